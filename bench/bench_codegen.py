@@ -0,0 +1,83 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Time the code generation stage of the demo forms with a number of worker processes.
+
+The generated code is checked to be the same for every number of
+workers. With --ir, the representation is also computed with the same
+number of processes and the time of both stages is reported.
+
+Usage: python bench_codegen.py [demo/HyperElasticity.ufl ...] [-n 1 2 4 8] [--ir]
+"""
+
+import argparse
+import pathlib
+import time
+
+import ufl
+import ffcx.parameters
+from ffcx.analysis import analyze_ufl_objects
+from ffcx.codegeneration.codegeneration import generate_code
+from ffcx.ir.representation import compute_ir
+
+demo_dir = pathlib.Path(__file__).parent.parent.joinpath("demo")
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("-n", "--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+parser.add_argument("--ir", action="store_true", help="also compute the representation in parallel")
+parser.add_argument("--repeat", type=int, default=3, help="number of timings to take the minimum of")
+parser.add_argument("ufl_file", nargs="*", default=sorted(str(f) for f in demo_dir.glob("*.ufl")))
+
+
+def load_forms(filename):
+    """Return the forms of a UFL file, executed with the UFL namespace."""
+    namespace = {}
+    exec("from ufl import *\n" + pathlib.Path(filename).read_text(), namespace)
+    return ufl.algorithms.formfiles.interpret_ufl_namespace(namespace).forms
+
+
+def time_stages(analysis, workers, ir_workers, repeat):
+    """Return the minimum time of the IR and code generation stages, and the generated code."""
+    parameters = ffcx.parameters.default_parameters()
+    parameters["ir_workers"] = ir_workers
+    parameters["codegen_workers"] = workers
+    timings = []
+    for i in range(repeat):
+        t = time.perf_counter()
+        ir = compute_ir(analysis, {}, "bench", parameters, False)
+        t_ir = time.perf_counter() - t
+        t = time.perf_counter()
+        code = generate_code(ir, parameters)
+        timings.append((t_ir, time.perf_counter() - t))
+    return min(t for t, _ in timings), min(t for _, t in timings), code
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    print("{:30} ".format("form file") + " ".join("{:>8}".format("n={}".format(n)) for n in args.workers))
+    totals = [0.0] * len(args.workers)
+    for filename in args.ufl_file:
+        name = pathlib.Path(filename).name
+        try:
+            forms = load_forms(filename)
+            if not forms:
+                continue
+            analysis = analyze_ufl_objects(forms, ffcx.parameters.default_parameters())
+            timings, codes = [], []
+            for n in args.workers:
+                t_ir, t_codegen, code = time_stages(analysis, n, n if args.ir else 0, args.repeat)
+                timings.append(t_codegen + t_ir if args.ir else t_codegen)
+                codes.append(code)
+        except Exception as e:
+            print("{:30} failed: {}".format(name, str(e).splitlines()[0]))
+            continue
+        assert all(code == codes[0] for code in codes)
+        totals = [total + t for total, t in zip(totals, timings)]
+        print("{:30} ".format(name) + " ".join("{:8.3f}".format(t) for t in timings))
+    print("{:30} ".format("total") + " ".join("{:8.3f}".format(t) for t in totals))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Time JIT compilation of the demo forms with the C source split in parts.
+
+Splitting only pays off with a processor per part, so the JIT functions
+compile a single part unless num_compile_parts is given.
+
+Usage: python bench_jit_parts.py [demo/HyperElasticity.ufl ...] [-n 1 2 4 8]
+"""
+
+import argparse
+import os
+import pathlib
+import tempfile
+import time
+
+import ufl
+import ffcx.codegeneration.jit
+
+demo_dir = pathlib.Path(__file__).parent.parent.joinpath("demo")
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("-n", "--num-parts", type=int, nargs="+", default=[1, 2, 4, 8])
+parser.add_argument("ufl_file", nargs="*", default=[str(demo_dir.joinpath(f)) for f in (
+    "HyperElasticity.ufl", "NavierStokes.ufl", "P5tet.ufl", "StabilisedStokes.ufl")])
+
+
+def load_forms(filename):
+    """Return the forms of a UFL file, executed with the UFL namespace."""
+    namespace = {}
+    exec("from ufl import *\n" + pathlib.Path(filename).read_text(), namespace)
+    return ufl.algorithms.formfiles.interpret_ufl_namespace(namespace).forms
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    print("{} processors".format(os.cpu_count()))
+    print("{:30} ".format("form file") + " ".join("{:>8}".format("n={}".format(n)) for n in args.num_parts))
+    for filename in args.ufl_file:
+        name = pathlib.Path(filename).name
+        timings = []
+        try:
+            forms = load_forms(filename)
+            if not forms:
+                continue
+            for n in args.num_parts:
+                with tempfile.TemporaryDirectory() as cache_dir:
+                    t = time.time()
+                    ffcx.codegeneration.jit.compile_forms(forms, cache_dir=cache_dir, num_compile_parts=n)
+                    timings.append(time.time() - t)
+                ffcx.codegeneration.jit.clear_loaded_modules()
+        except Exception as e:
+            print("{:30} failed: {}".format(name, str(e).splitlines()[0]))
+            continue
+        print("{:30} ".format(name) + " ".join("{:8.2f}".format(t) for t in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Time the IR stage of the demo forms with and without the cache of FIAT tabulations.
+
+The cache is emptied before each form file, so only the tabulations
+repeated within the forms of a file are reused.
+
+Usage: python bench_tabulation_cache.py [demo/HyperElasticity.ufl ...] [--repeat 3]
+"""
+
+import argparse
+import pathlib
+import time
+
+import ufl
+import ffcx.parameters
+from ffcx.analysis import analyze_ufl_objects
+from ffcx.ir.representation import compute_ir
+from ffcx.ir.uflacs.elementtables import tabulation_cache
+
+demo_dir = pathlib.Path(__file__).parent.parent.joinpath("demo")
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--repeat", type=int, default=3, help="number of timings to take the minimum of")
+parser.add_argument("ufl_file", nargs="*", default=sorted(str(f) for f in demo_dir.glob("*.ufl")))
+
+
+def load_forms(filename):
+    """Return the forms of a UFL file, executed with the UFL namespace."""
+    namespace = {}
+    exec("from ufl import *\n" + pathlib.Path(filename).read_text(), namespace)
+    return ufl.algorithms.formfiles.interpret_ufl_namespace(namespace).forms
+
+
+def time_ir(forms, maxsize, repeat):
+    """Return the minimum time of the IR stage, and the hits and misses of the cache."""
+    parameters = ffcx.parameters.default_parameters()
+    analysis = analyze_ufl_objects(forms, parameters)
+    timings = []
+    tabulation_cache.maxsize = maxsize
+    for i in range(repeat):
+        tabulation_cache.clear()
+        t = time.perf_counter()
+        compute_ir(analysis, {}, "bench", parameters, False)
+        timings.append(time.perf_counter() - t)
+    info = tabulation_cache.info()
+    return min(timings), info.hits, info.misses
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    maxsize = tabulation_cache.maxsize
+    print("{:30} {:>10} {:>10} {:>8} {:>9}".format("form file", "no cache", "cache", "speedup", "hit rate"))
+    total = [0.0, 0.0]
+    for filename in args.ufl_file:
+        name = pathlib.Path(filename).name
+        try:
+            forms = load_forms(filename)
+            if not forms:
+                continue
+            t0, hits, misses = time_ir(forms, 0, args.repeat)
+            t1, hits, misses = time_ir(forms, maxsize, args.repeat)
+        except Exception as e:
+            print("{:30} failed: {}".format(name, str(e).splitlines()[0]))
+            continue
+        total[0] += t0
+        total[1] += t1
+        print("{:30} {:10.3f} {:10.3f} {:8.2f} {:9.2f}".format(name, t0, t1, t0 / t1, hits / max(1, hits + misses)))
+    tabulation_cache.maxsize = maxsize
+    print("{:30} {:10.3f} {:10.3f} {:8.2f}".format("total", total[0], total[1], total[0] / max(total[1], 1e-12)))
+
+
+if __name__ == "__main__":
+    main()
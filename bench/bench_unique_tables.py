@@ -0,0 +1,75 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Time the deduplication of element tables against a pairwise scan of the unique tables.
+
+The tables are random, with each unique table repeated with
+perturbations within the tolerances, as for the tables of the
+derivatives and components of several coefficients.
+
+Usage: python bench_unique_tables.py [-n 100 1000 3000] [--duplicates 4]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from ffcx.ir.uflacs.elementtables import build_unique_tables, equal_tables
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("-n", "--num-tables", type=int, nargs="+", default=[100, 1000, 3000])
+parser.add_argument("--duplicates", type=int, default=4, help="number of copies of each unique table")
+parser.add_argument("--shape", type=int, nargs="+", default=[1, 1, 6, 10], help="shape of the tables")
+parser.add_argument("--rtol", type=float, default=1e-6)
+parser.add_argument("--atol", type=float, default=1e-9)
+
+
+def build_unique_tables_pairwise(tables, rtol, atol):
+    """Deduplicate tables comparing each with all unique tables found before."""
+    unique = []
+    mapping = {}
+    for k, t in enumerate(tables):
+        for i, u in enumerate(unique):
+            if equal_tables(u, t, rtol=rtol, atol=atol):
+                break
+        else:
+            i = len(unique)
+            unique.append(t)
+        mapping[k] = i
+    return unique, mapping
+
+
+def make_tables(n, duplicates, shape, rtol, atol):
+    """Return a shuffled list of n tables with n/duplicates unique tables."""
+    rng = np.random.RandomState(0)
+    unique = [rng.uniform(-1.0, 1.0, shape) for i in range(max(1, n // duplicates))]
+    tables = [unique[i % len(unique)] for i in range(n)]
+    tables = [t + 0.1 * atol * rng.uniform(-1.0, 1.0, shape) for t in tables]
+    rng.shuffle(tables)
+    return tables
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    print("{:>8} {:>8} {:>14} {:>14} {:>8}".format("tables", "unique", "pairwise (s)", "indexed (s)", "speedup"))
+    for n in args.num_tables:
+        tables = make_tables(n, args.duplicates, args.shape, args.rtol, args.atol)
+
+        t = time.perf_counter()
+        unique, mapping = build_unique_tables(tables, rtol=args.rtol, atol=args.atol)
+        t_indexed = time.perf_counter() - t
+
+        t = time.perf_counter()
+        reference = build_unique_tables_pairwise(tables, rtol=args.rtol, atol=args.atol)
+        t_pairwise = time.perf_counter() - t
+
+        assert mapping == reference[1]
+        print("{:8d} {:8d} {:14.4f} {:14.4f} {:8.1f}".format(
+            n, len(unique), t_pairwise, t_indexed, t_pairwise / t_indexed))
+
+
+if __name__ == "__main__":
+    main()
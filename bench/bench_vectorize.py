@@ -0,0 +1,132 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Time the cell integral kernels of the demo forms with and without the "vectorize" parameter.
+
+Both variants are compiled with the same compiler flags, which must enable
+the OpenMP SIMD pragmas for the vectorized code to differ.
+
+Usage: python bench_vectorize.py [demo/HyperElasticity.ufl ...] [--cflags -O2 -march=native -fopenmp-simd]
+"""
+
+import argparse
+import importlib
+import pathlib
+import sys
+import tempfile
+import time
+
+import cffi
+import numpy as np
+
+import ufl
+import ffcx.codegeneration
+import ffcx.codegeneration.jit
+from ffcx.fiatinterface import create_element
+
+demo_dir = pathlib.Path(__file__).parent.parent.joinpath("demo")
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--cflags", nargs="+", default=["-O2", "-march=native", "-fopenmp-simd"])
+parser.add_argument("--time", type=float, default=0.2, help="minimum time per kernel (seconds)")
+parser.add_argument("ufl_file", nargs="*", default=[str(demo_dir.joinpath(f)) for f in (
+    "HyperElasticity.ufl", "NavierStokes.ufl", "P5tet.ufl", "StabilisedStokes.ufl")])
+
+# Calls a tabulate_tensor repeatedly, to time the kernel without the
+# overhead of calling it from Python
+driver_source = """
+typedef double ufc_scalar_t;
+#include <ufc.h>
+
+void repeat(uintptr_t kernel, int n, double* A, const double* w, const double* c,
+            const double* coordinate_dofs)
+{
+  ufc_tabulate_tensor* tabulate_tensor = (ufc_tabulate_tensor*)kernel;
+  static const int entity_local_index[2] = {0};
+  static const uint8_t quadrature_permutation[2] = {0};
+  static const bool reflections[12] = {0};
+  static const uint8_t face_rotations[6] = {0};
+  for (int i = 0; i < n; ++i)
+    tabulate_tensor(A, w, c, coordinate_dofs, entity_local_index, quadrature_permutation,
+                    reflections, reflections, face_rotations);
+}
+"""
+
+
+def build_driver(build_dir, cflags):
+    ffi = cffi.FFI()
+    ffi.cdef("void repeat(uintptr_t kernel, int n, double* A, const double* w, const double* c, "
+             "const double* coordinate_dofs);")
+    ffi.set_source("_bench_vectorize_driver", driver_source,
+                   include_dirs=[ffcx.codegeneration.get_include_path()], extra_compile_args=cflags)
+    ffi.compile(tmpdir=build_dir)
+    sys.path.insert(0, build_dir)
+    return ffi, importlib.import_module("_bench_vectorize_driver").lib
+
+
+def kernel_data(form):
+    """Return arrays for A, w, c and coordinate_dofs of a cell integral of form."""
+    A_size = np.product([create_element(a.ufl_element()).space_dimension() for a in form.arguments()])
+    w_size = sum(create_element(f.ufl_element()).space_dimension() for f in form.coefficients())
+    c_size = sum(np.product(c.ufl_shape, dtype=int) for c in form.constants())
+
+    # Place the coordinate dofs on the reference cell
+    coordinate_element = create_element(form.ufl_domain().ufl_coordinate_element()).elements()[0]
+    points = [list(dof.get_point_dict().keys())[0] for dof in coordinate_element.dual_basis()]
+
+    return (np.zeros(A_size), np.random.rand(w_size), np.random.rand(c_size),
+            np.array(points, dtype=np.float64).flatten())
+
+
+def time_kernel(ffi, driver, integral, data, min_time):
+    """Return the time per call of a tabulate_tensor in microseconds."""
+    kernel = int(ffi.cast("uintptr_t", integral.tabulate_tensor))
+    pointers = [ffi.cast("double *", a.ctypes.data) for a in data]
+    n = 1
+    while True:
+        t = time.perf_counter()
+        driver.repeat(kernel, n, *pointers)
+        t = time.perf_counter() - t
+        if t > min_time:
+            return 1e6 * t / n
+        n *= 2
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    np.random.seed(0)
+    with tempfile.TemporaryDirectory() as build_dir:
+        ffi, driver = build_driver(build_dir, args.cflags)
+
+        print("{:30} {:>12} {:>12} {:>8}".format("form file", "scalar (us)", "vector (us)", "speedup"))
+        for filename in args.ufl_file:
+            forms = ufl.algorithms.load_ufl_file(filename).forms
+            forms = [form for form in forms if form.integrals_by_type("cell")]
+            if not forms:
+                continue
+
+            timings = []
+            for vectorize in (False, True):
+                with tempfile.TemporaryDirectory() as cache_dir:
+                    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+                        forms, parameters={"vectorize": vectorize}, cache_dir=cache_dir,
+                        cffi_extra_compile_args=args.cflags)
+                    t = 0.0
+                    for form, compiled_form in zip(forms, compiled_forms):
+                        data = kernel_data(form)
+                        ids = np.zeros(compiled_form.num_cell_integrals, dtype=np.int32)
+                        compiled_form.get_cell_integral_ids(ffi.cast("int *", ids.ctypes.data))
+                        for i in ids:
+                            integral = compiled_form.create_cell_integral(i)
+                            t += time_kernel(ffi, driver, integral, data, args.time)
+                    timings.append(t)
+                ffcx.codegeneration.jit.clear_loaded_modules()
+
+            print("{:30} {:12.2f} {:12.2f} {:8.2f}".format(
+                pathlib.Path(filename).name, timings[0], timings[1], timings[0] / timings[1]))
+
+
+if __name__ == "__main__":
+    main()
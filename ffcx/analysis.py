@@ -161,7 +161,7 @@ def _analyze_form(form: ufl.form.Form, parameters: typing.Dict) -> ufl.algorithm
         integral.metadata().get("representation", "auto") for integral in form.integrals())
 
     # Remove "auto" to see representations set by user
-    if parameters["representation"] in ("uflacs", "tsfc"):
+    if parameters["representation"] in ("uflacs", "tsfc", "tensor", "adaptive"):
         representation = parameters["representation"]
     elif len(representations - {"auto"}) == 1:
         # User has set just one
@@ -170,7 +170,7 @@ def _analyze_form(form: ufl.form.Form, parameters: typing.Dict) -> ufl.algorithm
         # If user didn't set any default to uflacs
         representation = "uflacs"
     else:
-        raise RuntimeError("Cannot mix uflacs and tsfc representations in a single form.")
+        raise RuntimeError("Cannot mix representations in a single form.")
 
     # Override representation with environment variable
     forced_r = os.environ.get("FFCX_FORCE_REPRESENTATION")
@@ -184,7 +184,7 @@ def _analyze_form(form: ufl.form.Form, parameters: typing.Dict) -> ufl.algorithm
     complex_mode = "complex" in parameters.get("scalar_type", "double")
 
     # Compute form metadata
-    if representation == "uflacs":
+    if representation in ("uflacs", "tensor", "adaptive"):
         form_data = ufl.algorithms.compute_form_data(
             form,
             do_apply_function_pullbacks=True,
@@ -205,6 +205,26 @@ def _analyze_form(form: ufl.form.Form, parameters: typing.Dict) -> ufl.algorithm
     # in form
     form_data.representation = representation
 
+    # Preprocess the form again for the kernels reading precomputed
+    # geometry, with the Jacobian determinant and inverse preserved as
+    # terminals instead of being expressed in terms of the Jacobian
+    form_data.geometry_integral_data = {}
+    if representation in ("uflacs", "tensor", "auto") and (
+            parameters.get("tabulate_geometry", False) or parameters.get("tabulate_fused", False)):
+        geometry_form_data = ufl.algorithms.compute_form_data(
+            form,
+            do_apply_function_pullbacks=True,
+            do_apply_integral_scaling=True,
+            do_apply_geometry_lowering=True,
+            preserve_geometry_types=(ufl.classes.Jacobian, ufl.classes.JacobianDeterminant,
+                                     ufl.classes.JacobianInverse),
+            do_apply_restrictions=True,
+            do_append_everywhere_integrals=False,
+            complex_mode=complex_mode)
+        form_data.geometry_integral_data = {
+            (itg_data.integral_type, itg_data.subdomain_id): itg_data
+            for itg_data in geometry_form_data.integral_data}
+
     # Determine unique quadrature degree, quadrature scheme and
     # precision per each integral data
     for integral_data in form_data.integral_data:
@@ -301,18 +321,27 @@ def _analyze_form(form: ufl.form.Form, parameters: typing.Dict) -> ufl.algorithm
         else:
             raise RuntimeError("Unable to determine quadrature degree.")
 
-        integral_data.metadata["quadrature_degree"] = qd
-        integral_data.metadata["quadrature_rule"] = qr
-        integral_data.metadata["precision"] = p
-
-        # Reconstruct integrals to avoid modifying the input integral,
-        # which would affect the signature computation if the integral
-        # was used again in the user program.  Modifying attributes of
-        # form_data.integral_data is less problematic since it's
-        # lifetime is internal to the form compiler pipeline.
-        for i, integral in enumerate(integral_data.integrals):
-            integral_data.integrals[i] = integral.reconstruct(
-                metadata={"quadrature_degree": qd, "quadrature_rule": qr, "precision": p})
+        # The integrals reading precomputed geometry use the same
+        # quadrature as the integrals they replace
+        geometry_integral_data = form_data.geometry_integral_data.get(
+            (integral_data.integral_type, integral_data.subdomain_id))
+
+        for itg_data in (integral_data, geometry_integral_data):
+            if itg_data is None:
+                continue
+
+            itg_data.metadata["quadrature_degree"] = qd
+            itg_data.metadata["quadrature_rule"] = qr
+            itg_data.metadata["precision"] = p
+
+            # Reconstruct integrals to avoid modifying the input integral,
+            # which would affect the signature computation if the integral
+            # was used again in the user program.  Modifying attributes of
+            # form_data.integral_data is less problematic since it's
+            # lifetime is internal to the form compiler pipeline.
+            for i, integral in enumerate(itg_data.integrals):
+                itg_data.integrals[i] = integral.reconstruct(
+                    metadata={"quadrature_degree": qd, "quadrature_rule": qr, "precision": p})
 
     return form_data
 
@@ -0,0 +1,214 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Command-line interface to the FFCX JIT cache.
+
+Inspect and maintain the cache of JIT compiled modules::
+
+    python -m ffcx.cache list
+    python -m ffcx.cache prune --max-age 30d --max-bytes 500M
+    python -m ffcx.cache clean
+    python -m ffcx.cache verify
+    python -m ffcx.cache warm forms.ufl
+"""
+
+import argparse
+import importlib.machinery
+import importlib.util
+import logging
+import pathlib
+import sys
+import time
+
+import ufl
+from ffcx.codegeneration import jit, jitcache
+
+logger = logging.getLogger(__name__)
+
+_size_units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+_age_units = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _parse_size(s):
+    """Parse a size in bytes with an optional K, M or G suffix."""
+    unit = s[-1].upper() if s[-1].isalpha() else ""
+    return int(float(s[:len(s) - len(unit)]) * _size_units[unit])
+
+
+def _parse_age(s):
+    """Parse an age in seconds with an optional s, m, h or d suffix."""
+    unit = s[-1].lower() if s[-1].isalpha() else ""
+    return float(s[:len(s) - len(unit)]) * _age_units[unit]
+
+
+def _format_size(size):
+    for unit in ("", "K", "M"):
+        if size < 1024:
+            return "{:.0f}{}".format(size, unit)
+        size /= 1024
+    return "{:.1f}G".format(size)
+
+
+def _format_age(seconds):
+    for unit, length in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= length:
+            return "{:.0f}{}".format(seconds / length, unit)
+    return "{:.0f}s".format(seconds)
+
+
+def _entry_kind(entry):
+    """Return "source" for cached generated code, "module" for compiled modules."""
+    return "source" if any(f.name.endswith(".ufc.c") for f in entry.files) else "module"
+
+
+def _entry_status(cache_dir, entry):
+    if entry.ready:
+        return "ready"
+    elif jitcache.build_in_progress(cache_dir, entry.module_name):
+        return "building"
+    elif any(f.name.endswith(".c.failed") for f in entry.files):
+        return "failed"
+    else:
+        return "stale"
+
+
+def _created(entry, default):
+    """Return the earliest creation time of the files of an entry, or default if they have been removed."""
+    times = []
+    for f in entry.files:
+        try:
+            times.append(f.stat().st_ctime)
+        except FileNotFoundError:
+            # Removed by another process since the entry was listed
+            pass
+    return min(times, default=default)
+
+
+def _module_library(cache_dir, module_name):
+    """Return the shared library of a compiled module, or None."""
+    for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+        library = cache_dir.joinpath(module_name + suffix)
+        if library.exists():
+            return library
+    return None
+
+
+def list_cache(args):
+    now = time.time()
+    entries = jitcache.list_entries(args.cache_dir)
+    print("{:<60} {:<6} {:<8} {:>8} {:>8} {:>9}".format("name", "kind", "status", "size", "age", "last use"))
+    for e in entries:
+        created = _created(e, now)
+        print("{:<60} {:<6} {:<8} {:>8} {:>8} {:>9}".format(
+            e.module_name, _entry_kind(e), _entry_status(args.cache_dir, e), _format_size(e.size),
+            _format_age(now - created), _format_age(now - e.last_used)))
+    print("{} entries, {} in {}".format(len(entries), _format_size(sum(e.size for e in entries)), args.cache_dir))
+    return 0
+
+
+def prune(args):
+    evicted = jitcache.evict(args.cache_dir, max_bytes=args.max_bytes, max_entries=args.max_entries,
+                             max_age=args.max_age, blocking=True)
+    for name in evicted:
+        print("Removed {}".format(name))
+    print("Removed {} entries".format(len(evicted)))
+    return 0
+
+
+def clean(args):
+    removed = jitcache.remove_stale(args.cache_dir)
+    for name in removed:
+        print("Removed {}".format(name))
+    print("Removed {} entries".format(len(removed)))
+    return 0
+
+
+def verify(args):
+    failed = []
+    for e in jitcache.list_entries(args.cache_dir):
+        if not e.ready or _entry_kind(e) != "module":
+            continue
+        library = _module_library(args.cache_dir, e.module_name)
+        try:
+            if library is None:
+                raise ImportError("Shared library not found")
+            loader = importlib.machinery.ExtensionFileLoader(e.module_name, str(library))
+            spec = importlib.util.spec_from_file_location(e.module_name, str(library), loader=loader)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        except ImportError as error:
+            print("{}: FAILED ({})".format(e.module_name, error))
+            failed.append(e.module_name)
+            if args.remove:
+                jitcache.remove_entry(args.cache_dir, e.module_name)
+        else:
+            print("{}: OK".format(e.module_name))
+
+    print("{} modules failed to load".format(len(failed)))
+    return 1 if failed and not args.remove else 0
+
+
+def warm(args):
+    for filename in args.ufl_file:
+        ufd = ufl.algorithms.load_ufl_file(filename)
+        if len(ufd.forms) > 0:
+            jit.compile_forms(ufd.forms, cache_dir=args.cache_dir, timeout=args.timeout)
+        if len(ufd.elements) > 0:
+            jit.compile_elements(ufd.elements, cache_dir=args.cache_dir, timeout=args.timeout)
+        print("Compiled {}".format(filename))
+    return 0
+
+
+parser = argparse.ArgumentParser(prog="python -m ffcx.cache", description="Manage the FFCX JIT cache")
+parser.add_argument("-v", "--verbosity", action="count", help="verbose output (-vv for more verbosity)")
+parser.add_argument("--cache-dir", type=pathlib.Path, default=None,
+                    help="cache directory (default \"{}\")".format(jitcache.default_cache_dir()))
+subparsers = parser.add_subparsers(dest="command")
+
+list_parser = subparsers.add_parser("list", help="list cached modules with their size, age and last use")
+list_parser.set_defaults(func=list_cache)
+
+prune_parser = subparsers.add_parser("prune", help="remove least recently used modules")
+prune_parser.add_argument("--max-age", type=_parse_age, default=None,
+                          help="remove modules not used for this long, e.g. 3600, 12h or 30d")
+prune_parser.add_argument("--max-bytes", type=_parse_size, default=0,
+                          help="remove modules until the cache is smaller than this, e.g. 500M")
+prune_parser.add_argument("--max-entries", type=int, default=0,
+                          help="remove modules until there are at most this many")
+prune_parser.set_defaults(func=prune)
+
+clean_parser = subparsers.add_parser("clean", help="remove failed builds and builds abandoned by dead processes")
+clean_parser.set_defaults(func=clean)
+
+verify_parser = subparsers.add_parser("verify", help="check that each compiled module loads")
+verify_parser.add_argument("--remove", action="store_true", help="remove modules that fail to load")
+verify_parser.set_defaults(func=verify)
+
+warm_parser = subparsers.add_parser("warm", help="compile the forms and elements in UFL files into the cache")
+warm_parser.add_argument("--timeout", type=float, default=600, help="timeout waiting for other processes (seconds)")
+warm_parser.add_argument("ufl_file", nargs="+", help="UFL file(s) to be compiled")
+warm_parser.set_defaults(func=warm)
+
+
+def main(args=None):
+    xargs = parser.parse_args(args)
+    if xargs.command is None:
+        parser.print_help()
+        return 1
+
+    ffcx_logger = logging.getLogger("ffcx")
+    if xargs.verbosity == 1:
+        ffcx_logger.setLevel(logging.INFO)
+    if xargs.verbosity == 2:
+        ffcx_logger.setLevel(logging.DEBUG)
+
+    if xargs.cache_dir is None:
+        xargs.cache_dir = jitcache.default_cache_dir()
+
+    return xargs.func(xargs)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
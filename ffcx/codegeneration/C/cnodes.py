@@ -736,7 +736,7 @@ class FlattenedArray(object):
             # Handle scalar case, allowing dims=() and indices=() for A[0]
             if len(self.strides) != 0:
                 raise ValueError("Empty indices for nonscalar array.")
-            flat = LiteralInt(0)
+            flat = LiteralInt(0) if self.offset is None else self.offset
         else:
             i, s = (indices[0], self.strides[0])
             literal_one = LiteralInt(1)
@@ -1484,7 +1484,12 @@ class Switch(CStatement):
 
 
 class ForRange(CStatement):
-    """Slightly higher-level for loop assuming incrementing an index over a range."""
+    """Slightly higher-level for loop assuming incrementing an index over a range.
+
+    If vectorize is set the loop is marked with "#pragma omp simd",
+    followed by the clauses given if vectorize is a string, e.g.
+    "reduction(+:s)".
+    """
 
     __slots__ = ("index", "begin", "end", "body", "pragma", "index_type")
     is_scoped = True
@@ -1495,7 +1500,9 @@ class ForRange(CStatement):
         self.end = as_cexpr(end)
         self.body = as_cstatement(body)
 
-        if vectorize:
+        if isinstance(vectorize, str):
+            pragma = Pragma("omp simd " + vectorize)
+        elif vectorize:
             pragma = Pragma("omp simd")
         else:
             pragma = None
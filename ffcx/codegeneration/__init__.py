@@ -4,7 +4,7 @@ import hashlib
 # Version of FFC header files
 __author__ = "FEniCS Project"
 __license__ = "This code is released into the public domain"
-__version__ = "2018.2.0.dev0"
+__version__ = "2018.3.0.dev0"
 
 # Get abspath on import, it can in some cases be a relative path w.r.t.
 # curdir on startup
@@ -32,6 +32,8 @@ class FFCXBackendAccess(object):
         self.call_lookup = {ufl.coefficient.Coefficient: self.coefficient,
                             ufl.constant.Constant: self.constant,
                             ufl.geometry.Jacobian: self.jacobian,
+                            ufl.geometry.JacobianDeterminant: self.jacobian_determinant,
+                            ufl.geometry.JacobianInverse: self.jacobian_inverse,
                             ufl.geometry.CellCoordinate: self.cell_coordinate,
                             ufl.geometry.FacetCoordinate: self.facet_coordinate,
                             ufl.geometry.CellVertices: self.cell_vertices,
@@ -186,6 +188,20 @@ class FFCXBackendAccess(object):
             raise RuntimeError("Not expecting average of Jacobian.")
         return self.symbols.J_component(mt)
 
+    def jacobian_determinant(self, e, mt, tabledata, num_points):
+        if mt.global_derivatives or mt.local_derivatives:
+            raise RuntimeError("Not expecting derivatives of Jacobian determinant.")
+        if mt.averaged:
+            raise RuntimeError("Not expecting average of Jacobian determinant.")
+        return self.symbols.detJ_component(mt)
+
+    def jacobian_inverse(self, e, mt, tabledata, num_points):
+        if mt.global_derivatives or mt.local_derivatives:
+            raise RuntimeError("Not expecting derivatives of Jacobian inverse.")
+        if mt.averaged:
+            raise RuntimeError("Not expecting average of Jacobian inverse.")
+        return self.symbols.K_component(mt)
+
     def reference_cell_volume(self, e, mt, tabledata, access):
         L = self.language
         cellname = mt.terminal.ufl_domain().ufl_cell().cellname()
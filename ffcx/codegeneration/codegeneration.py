@@ -11,52 +11,75 @@ UFC function from an intermediate representation (IR).
 
 """
 
+import itertools
 import logging
 from collections import namedtuple
 
+from ffcx import parallel, telemetry
 from ffcx.codegeneration.finite_element import generator as finite_element_generator
 from ffcx.codegeneration.coordinate_mapping import \
     generator as coordinate_mapping_generator
 from ffcx.codegeneration.dofmap import generator as dofmap_generator
 from ffcx.codegeneration.form import generator as form_generator
 from ffcx.codegeneration.integrals import generator as integral_generator
+from ffcx.codegeneration.integrals import fused_generator as fused_integral_generator
 from ffcx.codegeneration.expressions import generator as expression_generator
 
 logger = logging.getLogger(__name__)
 
 code_blocks = namedtuple("code_blocks", ["elements", "dofmaps",
                                          "coordinate_mappings", "integrals",
-                                         "forms", "expressions"])
+                                         "fused_integrals", "forms", "expressions"])
 
 
 def generate_code(ir, parameters):
-    """Generate code blocks from intermediate representation."""
+    """Generate code blocks from intermediate representation.
 
-    logger.debug("Compiler stage 4: Generating code")
-
-    # Generate code for finite_elements
-    logger.debug("Generating code for {} finite_element(s)".format(len(ir.elements)))
-    code_finite_elements = [finite_element_generator(element_ir, parameters) for element_ir in ir.elements]
-
-    # Generate code for dofmaps
-    logger.debug("Generating code for {} dofmap(s)".format(len(ir.dofmaps)))
-    code_dofmaps = [dofmap_generator(dofmap_ir, parameters) for dofmap_ir in ir.dofmaps]
-
-    # Generate code for coordinate_mappings
-    logger.debug("Generating code for {} coordinate_mapping(s)".format(len(ir.coordinate_mappings)))
-    code_coordinate_mappings = [coordinate_mapping_generator(cmap_ir, parameters) for cmap_ir in ir.coordinate_mappings]
+    With ``parameters["codegen_workers"]`` greater than 1, and at least
+    as many IR objects as workers, the code for the IR objects is
+    generated by a pool of processes. The code blocks
+    are collected in the order of the IR objects, so the generated code
+    is the same as when it is generated in this process.
+    """
 
-    # Generate code for integrals
-    logger.debug("Generating code for integrals")
-    code_integrals = [integral_generator(integral_ir, parameters) for integral_ir in ir.integrals]
-
-    # Generate code for forms
-    logger.debug("Generating code for forms")
-    code_forms = [form_generator(form_ir, parameters) for form_ir in ir.forms]
-
-    logger.debug("Generating code for expressions")
-    code_expressions = [expression_generator(expression_ir, parameters) for expression_ir in ir.expressions]
+    logger.debug("Compiler stage 4: Generating code")
 
-    return code_blocks(elements=code_finite_elements, dofmaps=code_dofmaps,
-                       coordinate_mappings=code_coordinate_mappings, integrals=code_integrals,
-                       forms=code_forms, expressions=code_expressions)
+    generators = [(finite_element_generator, ir.elements), (dofmap_generator, ir.dofmaps),
+                  (coordinate_mapping_generator, ir.coordinate_mappings),
+                  (_generate_integral_code, ir.integrals), (fused_integral_generator, ir.fused_integrals),
+                  (form_generator, ir.forms), (expression_generator, ir.expressions)]
+    jobs = [(generator, obj_ir) for generator, irs in generators for obj_ir in irs]
+
+    workers = parameters.get("codegen_workers", 0)
+    if parallel.use_pool(len(jobs), workers):
+        logger.debug("Generating code for {} objects with {} processes".format(len(jobs), workers))
+        futures = [parallel.process_pool(workers).submit(_generate_code_collect, generator, obj_ir, parameters)
+                   for generator, obj_ir in jobs]
+        code = []
+        for future in futures:
+            obj_code, record = future.result()
+            telemetry.merge(record)
+            code.append(obj_code)
+    else:
+        code = [generator(obj_ir, parameters) for generator, obj_ir in jobs]
+
+    # Split the code into blocks of the IR objects of each kind
+    offsets = list(itertools.accumulate(len(irs) for generator, irs in generators))
+    blocks = [code[begin:end] for begin, end in zip([0] + offsets, offsets)]
+    return code_blocks(*blocks)
+
+
+def _generate_integral_code(integral_ir, parameters):
+    """Generate code for an integral, recording its time and size in the telemetry."""
+    record = telemetry.integral_record(integral_ir.name)
+    with telemetry.timer("codegen", record):
+        code = integral_generator(integral_ir, parameters)
+    telemetry.add("source_size", sum(len(c) for c in code), record)
+    return code
+
+
+def _generate_code_collect(generator, obj_ir, parameters):
+    """Generate code for an IR object in a worker process, with its telemetry."""
+    with telemetry.collect({}) as record:
+        code = generator(obj_ir, parameters)
+    return code, record
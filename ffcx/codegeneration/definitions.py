@@ -43,6 +43,8 @@ class FFCXBackendDefinitions(object):
         self.call_lookup = {ufl.coefficient.Coefficient: self.coefficient,
                             ufl.constant.Constant: self.constant,
                             ufl.geometry.Jacobian: self.jacobian,
+                            ufl.geometry.JacobianDeterminant: self._expect_precomputed,
+                            ufl.geometry.JacobianInverse: self._expect_precomputed,
                             ufl.geometry.CellVertices: self._expect_physical_coords,
                             ufl.geometry.FacetEdgeVectors: self._expect_physical_coords,
                             ufl.geometry.CellEdgeVectors: self._expect_physical_coords,
@@ -57,6 +59,14 @@ class FFCXBackendDefinitions(object):
                             ufl.geometry.SpatialCoordinate: self.spatial_coordinate}
 
     def get(self, t, mt, tabledata, num_points, access):
+        # Read modified terminals with precomputed values at the
+        # quadrature points
+        value = self.symbols.precomputed_access(mt, num_points)
+        if value is not None:
+            if isinstance(t, ufl.coefficient.Coefficient):
+                return [self.language.VariableDecl("const ufc_scalar_t", access, value)]
+            return [self.language.VariableDecl("const double", access, value)]
+
         # Call appropriate handler, depending on the type of t
         ttype = type(t)
         handler = self.call_lookup.get(ttype, False)
@@ -112,9 +122,15 @@ class FFCXBackendDefinitions(object):
             # Loop to accumulate linear combination of dofs and tables
             ic = self.symbols.coefficient_dof_sum_index()
             dof_access = self.symbols.coefficient_dof_access(mt.terminal, ic + begin)
+            # Batch kernels vectorize the loop over cells instead
+            if self.ir.params["vectorize"] and self.symbols.batch_cell is None:
+                vectorize = "reduction(+:{})".format(access.ce_format())
+            else:
+                vectorize = None
             code = [
                 L.VariableDecl("ufc_scalar_t", access, 0.0),
-                L.ForRange(ic, 0, end - begin, body=[L.AssignAdd(access, dof_access * FE[ic])])
+                L.ForRange(ic, 0, end - begin, body=[L.AssignAdd(access, dof_access * FE[ic])],
+                           vectorize=vectorize)
             ]
         return code
 
@@ -184,6 +200,10 @@ class FFCXBackendDefinitions(object):
         # TODO: Jacobian may need adjustment for custom_integral_types
         return self._define_coordinate_dofs_lincomb(e, mt, tabledata, num_points, access)
 
+    def _expect_precomputed(self, e, mt, tabledata, num_points, access):
+        """The Jacobian determinant and inverse are terminals only when read from precomputed values."""
+        raise RuntimeError("Expecting {} to be expressed in terms of the Jacobian.".format(type(e).__name__))
+
     def _expect_table(self, e, mt, tabledata, num_points, access):
         """These quantities refer to constant tables defined in ufc_geometry.h."""
         # TODO: Inject const static table here instead?
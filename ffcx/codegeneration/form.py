@@ -157,6 +157,11 @@ class UFCForm:
 
         return L.StatementList(code)
 
+    def create_fused_cell_integral(self, L, ir):
+        subdomain_ids, classnames = ir.create_fused_cell_integral
+        subdomain_id = L.Symbol("subdomain_id")
+        return generate_return_new_switch(L, subdomain_id, classnames, subdomain_ids)
+
     # This group of functions are repeated for each foo_integral by
     # add_ufc_form_integral_methods:
 
@@ -225,6 +230,7 @@ def generator(ir, parameters):
         L, ir, parameters)
     d["create_vertex_integral"] = generator.create_vertex_integral(L, ir, parameters)
     d["create_custom_integral"] = generator.create_custom_integral(L, ir, parameters)
+    d["create_fused_cell_integral"] = generator.create_fused_cell_integral(L, ir)
 
     # Check that no keys are redundant or have been missed
     from string import Formatter
@@ -110,6 +110,11 @@ void get_custom_integral_ids_{factory_name}(int *ids)
   {get_custom_integral_ids}
 }}
 
+ufc_fused_integral* create_fused_cell_integral_{factory_name}(int subdomain_id)
+{{
+  {create_fused_cell_integral}
+}}
+
 ufc_form* create_{factory_name}(void)
 {{
   ufc_form* form = malloc(sizeof(*form));
@@ -145,6 +150,8 @@ ufc_form* create_{factory_name}(void)
   form->create_vertex_integral = create_vertex_integral_{factory_name};
   form->create_custom_integral = create_custom_integral_{factory_name};
 
+  form->create_fused_cell_integral = create_fused_cell_integral_{factory_name};
+
   return form;
 }}
 
@@ -7,7 +7,9 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with UFLACS. If not, see <http://www.gnu.org/licenses/>.
 
+import ufl
 from ffcx.codegeneration import integrals_template as ufc_integrals
+from ffcx.codegeneration.utils import has_dof_reflections
 
 
 def generator(ir, parameters):
@@ -21,7 +23,7 @@ def generator(ir, parameters):
     else:
         declaration = ufc_integrals.declaration.format(factory_name=factory_name)
 
-    if ir.representation == "uflacs":
+    if ir.representation in ("uflacs", "tensor"):
         from ffcx.codegeneration.integrals_generator import generate_integral_code
     elif ir.representation == "tsfc":
         from ffcx.codegeneration.tsfcgenerator import generate_integral_code
@@ -37,6 +39,104 @@ def generator(ir, parameters):
     tabulate_tensor_fn = tabulate_tensor_declaration.format(
         factory_name=factory_name, tabulate_tensor=code["tabulate_tensor"])
 
+    # Format batch tabulate tensor, for cell integrals which do not
+    # depend on the orientation of the cell entities
+    if _has_batch_kernel(ir):
+        from ffcx.codegeneration.integrals_generator import generate_integral_batch_code
+        tabulate_tensor_batch_fn = ufc_integrals.tabulate_batch_implementation.format(
+            factory_name=factory_name,
+            tabulate_tensor=generate_integral_batch_code(ir, parameters))
+        tabulate_tensor_batch = "tabulate_tensor_batch_" + factory_name
+    else:
+        tabulate_tensor_batch_fn = ""
+        tabulate_tensor_batch = "NULL"
+
+    # Format the action kernel of bilinear integrals
+    if ir.representation in ("uflacs", "tensor") and ir.action_ir is not None:
+        from ffcx.codegeneration.integrals_generator import generate_integral_action_code
+        tabulate_action_fn = ufc_integrals.tabulate_action_implementation.format(
+            factory_name=factory_name,
+            entity_local_index=ufc_integrals.entity_local_index[integral_type],
+            tabulate_action=generate_integral_action_code(ir, parameters))
+        tabulate_action = "tabulate_action_" + factory_name
+    else:
+        tabulate_action_fn = ""
+        tabulate_action = "NULL"
+
+    # Format the diagonal kernel of bilinear integrals, with the
+    # signature of tabulate_tensor
+    if _has_diagonal_kernel(ir):
+        from ffcx.codegeneration.integrals_generator import generate_integral_diagonal_code
+        tabulate_diagonal_fn = tabulate_tensor_declaration.format(
+            factory_name="diagonal_" + factory_name,
+            tabulate_tensor=generate_integral_diagonal_code(ir, parameters))
+        tabulate_diagonal = "tabulate_tensor_diagonal_" + factory_name
+    else:
+        tabulate_diagonal_fn = ""
+        tabulate_diagonal = "NULL"
+
+    # Format the packed kernel of symmetric bilinear integrals, with
+    # the signature of tabulate_tensor
+    if _has_packed_kernel(ir):
+        from ffcx.codegeneration.integrals_generator import generate_integral_packed_code
+        tabulate_packed_fn = tabulate_tensor_declaration.format(
+            factory_name="packed_" + factory_name,
+            tabulate_tensor=generate_integral_packed_code(ir, parameters))
+        tabulate_packed = "tabulate_tensor_packed_" + factory_name
+    else:
+        tabulate_packed_fn = ""
+        tabulate_packed = "NULL"
+
+    # Format the blocks of the element tensor with nonzero entries,
+    # and the compact kernel tabulating them only
+    block_sparsity = ir.block_sparsity if ir.representation in ("uflacs", "tensor") else None
+    if block_sparsity is None:
+        num_nonzero_blocks = -1
+        nonzero_blocks = "NULL"
+        nonzero_blocks_array = ""
+    elif not block_sparsity["nonzero_blocks"]:
+        num_nonzero_blocks = 0
+        nonzero_blocks = "NULL"
+        nonzero_blocks_array = ""
+    else:
+        num_nonzero_blocks = len(block_sparsity["nonzero_blocks"])
+        nonzero_blocks = "nonzero_blocks_" + factory_name
+        values = [k for block in block_sparsity["nonzero_blocks"] for k in block]
+        nonzero_blocks_array = "static const int {}[{}] = {{{}}};".format(
+            nonzero_blocks, len(values), ", ".join(str(k) for k in values))
+
+    if _has_compact_kernel(ir):
+        from ffcx.codegeneration.integrals_generator import (compact_block_offsets,
+                                                             generate_integral_compact_code)
+        tabulate_compact_fn = nonzero_blocks_array + "\n" + tabulate_tensor_declaration.format(
+            factory_name="compact_" + factory_name,
+            tabulate_tensor=generate_integral_compact_code(ir, parameters))
+        tabulate_compact = "tabulate_tensor_compact_" + factory_name
+        compact_size = compact_block_offsets(block_sparsity)[1]
+    else:
+        tabulate_compact_fn = nonzero_blocks_array
+        tabulate_compact = "NULL"
+        compact_size = 0
+
+    # Format the geometry kernel of cell integrals and the
+    # tabulate_tensor reading the geometry it computes
+    if ir.representation in ("uflacs", "tensor") and ir.geometry_ir is not None and ir.params["tabulate_geometry"]:
+        from ffcx.codegeneration.integrals_generator import generate_integral_geometry_code
+        tabulate_geometry_code, tabulate_tensor_code = generate_integral_geometry_code(ir, parameters)
+        tabulate_geometry_fn = ufc_integrals.tabulate_geometry_implementation.format(
+            factory_name=factory_name,
+            tabulate_geometry=tabulate_geometry_code,
+            tabulate_tensor=tabulate_tensor_code)
+        tabulate_geometry = "tabulate_geometry_" + factory_name
+        geometry_size = ir.geometry_ir["geometry_num_points"] * \
+            ufl.product(ir.geometry_ir["geometry_expression"]["expression_shape"])
+        tabulate_tensor_geometry = "tabulate_tensor_geometry_" + factory_name
+    else:
+        tabulate_geometry_fn = ""
+        tabulate_geometry = "NULL"
+        geometry_size = 0
+        tabulate_tensor_geometry = "NULL"
+
     # Format implementation code
 
     if integral_type == "custom":
@@ -48,6 +148,113 @@ def generator(ir, parameters):
         implementation = ufc_integrals.factory.format(
             factory_name=factory_name,
             enabled_coefficients=code["enabled_coefficients"],
-            tabulate_tensor=tabulate_tensor_fn)
+            tabulate_tensor=tabulate_tensor_fn,
+            tabulate_tensor_batch_fn=tabulate_tensor_batch_fn,
+            tabulate_tensor_batch=tabulate_tensor_batch,
+            tabulate_action_fn=tabulate_action_fn,
+            tabulate_action=tabulate_action,
+            tabulate_diagonal_fn=tabulate_diagonal_fn,
+            tabulate_diagonal=tabulate_diagonal,
+            tabulate_packed_fn=tabulate_packed_fn,
+            tabulate_packed=tabulate_packed,
+            num_nonzero_blocks=num_nonzero_blocks,
+            nonzero_blocks=nonzero_blocks,
+            tabulate_compact_fn=tabulate_compact_fn,
+            tabulate_compact=tabulate_compact,
+            compact_size=compact_size,
+            tabulate_geometry_fn=tabulate_geometry_fn,
+            tabulate_geometry=tabulate_geometry,
+            geometry_size=geometry_size,
+            tabulate_tensor_geometry=tabulate_tensor_geometry)
 
     return declaration, implementation
+
+
+def fused_generator(ir, parameters):
+    """Generate UFC code for the cell integrals of several forms fused into one kernel."""
+    from ffcx.codegeneration.integrals_generator import generate_fused_integral_code
+
+    declaration = ufc_integrals.fused_declaration.format(factory_name=ir.name)
+    implementation = ufc_integrals.fused_factory.format(
+        factory_name=ir.name,
+        num_forms=ir.num_forms,
+        tabulate_tensor=generate_fused_integral_code(ir, parameters))
+
+    return declaration, implementation
+
+
+def _has_batch_kernel(ir):
+    """Check if a batch tabulate_tensor is generated for the integral."""
+    if ir.representation not in ("uflacs", "tensor") or ir.integral_type != "cell":
+        return False
+    if not ir.params["tabulate_tensor_batch"]:
+        return False
+    # Reflections of dofs differ from cell to cell
+    return not has_dof_reflections(ir.element_dof_reflection_entities)
+
+
+def _has_diagonal_kernel(ir):
+    """Check if a diagonal tabulate_tensor is generated for the integral."""
+    if ir.representation not in ("uflacs", "tensor") or ir.integral_type in ufl.custom_integral_types:
+        return False
+    if not ir.params["tabulate_diagonal"] or ir.rank != 2 or ir.tensor_shape[0] != ir.tensor_shape[1]:
+        return False
+
+    from ffcx.codegeneration.integrals_generator import diagonal_block_entries
+    varying_irs = [(num_points, ir.varying_irs[num_points]) for num_points in ir.all_num_points]
+    for num_points, expr_ir in [(None, ir.piecewise_ir)] + varying_irs:
+        for blockmap, contributions in expr_ir["block_contributions"].items():
+            for blockdata in contributions:
+                # Quadrature elements index the blocks by the quadrature
+                # point
+                if "quadrature" in blockdata.ttypes:
+                    return False
+                # Sum factorization computes the diagonal of blocks of
+                # arguments with the same dofs and factors only
+                if blockdata.block_mode == "factorized" and diagonal_block_entries(blockmap):
+                    tensor_factors = expr_ir["tensor_factors"]
+                    shapes = [[ir.unique_tables[name].shape for name in tensor_factors[mad.tabledata.name]]
+                              for mad in blockdata.ma_data]
+                    if blockmap[0] != blockmap[1] or shapes[0] != shapes[1]:
+                        return False
+    return True
+
+
+def _has_compact_kernel(ir):
+    """Check if a compact tabulate_tensor is generated for the integral."""
+    if ir.representation not in ("uflacs", "tensor") or ir.integral_type in ufl.custom_integral_types:
+        return False
+    if not ir.params["tabulate_compact"] or ir.block_sparsity is None:
+        return False
+
+    # Skip integrals without zero blocks
+    offsets = ir.block_sparsity["offsets"]
+    if len(ir.block_sparsity["nonzero_blocks"]) == ufl.product([len(o) - 1 for o in offsets]):
+        return False
+
+    # The blocks of the factorization must not span several sub-spaces
+    from ffcx.codegeneration.integrals_generator import blockmap_subspaces
+    varying_irs = [ir.varying_irs[num_points] for num_points in ir.all_num_points]
+    for expr_ir in [ir.piecewise_ir] + varying_irs:
+        for blockmap in expr_ir["block_contributions"]:
+            if blockmap_subspaces(blockmap, offsets) is None:
+                return False
+    return True
+
+
+def _has_packed_kernel(ir):
+    """Check if a packed tabulate_tensor is generated for the integral."""
+    if ir.representation not in ("uflacs", "tensor") or ir.integral_type in ufl.custom_integral_types:
+        return False
+    if not ir.params["tabulate_packed"] or ir.rank != 2 or ir.tensor_shape[0] != ir.tensor_shape[1]:
+        return False
+
+    # The element matrix is symmetric if all blocks are symmetric or
+    # added together with their transpose
+    varying_irs = [ir.varying_irs[num_points] for num_points in ir.all_num_points]
+    for expr_ir in [ir.piecewise_ir] + varying_irs:
+        for contributions in expr_ir["block_contributions"].values():
+            for blockdata in contributions:
+                if blockdata.symmetry not in ("symmetric", "mirrored"):
+                    return False
+    return True
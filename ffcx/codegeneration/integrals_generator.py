@@ -5,6 +5,7 @@
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 """Controlling algorithm for building the tabulate_tensor source structure from factorized representation."""
 
+import bisect
 import collections
 import itertools
 import logging
@@ -13,9 +14,12 @@ import ufl
 from ffcx.codegeneration.backend import FFCXBackend
 from ffcx.codegeneration.C.cnodes import pad_dim, pad_innermost_dim
 from ffcx.codegeneration.C.format_lines import format_indented_lines
+from ffcx.codegeneration.expressions_generator import ExpressionGenerator
+from ffcx.ir.representation import ir_expression
 from ffcx.ir.representationutils import initialize_integral_code
 from ffcx.ir.uflacs.elementtables import piecewise_ttypes
-from ffcx.codegeneration.utils import get_vector_reflection_array, get_vector_reflection, get_table_dofmap_array
+from ffcx.codegeneration.utils import (get_vector_reflection_array, get_vector_reflection,
+                                       get_table_dofmap_array, has_dof_reflections)
 
 logger = logging.getLogger(__name__)
 
@@ -44,8 +48,184 @@ def generate_integral_code(ir, parameters):
     return code
 
 
+def generate_integral_batch_code(ir, parameters):
+    """Generate the body of the batch tabulate_tensor from intermediate representation."""
+
+    logger.info("Generating batch code from ffcx.ir.uflacs representation")
+
+    backend = FFCXBackend(ir, parameters)
+    L = backend.language
+    backend.symbols.set_batch(L.Symbol("cell"), L.Symbol("num_cells"))
+
+    ig = IntegralGenerator(ir, backend)
+    parts = ig.generate()
+
+    return format_indented_lines(parts.cs_format(ir.precision), 1)
+
+
+def generate_integral_action_code(ir, parameters):
+    """Generate the body of the action kernel of a bilinear integral from intermediate representation."""
+
+    logger.info("Generating action code from ffcx.ir.uflacs representation")
+
+    action_ir = dict(ir.action_ir)
+    action_coefficient = action_ir.pop("action_coefficient")
+    ir = ir._replace(action_ir=None, **action_ir)
+
+    backend = FFCXBackend(ir, parameters)
+    backend.symbols.set_action(action_coefficient)
+
+    ig = IntegralGenerator(ir, backend)
+    parts = ig.generate()
+
+    return format_indented_lines(parts.cs_format(ir.precision), 1)
+
+
+def generate_integral_diagonal_code(ir, parameters):
+    """Generate the body of the diagonal kernel of a bilinear integral from intermediate representation."""
+
+    logger.info("Generating diagonal code from ffcx.ir.uflacs representation")
+
+    ir = ir._replace(tensor_shape=ir.tensor_shape[:1])
+    backend = FFCXBackend(ir, parameters)
+
+    ig = IntegralGenerator(ir, backend, diagonal=True)
+    parts = ig.generate()
+
+    return format_indented_lines(parts.cs_format(ir.precision), 1)
+
+
+def generate_integral_packed_code(ir, parameters):
+    """Generate the body of the packed kernel of a symmetric bilinear integral from intermediate representation."""
+
+    logger.info("Generating packed code from ffcx.ir.uflacs representation")
+
+    n = ir.tensor_shape[0]
+    ir = ir._replace(tensor_shape=(n * (n + 1) // 2, ))
+    backend = FFCXBackend(ir, parameters)
+
+    ig = IntegralGenerator(ir, backend, packed=n)
+    parts = ig.generate()
+
+    return format_indented_lines(parts.cs_format(ir.precision), 1)
+
+
+def generate_integral_geometry_code(ir, parameters):
+    """Generate the bodies of the geometry kernel of a cell integral and of the tabulate_tensor reading its output."""
+
+    logger.info("Generating precomputed geometry code from ffcx.ir.uflacs representation")
+
+    geometry_ir = dict(ir.geometry_ir)
+    expression_ir = ir_expression(name=ir.name, **geometry_ir.pop("geometry_expression"))
+    components = geometry_ir.pop("geometry_components")
+    point_offsets = geometry_ir.pop("geometry_point_offsets")
+    num_points = geometry_ir.pop("geometry_num_points")
+
+    # The geometry is evaluated by an expression kernel at the
+    # quadrature points of all rules
+    backend = FFCXBackend(expression_ir, parameters)
+    eg = ExpressionGenerator(expression_ir, backend)
+    parts = eg.generate()
+    geometry_body = format_indented_lines(parts.cs_format(ir.precision), 1)
+
+    ir = ir._replace(action_ir=None, geometry_ir=None, **geometry_ir)
+    backend = FFCXBackend(ir, parameters)
+    backend.symbols.set_precomputed("geometry", components, point_offsets, num_points)
+
+    ig = IntegralGenerator(ir, backend)
+    parts = ig.generate()
+
+    return geometry_body, format_indented_lines(parts.cs_format(ir.precision), 1)
+
+
+def generate_fused_integral_code(ir, parameters):
+    """Generate the body of the tabulate_tensor of the cell integrals of several forms fused into one kernel."""
+
+    logger.info("Generating fused integral code from ffcx.ir.uflacs representation")
+
+    expression_ir = ir_expression(name=ir.name, **ir.expression)
+    backend = FFCXBackend(expression_ir, parameters)
+    L = backend.language
+    A_forms = L.Symbol("A_forms")
+    w_forms = L.Symbol("w_forms")
+    c_forms = L.Symbol("c_forms")
+
+    parts = []
+
+    # Pack the coefficients of the precomputed values
+    if ir.packed_coefficients:
+        w = L.Symbol("w")
+        i = L.Symbol("i")
+        size = sum(coefficient[3] for coefficient in ir.packed_coefficients)
+        parts += [L.ArrayDecl("ufc_scalar_t", w, size)]
+        for form_index, form_offset, offset, size in ir.packed_coefficients:
+            parts += [L.ForRange(i, 0, size, body=L.Assign(w[offset + i], w_forms[form_index][form_offset + i]))]
+
+    # Evaluate the values shared by the forms at the quadrature points
+    # of all rules
+    values = L.Symbol("values")
+    parts += [L.ArrayDecl("ufc_scalar_t", values, ir.num_points * ufl.product(expression_ir.expression_shape))]
+    eg = ExpressionGenerator(expression_ir, backend)
+    parts += [L.Scope([L.VariableDecl("ufc_scalar_t* restrict", "A", values), eg.generate()])]
+
+    # Tabulate the tensor of each form reading the values
+    for k, integral_ir in enumerate(ir.integrals):
+        backend = FFCXBackend(integral_ir, parameters)
+        backend.symbols.set_precomputed("values", ir.components[k], ir.point_offsets, ir.num_points)
+        ig = IntegralGenerator(integral_ir, backend)
+        parts += [L.Scope([L.VariableDecl("ufc_scalar_t* restrict", "A", A_forms[k]),
+                           L.VariableDecl("const ufc_scalar_t*", "w", w_forms[k]),
+                           L.VariableDecl("const ufc_scalar_t*", "c", c_forms[k]),
+                           ig.generate()])]
+
+    return format_indented_lines(L.StatementList(parts).cs_format(ir.precision), 1)
+
+
+def generate_integral_compact_code(ir, parameters):
+    """Generate the body of the compact kernel of an integral from intermediate representation."""
+
+    logger.info("Generating compact code from ffcx.ir.uflacs representation")
+
+    size = compact_block_offsets(ir.block_sparsity)[1]
+    ir = ir._replace(tensor_shape=(size, ))
+    backend = FFCXBackend(ir, parameters)
+
+    ig = IntegralGenerator(ir, backend, compact=True)
+    parts = ig.generate()
+
+    return format_indented_lines(parts.cs_format(ir.precision), 1)
+
+
+def blockmap_subspaces(blockmap, offsets):
+    """Return the sub-spaces of the arguments of a block, or None if a dofmap spans several sub-spaces."""
+    block = []
+    for dofmap, o in zip(blockmap, offsets):
+        k = bisect.bisect_right(o, dofmap[0]) - 1
+        if not all(o[k] <= dof < o[k + 1] for dof in dofmap):
+            return None
+        block.append(k)
+    return tuple(block)
+
+
+def compact_block_offsets(block_sparsity):
+    """Return the offsets of the nonzero blocks of sub-spaces in the compact element tensor, and its size."""
+    offsets = block_sparsity["offsets"]
+    compact_offsets = {}
+    size = 0
+    for block in block_sparsity["nonzero_blocks"]:
+        compact_offsets[block] = size
+        size += ufl.product([offsets[i][k + 1] - offsets[i][k] for i, k in enumerate(block)])
+    return compact_offsets, size
+
+
+def diagonal_block_entries(blockmap):
+    """Return the pairs of indices (i, j) of the entries of a block on the diagonal of the element tensor."""
+    positions = {dof: j for j, dof in enumerate(blockmap[1])}
+    return [(i, positions[dof]) for i, dof in enumerate(blockmap[0]) if dof in positions]
+
+
 class IntegralGenerator(object):
-    def __init__(self, ir, backend):
+    def __init__(self, ir, backend, diagonal=False, packed=None, compact=False):
         # Store ir
         self.ir = ir
 
@@ -69,9 +249,43 @@ class IntegralGenerator(object):
         # Block contributions collected during generation to be added to A at the end
         self.finalization_blocks = collections.defaultdict(list)
 
+        # Block contributions also added transposed to A at the end
+        self.mirrored_blocks = collections.defaultdict(list)
+
         # Set of counters used for assigning names to intermediate variables
         self.symbol_counters = collections.defaultdict(int)
 
+        # Arrays of coefficient values in all quadrature points, computed
+        # by sum factorization before the quadrature loop
+        self.factorized_coefficient_values = {}
+
+        # Batch kernels vectorize the loop over cells instead of the
+        # loops within a cell
+        self.vectorize = ir.params["vectorize"] and backend.symbols.batch_cell is None
+
+        # Loops over dofs run over the padding of the tables and blocks,
+        # unless dofs are reflected through the unpadded dof arrays
+        self.padlen = 1 if has_dof_reflections(ir.element_dof_reflection_entities) else ir.params["padlen"]
+
+        # Diagonal kernels compute only the entries of the blocks on the
+        # diagonal of the element matrix, into the vector A
+        self.diagonal = diagonal
+
+        # Arrays of the argument indices of the diagonal entries of
+        # blocks, {entries: (symbols, declarations)}
+        self.diagonal_indices = {}
+
+        # Packed kernels compute the upper triangle of the symmetric
+        # element matrix of dimension packed, into the vector A
+        self.packed = packed
+
+        # Compact kernels compute the nonzero blocks of sub-spaces of
+        # the element tensor only, one after the other into the vector
+        # A, with the offsets of the blocks in A
+        self.compact = compact
+        if compact:
+            self.compact_offsets = compact_block_offsets(ir.block_sparsity)[0]
+
     def init_scopes(self):
         """Initialize variable scope dicts."""
         # Reset variables, separate sets for quadrature loop
@@ -162,6 +376,11 @@ class IntegralGenerator(object):
         # Generate the tables of basis function values and preintegrated blocks
         parts += self.generate_element_tables()
 
+        # The tables are shared by the cells of a batch kernel, the
+        # remaining code is repeated for each cell
+        preamble = parts
+        parts = []
+
         # Generate code to compute piecewise constant scalar factors
         parts += self.generate_unstructured_piecewise_partition()
 
@@ -193,6 +412,10 @@ class IntegralGenerator(object):
         all_quadparts += quadparts
         all_postparts += postparts
 
+        # Define the argument indices of the diagonal entries of blocks
+        for symbols, decls in self.diagonal_indices.values():
+            preamble += decls
+
         # Generate code to fill in A
         all_finalizeparts = []
 
@@ -209,7 +432,14 @@ class IntegralGenerator(object):
         parts += all_postparts
         parts += all_finalizeparts
 
-        return L.StatementList(parts)
+        # Loop over the cells of a batch, with consecutive iterations
+        # accessing consecutive memory
+        cell = self.backend.symbols.batch_cell
+        if cell is not None:
+            num_cells = self.backend.symbols.batch_num_cells
+            parts = [L.ForRange(cell, 0, num_cells, body=parts, vectorize=True)]
+
+        return L.StatementList(preamble + parts)
 
     def generate_quadrature_tables(self):
         """Generate static tables of quadrature points and weights."""
@@ -298,6 +528,7 @@ class IntegralGenerator(object):
             "FE* dimensions: [permutation][entities][points][dofs]",
             "PI* dimensions: [permutations][permutations][entities][dofs][dofs] or [permutations][entities][dofs]",
             "PM* dimensions: [permutations][entities][dofs][dofs]",
+            "PT* dimensions: [coefficient dofs]...[coefficient dofs][dofs][dofs]",
         ])
         return parts
 
@@ -305,6 +536,10 @@ class IntegralGenerator(object):
         """Generate quadrature loop with for this num_points."""
         L = self.backend.language
 
+        # Evaluate coefficients of tensor product elements in all points
+        # before the quadrature loop
+        coefficient_parts = self.generate_factorized_coefficients(num_points)
+
         # Generate unstructured varying partition
         body = self.generate_unstructured_varying_partition(num_points)
         body = L.commented_code_list(
@@ -314,6 +549,7 @@ class IntegralGenerator(object):
         # will be placed before or after quadloop
         preparts, quadparts, postparts = \
             self.generate_dofblock_partition(num_points)
+        preparts = coefficient_parts + preparts
         body += quadparts
 
         # Wrap body in loop or scope
@@ -333,6 +569,78 @@ class IntegralGenerator(object):
 
         return preparts, quadparts, postparts
 
+    def generate_factorized_coefficients(self, num_points):
+        """Generate code evaluating coefficients in all quadrature points by sum factorization.
+
+        The values are stored in arrays indexed by the quadrature loop
+        index. The sum over the dofs is done one direction at a time,
+        from the last direction to the first:
+
+            Y_d[c_0, ..., c_{d-1}, q_d, ..., q_{n-1}]
+                = sum_{c_d} FT_d[q_d][c_d] * Y_{d+1}[c_0, ..., c_d, q_{d+1}, ..., q_{n-1}]
+
+        where Y_n are the dofs and Y_0 the values in the points.
+        """
+        L = self.backend.language
+        symbols = self.backend.symbols
+
+        varying_ir = self.ir.varying_irs[num_points]
+        F = varying_ir["factorization"]
+        alignas = self.ir.params["alignas"]
+
+        parts = []
+        for i in sorted(varying_ir["factorized_coefficients"]):
+            mt = F.nodes[i]['mt']
+            tabledata = F.nodes[i]['tr']
+            begin, end = tabledata.dofrange
+
+            names = varying_ir["tensor_factors"][tabledata.name]
+            tables = [L.Symbol(name)[0][0] for name in names]
+            point_counts = [self.ir.unique_tables[name].shape[2] for name in names]
+            dof_counts = [self.ir.unique_tables[name].shape[3] for name in names]
+            tdim = len(names)
+
+            q = [symbols.tensor_point_index(d) for d in range(tdim)]
+            c = [symbols.tensor_coefficient_dof_index(d) for d in range(tdim)]
+
+            values = self.new_temp_symbol("WQ")
+            parts += [L.ArrayDecl("ufc_scalar_t", values, num_points, 0, alignas=alignas)]
+
+            code = []
+            Y_prev = None
+            for d in reversed(range(tdim)):
+                dims = dof_counts[:d] + point_counts[d:]
+                if d == 0:
+                    Y = values
+                else:
+                    Y = self.new_temp_symbol("TT")
+                    code += [L.ArrayDecl("ufc_scalar_t", Y, ufl.product(dims), 0, alignas=alignas)]
+                Y = L.FlattenedArray(Y, dims=dims)
+
+                if Y_prev is None:
+                    dof = c[0]
+                    for ci, n in zip(c[1:], dof_counts[1:]):
+                        dof = dof * n + ci
+                    Y_in = symbols.coefficient_dof_access(mt.terminal, dof + begin)
+                else:
+                    Y_in = Y_prev[c[:d + 1] + q[d + 1:]]
+                body = L.AssignAdd(Y[c[:d] + q[d:]], tables[d][q[d]][c[d]] * Y_in)
+
+                # The innermost loop runs over the points of the last
+                # direction, which are contiguous in Y
+                loops = list(zip(c[:d + 1], dof_counts[:d + 1])) + list(zip(q[d:], point_counts[d:]))
+                for j, (index, n) in reversed(list(enumerate(loops))):
+                    vectorize = self.vectorize and j == len(loops) - 1
+                    body = L.ForRange(index, 0, n, body=body, vectorize=vectorize)
+                code += [body]
+                Y_prev = Y
+            parts += [L.Scope(code)]
+
+            self.factorized_coefficient_values[(num_points, i)] = values
+
+        return L.commented_code_list(parts, "Sum factorized evaluation of coefficients "
+                                     "for num_points={}".format(num_points))
+
     def generate_runtime_quadrature_loop(self):
         """Generate quadrature loop for custom integrals, with physical points given runtime."""
         L = self.backend.language
@@ -345,6 +653,7 @@ class IntegralGenerator(object):
         gdim = self.ir.geometric_dimension
 
         alignas = self.ir.params["alignas"]
+        padlen = self.ir.params["padlen"]
 
         tables = self.ir.unique_tables
         table_types = self.ir.unique_table_types
@@ -431,7 +740,7 @@ class IntegralGenerator(object):
                 table = tables[name]
                 decl = L.ArrayDecl(
                     "ufc_scalar_t", name, (1, chunk_size, table.shape[2]), 0,
-                    alignas=alignas)  # padlen=padlen)
+                    alignas=alignas, padlen=padlen)
                 table_parts += [decl]
 
             table_parts += [L.Comment("FIXME: Fill element tables here")]
@@ -488,7 +797,13 @@ class IntegralGenerator(object):
 
                 # Backend specific modified terminal translation
                 vaccess = self.backend.access.get(mt.terminal, mt, tabledata, num_points)
-                vdef = self.backend.definitions.get(mt.terminal, mt, tabledata, num_points, vaccess)
+                values = self.factorized_coefficient_values.get((num_points, i))
+                if values is not None:
+                    # Coefficient evaluated in all points before the quadrature loop
+                    iq = self.backend.symbols.quadrature_loop_index()
+                    vdef = [L.VariableDecl("const ufc_scalar_t", vaccess, values[iq])]
+                else:
+                    vdef = self.backend.definitions.get(mt.terminal, mt, tabledata, num_points, vaccess)
 
                 # Store definitions of terminals in list
                 assert isinstance(vdef, list)
@@ -565,10 +880,20 @@ class IntegralGenerator(object):
 
         for blockmap, blockdata in blocks:
 
+            if self.diagonal:
+                # Skip blocks without entries on the diagonal, the
+                # others are added to the diagonal dofs
+                entries = diagonal_block_entries(blockmap)
+                if not entries:
+                    continue
+
             # Define code for block depending on mode
             B, block_preparts, block_quadparts, block_postparts = \
                 self.generate_block_parts(num_points, blockmap, blockdata)
 
+            if self.diagonal:
+                blockmap = (tuple(blockmap[0][i] for i, j in entries), )
+
             # Add definitions
             preparts.extend(block_preparts)
 
@@ -581,8 +906,39 @@ class IntegralGenerator(object):
             # Add A[blockmap] += B[...] to finalization
             self.finalization_blocks[blockmap].append(B)
 
+            # Add the transposed block of the dropped term, its diagonal
+            # entries are the diagonal entries of B
+            if blockdata.symmetry == "mirrored":
+                if self.diagonal:
+                    self.finalization_blocks[blockmap].append(B)
+                else:
+                    self.mirrored_blocks[blockmap].append(B)
+
         return preparts, quadparts, postparts
 
+    def get_diagonal_indices(self, blockmap):
+        """Get the argument indices of the entries of a block on the diagonal of A.
+
+        The diagonal entries are numbered by the loop index of the
+        first argument.
+        """
+        L = self.backend.language
+        k = self.backend.symbols.argument_loop_index(0)
+
+        entries = tuple(diagonal_block_entries(blockmap))
+        if entries == tuple((i, i) for i in range(len(entries))):
+            return (k, k)
+
+        indices = self.diagonal_indices.get(entries)
+        if indices is None:
+            symbols = (self.new_temp_symbol("DI"), self.new_temp_symbol("DJ"))
+            decls = [L.ArrayDecl("static const int", symbols[r], len(entries), [e[r] for e in entries])
+                     for r in range(2)]
+            indices = (symbols, decls)
+            self.diagonal_indices[entries] = indices
+        symbols, decls = indices
+        return (symbols[0][k], symbols[1][k])
+
     def get_entities(self, blockdata):
         L = self.backend.language
 
@@ -679,6 +1035,7 @@ class IntegralGenerator(object):
             "full": "TF",
             "safe": "TS",
             "quadrature": "TQ",
+            "factorized": "FQ",
         }
         blocknames = {
             # "preintegrated": "BI",
@@ -687,6 +1044,8 @@ class IntegralGenerator(object):
             "full": "BF",
             "safe": "BS",
             "quadrature": "BQ",
+            "factorized": "BT",
+            "tensor": "BC",
         }
 
         tempname = tempnames.get(blockdata.block_mode)
@@ -696,7 +1055,7 @@ class IntegralGenerator(object):
 
         block_rank = len(blockmap)
         blockdims = tuple(len(dofmap) for dofmap in blockmap)
-        padded_blockdims = pad_innermost_dim(blockdims, padlen)
+        padded_blockdims = pad_innermost_dim(blockdims, self.padlen)
 
         ttypes = blockdata.ttypes
         if "zeros" in ttypes:
@@ -720,20 +1079,30 @@ class IntegralGenerator(object):
                 B_indices.append(arg_indices[i])
         B_indices = tuple(B_indices)
 
+        # Loops over the entries of the block B
+        loop_indices = B_indices
+        loop_dims = padded_blockdims
+        if self.diagonal:
+            # Loop over the entries on the diagonal of A only, at the
+            # argument indices arg_indices
+            arg_indices = self.get_diagonal_indices(blockmap)
+            B_indices = arg_indices
+            loop_indices = loop_indices[:1]
+            loop_dims = (len(diagonal_block_entries(blockmap)), )
+
         # Define unique block symbol
         blockname = blocknames.get(blockdata.block_mode)
         if blockname:
             B = self.new_temp_symbol(blockname)
             # Add initialization of this block to parts
             # For all modes, block definition occurs before quadloop
+            B_dims = loop_dims if self.diagonal else blockdims
             preparts.append(
-                L.ArrayDecl("ufc_scalar_t", B, blockdims, 0, alignas=alignas, padlen=padlen))
+                L.ArrayDecl("ufc_scalar_t", B, B_dims, 0, alignas=alignas, padlen=padlen))
 
-        # Get factor expression
-        if blockdata.factor_is_piecewise:
-            F = self.ir.piecewise_ir["factorization"]
-        else:
-            F = self.ir.varying_irs[num_points]["factorization"]
+            # Entries of B accumulated and added to A
+            B_entry = B[loop_indices] if self.diagonal else B[B_indices]
+            B_out = B[loop_indices] if self.diagonal else B[arg_indices]
 
         if len(blockdata.factor_indices_comp_indices) > 1:
             raise RuntimeError("Code generation for non-scalar integrals unsupported")
@@ -741,8 +1110,15 @@ class IntegralGenerator(object):
         # We have scalar integrand here, take just the factor index
         factor_index = blockdata.factor_indices_comp_indices[0][0]
 
-        v = F.nodes[factor_index]['expression']
-        f = self.get_var(num_points, v)
+        # Get factor expression, tensor blocks are evaluated from their
+        # monomials instead
+        if blockdata.block_mode != "tensor":
+            if blockdata.factor_is_piecewise:
+                F = self.ir.piecewise_ir["factorization"]
+            else:
+                F = self.ir.varying_irs[num_points]["factorization"]
+            v = F.nodes[factor_index]['expression']
+            f = self.get_var(num_points, v)
 
         # Quadrature weight was removed in representation, add it back now
         if num_points is None:
@@ -754,6 +1130,11 @@ class IntegralGenerator(object):
             weights = self.backend.symbols.weights_table(num_points)
             weight = weights[iq]
 
+        # Compute only the upper triangle of symmetric blocks, mirrored
+        # to the lower triangle after the quadrature loop
+        triangular = (blockdata.symmetry == "symmetric" and not self.diagonal
+                      and blockdata.block_mode in ("safe", "full") and "quadrature" not in ttypes)
+
         # Define fw = f * weight
         if blockdata.block_mode in ("safe", "full", "partial"):
             assert not blockdata.transposed, "Not handled yet"
@@ -784,17 +1165,20 @@ class IntegralGenerator(object):
                 # 4) Possibly swap loops over iq and ic:
                 #    for(ic) for(iq) w0_c1[iq] = w[0][ic] * FE[iq][ic];
 
-        if blockdata.block_mode == "safe":
+        if blockdata.block_mode == "safe" or (self.diagonal and blockdata.block_mode == "full"):
             # Naively accumulate integrand for this block in the innermost loop
             assert not blockdata.transposed
             B_rhs = L.float_product([fw] + arg_factors)
-            body = L.AssignAdd(B[B_indices], B_rhs)  # NB! += not =
-            for i in reversed(range(block_rank)):
-                body = L.ForRange(B_indices[i], 0, padded_blockdims[i], body=body)
+            body = L.AssignAdd(B_entry, B_rhs)  # NB! += not =
+            for i in reversed(range(len(loop_indices))):
+                # Vectorize only the innermost loop
+                vectorize = self.vectorize and (i == len(loop_indices) - 1)
+                begin = loop_indices[0] if triangular and i == 1 else 0
+                body = L.ForRange(loop_indices[i], begin, loop_dims[i], body=body, vectorize=vectorize)
             quadparts += [body]
 
             # Define rhs expression for A[blockmap[arg_indices]] += A_rhs
-            A_rhs = B[arg_indices]
+            A_rhs = B_out
 
         elif blockdata.block_mode == "full":
             assert not blockdata.transposed, "Not handled yet"
@@ -827,8 +1211,8 @@ class IntegralGenerator(object):
                     P_rhs = L.float_product([fw, arg_factors[i]])
                     body = L.Assign(P[P_index], P_rhs)
                     # if ttypes[i] != "quadrature":  # FIXME: What does this mean here?
-                    vectorize = self.ir.params["vectorize"]
-                    body = L.ForRange(P_index, 0, P_dim, body=body, vectorize=vectorize)
+                    body = L.ForRange(P_index, 0, pad_dim(P_dim, self.padlen), body=body,
+                                      vectorize=self.vectorize)
                     quadparts.append(body)
 
                 B_rhs = P[P_index] * arg_factors[j]
@@ -837,15 +1221,44 @@ class IntegralGenerator(object):
             body = L.AssignAdd(B[B_indices], B_rhs)  # NB! += not =
             for i in reversed(range(block_rank)):
                 # Vectorize only the innermost loop
-                vectorize = self.ir.params["vectorize"] and (i == block_rank - 1)
+                vectorize = self.vectorize and (i == block_rank - 1)
                 if ttypes[i] != "quadrature":
+                    begin = B_indices[0] if triangular and i == 1 else 0
                     body = L.ForRange(
-                        B_indices[i], 0, padded_blockdims[i], body=body, vectorize=vectorize)
+                        B_indices[i], begin, padded_blockdims[i], body=body, vectorize=vectorize)
             quadparts += [body]
 
             # Define rhs expression for A[blockmap[arg_indices]] += A_rhs
             A_rhs = B[arg_indices]
 
+        elif blockdata.block_mode == "factorized":
+            assert not blockdata.transposed, "Not handled yet"
+
+            # Store the integrand scaled by the weight in all points
+            key = (num_points, factor_index, blockdata.factor_is_piecewise)
+            FQ, defined = self.get_temp_symbol(tempname, key)
+            if not defined:
+                preparts.append(L.ArrayDecl("ufc_scalar_t", FQ, num_points, None, alignas=alignas))
+                quadparts.append(L.Assign(FQ[iq], L.float_product([f, weight])))
+
+            # Integrate after the quadrature loop
+            postparts += self.generate_factorized_block_integration(num_points, blockdata, FQ, B)
+
+            # Define rhs expression for A[blockmap[arg_indices]] += A_rhs
+            A_rhs = B_out
+
+        elif blockdata.block_mode == "tensor":
+            # Contract the reference tensors with the piecewise factors
+            # and coefficient dofs
+            assert num_points is None
+            # The reference tensors are not padded
+            dims = loop_dims if self.diagonal else blockdims
+            for monomial in blockdata.monomials:
+                quadparts += self.generate_tensor_contraction(monomial, B_entry, arg_indices, loop_indices, dims)
+
+            # Define rhs expression for A[blockmap[arg_indices]] += A_rhs
+            A_rhs = B_out
+
         elif blockdata.block_mode == "partial":
             # TODO: To handle transpose here, must add back intermediate block B
             assert not blockdata.transposed, "Not handled yet"
@@ -855,10 +1268,16 @@ class IntegralGenerator(object):
             i = blockdata.piecewise_ma_index
             not_piecewise_index = 1 - i
 
-            P_index = arg_indices[not_piecewise_index]
+            # P is computed for all dofs, also in diagonal kernels
+            P_index = self.backend.symbols.argument_loop_index(not_piecewise_index)
+            if self.diagonal:
+                P_factor = self.get_arg_factors(blockdata, block_rank, num_points, iq,
+                                                (P_index, P_index))[not_piecewise_index]
+            else:
+                P_factor = arg_factors[not_piecewise_index]
 
             key = (num_points, factor_index, blockdata.factor_is_piecewise,
-                   arg_factors[not_piecewise_index].ce_format(self.ir.precision))
+                   P_factor.ce_format(self.ir.precision))
             P, defined = self.get_temp_symbol(tempname, key)
             if not defined:
                 # Declare P table in preparts
@@ -867,16 +1286,17 @@ class IntegralGenerator(object):
                     L.ArrayDecl("ufc_scalar_t", P, P_dim, 0, alignas=alignas, padlen=padlen))
 
                 # Multiply collected factors
-                P_rhs = L.float_product([fw, arg_factors[not_piecewise_index]])
+                P_rhs = L.float_product([fw, P_factor])
 
                 # Accumulate P += weight * f * args in quadrature loop
                 body = L.AssignAdd(P[P_index], P_rhs)
-                body = L.ForRange(P_index, 0, pad_dim(P_dim, padlen), body=body)
+                body = L.ForRange(P_index, 0, pad_dim(P_dim, self.padlen), body=body,
+                                  vectorize=self.vectorize)
                 quadparts.append(body)
 
             # Define B = B_rhs = piecewise_argument[:] * P[:],
             # where P[:] = sum_q weight * f * other_argument[:]
-            B_rhs = arg_factors[i] * P[P_index]
+            B_rhs = arg_factors[i] * P[arg_indices[not_piecewise_index]]
 
             # Define rhs expression for A[blockmap[arg_indices]] += A_rhs
             A_rhs = B_rhs
@@ -911,6 +1331,13 @@ class IntegralGenerator(object):
             # Define rhs expression for A[blockmap[arg_indices]] += A_rhs
             A_rhs = B_rhs
 
+        if triangular:
+            # Mirror the upper triangle of B, B[i][j] = B[j][i] for j < i
+            i, j = B_indices
+            body = L.Assign(B[i, j], B[j, i])
+            body = L.ForRange(i, 0, blockdims[0], body=L.ForRange(j, 0, i, body=body))
+            postparts += [body]
+
         # Equip code with comments
         comments = ["UFLACS block mode: {}".format(blockdata.block_mode)]
         preparts = L.commented_code_list(preparts, comments)
@@ -919,6 +1346,118 @@ class IntegralGenerator(object):
 
         return A_rhs, preparts, quadparts, postparts
 
+    def generate_factorized_block_integration(self, num_points, blockdata, FQ, B):
+        """Generate code integrating a block of tensor product arguments by sum factorization.
+
+        The sum over the points is done one direction at a time, from
+        the last direction to the first:
+
+            X_d[q_0, ..., q_{d-1}, i_d, ..., i_{n-1}, j_d, ..., j_{n-1}]
+                = sum_{q_d} FT_d[q_d][i_d] * GT_d[q_d][j_d]
+                  * X_{d+1}[q_0, ..., q_d, i_{d+1}, ..., i_{n-1}, j_{d+1}, ..., j_{n-1}]
+
+        where FT_d and GT_d are the factors of the argument tables,
+        X_n = FQ holds the weighted integrand in the points and X_0 is
+        added to the block B, indexed by the flattened dof indices.
+
+        Diagonal kernels use the same dof indices i = j for all arguments.
+        """
+        L = self.backend.language
+        symbols = self.backend.symbols
+
+        tensor_factors = self.ir.varying_irs[num_points]["tensor_factors"]
+        alignas = self.ir.params["alignas"]
+
+        names = [tensor_factors[mad.tabledata.name] for mad in blockdata.ma_data]
+        tables = [[L.Symbol(name)[0][0] for name in arg_names] for arg_names in names]
+        point_counts = [self.ir.unique_tables[name].shape[2] for name in names[0]]
+        dof_counts = [[self.ir.unique_tables[name].shape[3] for name in arg_names] for arg_names in names]
+        rank = len(names)
+        tdim = len(point_counts)
+
+        q = [symbols.tensor_point_index(d) for d in range(tdim)]
+        if self.diagonal:
+            dofs = [[symbols.tensor_argument_dof_index(0, d) for d in range(tdim)]] * rank
+            out_rank = 1
+        else:
+            dofs = [[symbols.tensor_argument_dof_index(a, d) for d in range(tdim)] for a in range(rank)]
+            out_rank = rank
+
+        code = []
+        X_prev = L.FlattenedArray(FQ, dims=point_counts)
+        for d in reversed(range(tdim)):
+            out_indices = q[:d] + [i for a in range(out_rank) for i in dofs[a][d:]]
+            out_dims = point_counts[:d] + [n for a in range(out_rank) for n in dof_counts[a][d:]]
+            if d == 0:
+                # Accumulate the block directly
+                flat_indices = []
+                for a in range(out_rank):
+                    flat = dofs[a][0]
+                    for i, n in zip(dofs[a][1:], dof_counts[a][1:]):
+                        flat = flat * n + i
+                    flat_indices.append(flat)
+                X_out = B[tuple(flat_indices)]
+            else:
+                X = self.new_temp_symbol("TT")
+                code += [L.ArrayDecl("ufc_scalar_t", X, ufl.product(out_dims), 0, alignas=alignas)]
+                X = L.FlattenedArray(X, dims=out_dims)
+                X_out = X[out_indices]
+
+            in_indices = q[:d + 1] + [i for a in range(out_rank) for i in dofs[a][d + 1:]]
+            arg_factors = [tables[a][d][q[d]][dofs[a][d]] for a in range(rank)]
+            body = L.AssignAdd(X_out, L.float_product(arg_factors + [X_prev[in_indices]]))
+
+            # The point loops are outermost, the innermost loop runs over
+            # the contiguous last index of the output
+            loops = list(zip(q[:d + 1], point_counts[:d + 1])) + list(zip(out_indices[d:], out_dims[d:]))
+            for j, (index, n) in reversed(list(enumerate(loops))):
+                vectorize = self.vectorize and j == len(loops) - 1
+                body = L.ForRange(index, 0, n, body=body, vectorize=vectorize)
+            code += [body]
+            if d > 0:
+                X_prev = X
+
+        return [L.Scope(code)]
+
+    def generate_tensor_contraction(self, monomial, B_entry, arg_indices, loop_indices, loop_dims):
+        """Generate code adding the contraction of a reference tensor to the entries B_entry of a block.
+
+        B[i, j] += sum_c G * w_0[c_0] * ... * w_n[c_n] * PT[c_0]...[c_n][i][j],
+        where G is the piecewise coefficient of the monomial and w_k are
+        the dofs of its coefficients. The entries at the argument indices
+        arg_indices are computed in loops over loop_indices.
+        """
+        L = self.backend.language
+        symbols = self.backend.symbols
+
+        # Sum the terms of the piecewise coefficient
+        terms = []
+        for scale, numerators, denominators in monomial.terms:
+            term = L.float_product([L.LiteralFloat(scale)] + [self.get_var(None, e) for e in numerators])
+            if denominators:
+                term = L.Div(term, L.float_product([self.get_var(None, e) for e in denominators]))
+            terms.append(term)
+        G = self.new_temp_symbol("G")
+        code = [L.VariableDecl("const ufc_scalar_t", G, L.Sum(terms) if len(terms) > 1 else terms[0])]
+
+        # Loop over the block, scaled by the coefficient dofs
+        c = [symbols.tensor_coefficient_dof_index(k) for k in range(len(monomial.coefficients))]
+        PT = L.Symbol(monomial.name)[tuple(c) + arg_indices]
+        GW = self.new_temp_symbol("GW")
+        body = L.AssignAdd(B_entry, GW * PT * self._get_vector_reflection(monomial.name, arg_indices))
+        for i in reversed(range(len(loop_indices))):
+            vectorize = self.vectorize and i == len(loop_indices) - 1
+            body = L.ForRange(loop_indices[i], 0, loop_dims[i], body=body, vectorize=vectorize)
+
+        dofs = [symbols.coefficient_dof_access(mt.terminal, ck + tr.dofrange[0])
+                for ck, (mt, tr) in zip(c, monomial.coefficients)]
+        body = [L.VariableDecl("const ufc_scalar_t", GW, L.float_product([G] + dofs)), body]
+        for ck, (mt, tr) in reversed(list(zip(c, monomial.coefficients))):
+            body = L.ForRange(ck, 0, len(tr.dofmap), body=body)
+        code += [body] if monomial.coefficients else body
+
+        return [L.Scope(code)]
+
     def generate_preintegrated_dofblock_partition(self):
         # FIXME: Generalize this to unrolling all A[] += ... loops,
         # or all loops with noncontiguous DM??
@@ -972,11 +1511,27 @@ class IntegralGenerator(object):
                 assert table.shape[0] == 1
 
             # Unroll loop
-            blockshape = [len(DM) for DM in blockmap]
-            blockrange = [range(d) for d in blockshape]
+            if self.diagonal:
+                # Entries on the diagonal only, into the vector A
+                entries = [(ii, blockmap[0][ii[0]]) for ii in diagonal_block_entries(blockmap)]
+                if blockdata.symmetry == "mirrored":
+                    entries += entries
+            else:
+                blockshape = [len(DM) for DM in blockmap]
+                blockrange = [range(d) for d in blockshape]
+                dofs = [(ii, tuple(blockmap[i][ii[i]] for i in range(len(ii))))
+                        for ii in itertools.product(*blockrange)]
+                if blockdata.symmetry == "mirrored":
+                    dofs += [(ii, dof[::-1]) for ii, dof in dofs]
+                if self.packed:
+                    # Entries in the upper triangle only
+                    entries = [(ii, self.packed_index(*dof)) for ii, dof in dofs if dof[0] <= dof[1]]
+                elif self.compact:
+                    entries = [(ii, self.compact_index(dof)) for ii, dof in dofs]
+                else:
+                    entries = [(ii, sum(A_strides[i] * dof[i] for i in range(len(ii)))) for ii, dof in dofs]
 
-            for ii in itertools.product(*blockrange):
-                A_ii = sum(A_strides[i] * blockmap[i][ii[i]] for i in range(len(ii)))
+            for ii, A_ii in entries:
                 if blockdata.transposed:
                     P_arg_indices = (ii[1], ii[0])
                 else:
@@ -998,7 +1553,7 @@ class IntegralGenerator(object):
 
         z = L.LiteralFloat(0.0)
         code = []
-        A = self.backend.symbols.element_tensor()
+        A = self.backend.symbols.element_tensor_array((len(A_values), ))
         for i in range(len(A_values)):
             if not (A_values[i] == 0.0 or A_values[i] == z):
                 code += [L.AssignAdd(A[i], A_values[i])]
@@ -1010,16 +1565,16 @@ class IntegralGenerator(object):
 
         # Get symbol, dimensions, and loop index symbols for A
         A_shape = self.ir.tensor_shape
-        A_rank = len(A_shape)
+        A_rank = self.ir.rank if self.packed or self.compact else len(A_shape)
 
-        Asym = self.backend.symbols.element_tensor()
-        A = L.FlattenedArray(Asym, dims=A_shape)
+        A = self.backend.symbols.element_tensor_array(A_shape)
 
         indices = [self.backend.symbols.argument_loop_index(i) for i in range(A_rank)]
 
         dofmap_parts = []
         dofmaps = {}
-        for blockmap, contributions in sorted(self.finalization_blocks.items()):
+        blockmaps = set(self.finalization_blocks) | set(self.mirrored_blocks)
+        for blockmap in sorted(blockmaps):
 
             # Define mapping from B indices to A indices
             A_indices = []
@@ -1042,28 +1597,82 @@ class IntegralGenerator(object):
                 A_indices.append(j)
             A_indices = tuple(A_indices)
 
-            # Sum up all blocks contributing to this blockmap
-            term = L.Sum([B_rhs for B_rhs in contributions])
-
             # TODO: need ttypes associated with this block to deal
             # with loop dropping for quadrature elements:
             ttypes = ()
             if ttypes == ("quadrature", "quadrature"):
                 logger.debug("quadrature element block insertion not optimized")
 
-            # Add components of all B's to A component in loop nest
-            body = L.AssignAdd(A[A_indices], term)
-            for i in reversed(range(A_rank)):
-                body = L.ForRange(indices[i], 0, len(blockmap[i]), body=body)
-
-            # Add this block to parts
-            parts.append(body)
+            # Sum up all blocks contributing to this blockmap, and add
+            # the components of all B's to A component in loop nest
+            contributions = self.finalization_blocks.get(blockmap)
+            if contributions:
+                body = self.generate_element_tensor_update(A, A_indices, blockmap, L.Sum(contributions))
+                if body is not None:
+                    for i in reversed(range(A_rank)):
+                        vectorize = self.vectorize and (i == A_rank - 1)
+                        body = L.ForRange(indices[i], 0, len(blockmap[i]), body=body, vectorize=vectorize)
+                    parts.append(body)
+
+            # Add the transposed blocks, looping over the rows of B
+            # innermost to access A contiguously
+            contributions = self.mirrored_blocks.get(blockmap)
+            if contributions:
+                body = self.generate_element_tensor_update(A, A_indices[::-1], blockmap[::-1],
+                                                           L.Sum(contributions))
+                if body is not None:
+                    for i in range(A_rank):
+                        vectorize = self.vectorize and (i == 0)
+                        body = L.ForRange(indices[i], 0, len(blockmap[i]), body=body, vectorize=vectorize)
+                    parts.append(body)
 
         # Place static dofmap tables first
         parts = dofmap_parts + parts
 
         return parts
 
+    def generate_element_tensor_update(self, A, A_indices, blockmap, term):
+        """Generate A[A_indices] += term for the entries of A covered by a block with the given blockmap.
+
+        Packed kernels update the entries in the upper triangle only,
+        returns None if the block has none.
+        """
+        L = self.backend.language
+        if self.compact:
+            return L.AssignAdd(A[self.compact_index(A_indices, blockmap)], term)
+        if not self.packed:
+            return L.AssignAdd(A[A_indices], term)
+        if min(blockmap[0]) > max(blockmap[1]):
+            return None
+        body = L.AssignAdd(A[self.packed_index(*A_indices)], term)
+        if max(blockmap[0]) > min(blockmap[1]):
+            body = L.If(L.LE(*A_indices), body)
+        return body
+
+    def compact_index(self, A_indices, blockmap=None):
+        """Index of the entry A_indices of the element tensor in the compact storage of its nonzero blocks.
+
+        The block is found from the blockmap of the entry if given, else
+        from the integer indices.
+        """
+        offsets = self.ir.block_sparsity["offsets"]
+        block = blockmap_subspaces(blockmap or [(i, ) for i in A_indices], offsets)
+        index = self.compact_offsets[block]
+        stride = 1
+        for i in reversed(range(len(block))):
+            begin, end = offsets[i][block[i]:block[i] + 2]
+            index = (A_indices[i] - begin) * stride + index
+            stride *= end - begin
+        return index
+
+    def packed_index(self, r, c):
+        """Index of the entry (r, c), r <= c, of the upper triangle of the element matrix in packed storage."""
+        L = self.backend.language
+        n = self.packed
+        if isinstance(r, L.CExpr):
+            return L.Div(r * (2 * n - 1 - r), 2) + c
+        return r * (2 * n - 1 - r) // 2 + c
+
     def _get_vector_reflection(self, pname, indices):
         """Get the vector reflection for entry the table pname accessed using indices."""
         origin = self.ir.table_origins[pname]
@@ -83,10 +83,70 @@ void tabulate_tensor_{factory_name}(ufc_scalar_t* restrict A, const ufc_scalar_t
 """
 }
 
+tabulate_batch_implementation = """
+void tabulate_tensor_batch_{factory_name}(ufc_scalar_t* restrict A, const ufc_scalar_t* restrict w,
+                                          const ufc_scalar_t* c,
+                                          const double* restrict coordinate_dofs,
+                                          int num_cells)
+{{
+{tabulate_tensor}
+}}
+"""
+
+# Name of the local index of the entity in the tabulate_tensor
+# signatures above
+entity_local_index = {
+    "cell": "unused_local_index",
+    "exterior_facet": "facet",
+    "interior_facet": "facet",
+    "vertex": "vertex"
+}
+
+tabulate_action_implementation = """
+void tabulate_action_{factory_name}(ufc_scalar_t* restrict A, const ufc_scalar_t* restrict x,
+                                    const ufc_scalar_t* w,
+                                    const ufc_scalar_t* c,
+                                    const double* restrict coordinate_dofs,
+                                    const int* {entity_local_index},
+                                    const uint8_t* restrict quadrature_permutation,
+                                    const bool* edge_reflections,
+                                    const bool* face_reflections,
+                                    const uint8_t* face_rotations)
+{{
+{tabulate_action}
+}}
+"""
+
+tabulate_geometry_implementation = """
+void tabulate_geometry_{factory_name}(double* restrict A, const double* restrict coordinate_dofs)
+{{
+{tabulate_geometry}
+}}
+
+void tabulate_tensor_geometry_{factory_name}(ufc_scalar_t* restrict A, const ufc_scalar_t* w,
+                                             const ufc_scalar_t* c,
+                                             const double* restrict coordinate_dofs,
+                                             const double* restrict geometry,
+                                             const int* unused_local_index,
+                                             const uint8_t* restrict quadrature_permutation,
+                                             const bool* edge_reflections,
+                                             const bool* face_reflections,
+                                             const uint8_t* face_rotations)
+{{
+{tabulate_tensor}
+}}
+"""
+
 factory = """
 // Code for integral {factory_name}
 
 {tabulate_tensor}
+{tabulate_tensor_batch_fn}
+{tabulate_action_fn}
+{tabulate_diagonal_fn}
+{tabulate_packed_fn}
+{tabulate_compact_fn}
+{tabulate_geometry_fn}
 
 ufc_integral* create_{factory_name}(void)
 {{
@@ -94,12 +154,53 @@ ufc_integral* create_{factory_name}(void)
   ufc_integral* integral = malloc(sizeof(*integral));
   integral->enabled_coefficients = enabled;
   integral->tabulate_tensor = tabulate_tensor_{factory_name};
+  integral->tabulate_tensor_batch = {tabulate_tensor_batch};
+  integral->tabulate_action = {tabulate_action};
+  integral->tabulate_diagonal = {tabulate_diagonal};
+  integral->tabulate_tensor_packed = {tabulate_packed};
+  integral->num_nonzero_blocks = {num_nonzero_blocks};
+  integral->nonzero_blocks = {nonzero_blocks};
+  integral->tabulate_tensor_compact = {tabulate_compact};
+  integral->compact_size = {compact_size};
+  integral->tabulate_geometry = {tabulate_geometry};
+  integral->geometry_size = {geometry_size};
+  integral->tabulate_tensor_geometry = {tabulate_tensor_geometry};
   return integral;
 }}
 
 // End of code for integral {factory_name}
 """
 
+fused_declaration = """
+ufc_fused_integral* create_{factory_name}(void);
+"""
+
+fused_factory = """
+// Code for fused integral {factory_name}
+
+void tabulate_tensor_{factory_name}(ufc_scalar_t* restrict* A_forms, const ufc_scalar_t* const* w_forms,
+                                    const ufc_scalar_t* const* c_forms,
+                                    const double* restrict coordinate_dofs,
+                                    const int* unused_local_index,
+                                    const uint8_t* restrict quadrature_permutation,
+                                    const bool* edge_reflections,
+                                    const bool* face_reflections,
+                                    const uint8_t* face_rotations)
+{{
+{tabulate_tensor}
+}}
+
+ufc_fused_integral* create_{factory_name}(void)
+{{
+  ufc_fused_integral* integral = malloc(sizeof(*integral));
+  integral->num_forms = {num_forms};
+  integral->tabulate_tensor = tabulate_tensor_{factory_name};
+  return integral;
+}}
+
+// End of code for fused integral {factory_name}
+"""
+
 custom_factory = """
 // Code for custom integral {factory_name}
 
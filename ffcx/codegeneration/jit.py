@@ -4,17 +4,27 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import asyncio
+import atexit
+import concurrent.futures
+import functools
+import hashlib
 import importlib
 import logging
 import os
 import re
-import tempfile
+import subprocess
+import sysconfig
+import threading
 import time
 from pathlib import Path
 
 import cffi
+import cffi.recompiler
 
 import ffcx
+from ffcx import telemetry
+from ffcx.codegeneration import jitcache
 
 logger = logging.getLogger(__name__)
 
@@ -37,68 +47,187 @@ UFC_FORM_DECL = '\n'.join(re.findall('typedef struct ufc_form.*?ufc_form;', ufc_
 
 UFC_INTEGRAL_DECL = '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor\).*?\);', ufc_h, re.DOTALL))
 UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor_custom\).*?\);', ufc_h, re.DOTALL))
+UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor_batch\).*?\);', ufc_h, re.DOTALL))
+UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_action\).*?\);', ufc_h, re.DOTALL))
+UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_geometry\).*?\);', ufc_h, re.DOTALL))
+UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor_geometry\).*?\);', ufc_h,
+                                          re.DOTALL))
 UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufc_integral.*?ufc_integral;',
                                           ufc_h, re.DOTALL))
+UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor_fused\).*?\);', ufc_h, re.DOTALL))
+UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufc_fused_integral.*?ufc_fused_integral;',
+                                          ufc_h, re.DOTALL))
 UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufc_custom_integral.*?ufc_custom_integral;',
                                           ufc_h, re.DOTALL))
 UFC_EXPRESSION_DECL = '\n'.join(re.findall('typedef struct ufc_expression.*?ufc_expression;', ufc_h, re.DOTALL))
 
 
+# Modules loaded by this process, keyed by (cache directory, source
+# name, compiler arguments), with the objects created from them
+_loaded_modules = {}
+_loaded_modules_lock = threading.Lock()
+_loaded_modules_stats = {"hits": 0, "misses": 0}
+
+
+def loaded_module_stats():
+    """Return hit and miss counts of the in-process module registry.
+
+    A hit is a JIT call served by a module already loaded by this
+    process, a miss is a call that loaded a module from disk.
+    """
+    with _loaded_modules_lock:
+        return dict(_loaded_modules_stats, size=len(_loaded_modules))
+
+
+def clear_loaded_modules():
+    """Forget modules loaded by this process and reset the statistics.
+
+    Subsequent JIT calls load the modules again from the cache directory.
+    """
+    with _loaded_modules_lock:
+        _loaded_modules.clear()
+        _declarations_cache.clear()
+        _loaded_modules_stats.update(hits=0, misses=0)
+
+
+# Declarations, object names and source names of the UFL objects of JIT
+# calls, keyed by the memoised signatures of the objects and the
+# parameters, so that warm calls skip the naming and hashing work
+_declarations_cache = {}
+
+
+def _declarations(declare, ufl_objects, parameters, num_compile_parts):
+    """Return the C declarations, object names and source name of UFL objects.
+
+    The result of ``declare(ufl_objects, parameters, num_compile_parts)``
+    is computed once per process for equal objects and parameters.
+    """
+    key = (declare.__name__, tuple(ffcx.naming.object_signature_and_kind(o) for o in ufl_objects),
+           _compute_parameter_signature(parameters), num_compile_parts)
+    with _loaded_modules_lock:
+        declarations = _declarations_cache.get(key)
+    if declarations is None:
+        declarations = declare(ufl_objects, parameters, num_compile_parts)
+        with _loaded_modules_lock:
+            _declarations_cache[key] = declarations
+    return declarations
+
+
+# Process pool of asynchronous and background builds, created on first
+# use. Builds run in other processes because cffi changes the working
+# directory of the process while compiling.
+_build_executor = None
+_build_executor_lock = threading.Lock()
+
+
+def _get_build_executor():
+    """Return the process pool of asynchronous and background builds, creating it on first use."""
+    global _build_executor
+    with _build_executor_lock:
+        if _build_executor is None:
+            _build_executor = concurrent.futures.ProcessPoolExecutor()
+            atexit.register(_build_executor.shutdown)
+        return _build_executor
+
+
+# Compiler arguments appended for the quick tier of tiered compilation
+QUICK_TIER_COMPILE_ARGS = ["-O0"]
+
+# Modules of the quick tier, and background builds of the optimised
+# tier keyed as _loaded_modules
+_quick_tier_modules = set()
+_upgrades = {}
+
+
+def module_tier(module):
+    """Return the tier of a JIT module, "quick" or "optimised".
+
+    A quick tier module is returned by a tiered compile while the
+    optimised module is built in the background. Once the optimised
+    module is ready the same compile call returns it.
+    """
+    with _loaded_modules_lock:
+        return "quick" if module.__name__ in _quick_tier_modules else "optimised"
+
+
+def wait_for_upgrades(timeout=None):
+    """Wait for background builds of optimised modules, returning True if all have finished."""
+    with _loaded_modules_lock:
+        futures = list(_upgrades.values())
+    done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    return not not_done
+
+
 def _compute_parameter_signature(parameters):
     """Return parameters signature (some parameters should not affect signature)."""
-    return str(sorted(parameters.items()))
-
+    return str(sorted((k, v) for k, v in parameters.items() if k not in ffcx.parameters.EXECUTION_PARAMETERS))
 
-def get_cached_module(module_name, object_names, cache_dir, timeout):
-    """Look for an existing C file and wait for compilation, or if it does not exist, create it."""
-    cache_dir = Path(cache_dir)
-    c_filename = cache_dir.joinpath(module_name).with_suffix(".c")
-    ready_name = c_filename.with_suffix(".c.cached")
 
-    # Ensure cache dir exists
-    cache_dir.mkdir(exist_ok=True, parents=True)
+def get_cached_module(module_name, object_names, cache_dir):
+    """Load a compiled module from the cache, or return (None, None) if it is not available."""
+    if not jitcache.ready_marker(cache_dir, module_name).exists():
+        return None, None
 
     try:
-        # Create C file with exclusive access
-        open(c_filename, "x")
+        compiled_objects, compiled_module = _load_objects(cache_dir, module_name, object_names)
+    except ModuleNotFoundError:
+        # Evicted by another process
         return None, None
-    except FileExistsError:
-        logger.info("Cached C file already exists: " + str(c_filename))
-        finder = importlib.machinery.FileFinder(
-            str(cache_dir), (importlib.machinery.ExtensionFileLoader, importlib.machinery.EXTENSION_SUFFIXES))
-        finder.invalidate_caches()
-
-        # Now, wait for ready
-        for i in range(timeout):
-            if os.path.exists(ready_name):
-                spec = finder.find_spec(module_name)
-                if spec is None:
-                    raise ModuleNotFoundError("Unable to find JIT module.")
-                compiled_module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(compiled_module)
-
-                compiled_objects = [getattr(compiled_module.lib, "create_" + name)() for name in object_names]
-                return compiled_objects, compiled_module
-
-            logger.info("Waiting for {} to appear.".format(str(ready_name)))
-            time.sleep(1)
-        raise TimeoutError("""JIT compilation timed out, probably due to a failed previous compile.
-        Try cleaning cache (e.g. remove {}) or increase timeout parameter.""".format(c_filename))
+
+    logger.info("Loaded {} from JIT cache {}".format(module_name, cache_dir))
+    jitcache.touch(cache_dir, module_name)
+    return compiled_objects, compiled_module
+
+
+def get_cached_source(source_name, cache_dir):
+    """Return the cached generated C code parts, or None if they are not available."""
+    if not jitcache.ready_marker(cache_dir, source_name).exists():
+        return None
+
+    code_parts = []
+    for filename in _source_filenames(source_name, cache_dir):
+        try:
+            with open(filename, "r") as f:
+                code_parts.append(f.read())
+        except FileNotFoundError:
+            # Evicted by another process
+            return None
+    if not code_parts:
+        return None
+
+    jitcache.touch(cache_dir, source_name)
+    return code_parts
+
+
+def _source_filenames(source_name, cache_dir):
+    """Return the files holding the generated C code parts, in order."""
+    filenames = Path(cache_dir).glob(source_name + ".*.ufc.c")
+    return sorted(filenames, key=lambda f: int(f.name.split(".")[1]))
 
 
 def compile_elements(elements, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                     cffi_verbose=False, cffi_debug=None):
+                     cffi_verbose=False, cffi_debug=None, num_compile_parts=1, tiered=False):
     """Compile a list of UFL elements and dofmaps into Python objects."""
     p = ffcx.parameters.default_parameters()
     if parameters is not None:
         p.update(parameters)
 
-    logger.info('Compiling elements: ' + str(elements))
+    logger.info("Compiling elements: %s", elements)
+
+    decl, names, source_name = _declarations(_declare_elements, elements, p, num_compile_parts)
+    cache_dir = Path(cache_dir) if cache_dir is not None else jitcache.default_cache_dir()
+
+    objects, module = _compile_module(decl, elements, names, source_name, p, cache_dir, timeout,
+                                      cffi_extra_compile_args, cffi_verbose, cffi_debug, num_compile_parts, tiered)
+    # Pair up elements with dofmaps
+    objects = list(zip(objects[::2], objects[1::2]))
+    return objects, module
+
 
-    # Get a signature for these elements
-    module_name = 'libffcx_elements_' + \
-        ffcx.naming.compute_signature(elements, _compute_parameter_signature(p)
-                                      + str(cffi_extra_compile_args) + str(cffi_debug))
+def _declare_elements(elements, parameters, num_compile_parts):
+    # Get a signature for the generated code of these elements
+    source_name = 'libffcx_elements_' + \
+        ffcx.naming.compute_signature(elements, _compute_parameter_signature(parameters) + str(num_compile_parts))
 
     names = []
     for e in elements:
@@ -107,86 +236,113 @@ def compile_elements(elements, parameters=None, cache_dir=None, timeout=10, cffi
         name = ffcx.naming.dofmap_name(e, "JIT")
         names.append(name)
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, names, cache_dir, timeout)
-        if obj is not None:
-            # Pair up elements with dofmaps
-            obj = list(zip(obj[::2], obj[1::2]))
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
-
-    try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL
-        element_template = "ufc_finite_element * create_{name}(void);\n"
-        dofmap_template = "ufc_dofmap * create_{name}(void);\n"
-        for i in range(len(elements)):
-            decl += element_template.format(name=names[i * 2])
-            decl += dofmap_template.format(name=names[i * 2 + 1])
-
-        _compile_objects(decl, elements, names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
-
-    objects, module = _load_objects(cache_dir, module_name, names)
-    # Pair up elements with dofmaps
-    objects = list(zip(objects[::2], objects[1::2]))
-    return objects, module
+    scalar_type = parameters["scalar_type"].replace("complex", "_Complex")
+    decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL
+    element_template = "ufc_finite_element * create_{name}(void);\n"
+    dofmap_template = "ufc_dofmap * create_{name}(void);\n"
+    for i in range(len(elements)):
+        decl += element_template.format(name=names[i * 2])
+        decl += dofmap_template.format(name=names[i * 2 + 1])
+    return decl, names, source_name
 
 
 def compile_forms(forms, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                  cffi_verbose=False, cffi_debug=None):
+                  cffi_verbose=False, cffi_debug=None, num_compile_parts=1, tiered=False):
     """Compile a list of UFL forms into UFC Python objects."""
     p = ffcx.parameters.default_parameters()
     if parameters is not None:
         p.update(parameters)
 
-    logger.info('Compiling forms: ' + str(forms))
+    logger.info("Compiling forms: %s", forms)
 
-    # Get a signature for these forms
-    module_name = 'libffcx_forms_' + \
-        ffcx.naming.compute_signature(forms, _compute_parameter_signature(p)
-                                      + str(cffi_extra_compile_args) + str(cffi_debug))
+    decl, form_names, source_name = _declarations(_declare_forms, forms, p, num_compile_parts)
+    cache_dir = Path(cache_dir) if cache_dir is not None else jitcache.default_cache_dir()
+
+    obj, module = _compile_module(decl, forms, form_names, source_name, p, cache_dir, timeout,
+                                  cffi_extra_compile_args, cffi_verbose, cffi_debug, num_compile_parts, tiered)
+    return obj, module
+
+
+def _declare_forms(forms, parameters, num_compile_parts):
+    # Get a signature for the generated code of these forms
+    source_name = 'libffcx_forms_' + \
+        ffcx.naming.compute_signature(forms, _compute_parameter_signature(parameters) + str(num_compile_parts))
 
     form_names = [ffcx.naming.form_name(form, i) for i, form in enumerate(forms)]
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, form_names, cache_dir, timeout)
-        if obj is not None:
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
+    scalar_type = parameters["scalar_type"].replace("complex", "_Complex")
+    decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
+        UFC_COORDINATEMAPPING_DECL + UFC_INTEGRAL_DECL + UFC_FORM_DECL
 
-    try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
-            UFC_COORDINATEMAPPING_DECL + UFC_INTEGRAL_DECL + UFC_FORM_DECL
+    form_template = "ufc_form * create_{name}(void);\n"
+    for name in form_names:
+        decl += form_template.format(name=name)
+    return decl, form_names, source_name
 
-        form_template = "ufc_form * create_{name}(void);\n"
-        for name in form_names:
-            decl += form_template.format(name=name)
 
-        _compile_objects(decl, forms, form_names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
+def compile_forms_many(form_lists, max_workers=None, **kwargs):
+    """Compile several independent lists of UFL forms concurrently.
 
-    obj, module = _load_objects(cache_dir, module_name, form_names)
-    return obj, module
+    Code generation and C compilation of each list run in a pool of
+    worker processes, which publish the compiled modules to the cache.
+    The modules are then loaded by this process.
+
+    Parameters
+    ----------
+    form_lists
+        List of lists of UFL forms, each list is compiled into one module.
+    max_workers
+        Number of worker processes, defaults to the number of processors.
+    kwargs
+        Arguments passed to ``compile_forms``.
+
+    Returns
+    -------
+    List of (compiled forms, module) pairs, in the order of form_lists.
+
+    """
+    kwargs = _resolve_cache_dir(kwargs)
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_build_forms, forms, kwargs) for forms in form_lists]
+        # Load modules in order while the remaining ones are built
+        for forms, future in zip(form_lists, futures):
+            future.result()
+            results.append(compile_forms(forms, **kwargs))
+    return results
+
+
+async def acompile_forms(forms, executor=None, **kwargs):
+    """Compile a list of UFL forms without blocking the asyncio event loop.
+
+    The module is built by executor, a ``concurrent.futures.ProcessPoolExecutor``
+    by default, and then loaded by this process. Arguments in kwargs are
+    passed to ``compile_forms``.
+    """
+    kwargs = _resolve_cache_dir(kwargs)
+    if executor is None:
+        executor = _get_build_executor()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, _build_forms, forms, kwargs)
+    return compile_forms(forms, **kwargs)
+
+
+def _resolve_cache_dir(kwargs):
+    """Return compile arguments with the absolute cache directory of this process, to pass to workers."""
+    kwargs = dict(kwargs)
+    if kwargs.get("cache_dir") is None:
+        kwargs["cache_dir"] = jitcache.default_cache_dir()
+    kwargs["cache_dir"] = Path(kwargs["cache_dir"]).absolute()
+    return kwargs
+
+
+def _build_forms(forms, kwargs):
+    """Compile forms in a worker, publishing the module to the cache."""
+    compile_forms(forms, **kwargs)
 
 
 def compile_expressions(expressions, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                        cffi_verbose=False, cffi_debug=None):
+                        cffi_verbose=False, cffi_debug=None, num_compile_parts=1, tiered=False):
     """Compile a list of UFL expressions into UFC Python objects.
 
     Parameters
@@ -199,111 +355,360 @@ def compile_expressions(expressions, parameters=None, cache_dir=None, timeout=10
     if parameters is not None:
         p.update(parameters)
 
-    logger.info('Compiling expressions: ' + str(expressions))
+    logger.info("Compiling expressions: %s", expressions)
 
-    # Get a signature for these forms
-    module_name = 'libffcx_expressions_' + ffcx.naming.compute_signature(expressions, '', p)
+    decl, expr_names, source_name = _declarations(_declare_expressions, expressions, p, num_compile_parts)
+    cache_dir = Path(cache_dir) if cache_dir is not None else jitcache.default_cache_dir()
 
-    expr_names = ["expression_{!s}".format(ffcx.naming.compute_signature([expression], "", p))
-                  for expression in expressions]
+    obj, module = _compile_module(decl, expressions, expr_names, source_name, p, cache_dir, timeout,
+                                  cffi_extra_compile_args, cffi_verbose, cffi_debug, num_compile_parts, tiered)
+    return obj, module
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, expr_names, cache_dir, timeout)
-        if obj is not None:
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
 
-    try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
-            UFC_COORDINATEMAPPING_DECL + UFC_INTEGRAL_DECL + UFC_FORM_DECL + UFC_EXPRESSION_DECL
+def _declare_expressions(expressions, parameters, num_compile_parts):
+    # Get a signature for the generated code of these expressions
+    source_name = 'libffcx_expressions_' + \
+        ffcx.naming.compute_signature(expressions, _compute_parameter_signature(parameters) + str(num_compile_parts))
 
-        expression_template = "ufc_expression* create_{name}(void);\n"
-        for name in expr_names:
-            decl += expression_template.format(name=name)
+    expr_names = ["expression_{!s}".format(ffcx.naming.compute_signature([expression], "", parameters))
+                  for expression in expressions]
 
-        _compile_objects(decl, expressions, expr_names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
+    scalar_type = parameters["scalar_type"].replace("complex", "_Complex")
+    decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
+        UFC_COORDINATEMAPPING_DECL + UFC_INTEGRAL_DECL + UFC_FORM_DECL + UFC_EXPRESSION_DECL
 
-    obj, module = _load_objects(cache_dir, module_name, expr_names)
-    return obj, module
+    expression_template = "ufc_expression* create_{name}(void);\n"
+    for name in expr_names:
+        decl += expression_template.format(name=name)
+    return decl, expr_names, source_name
 
 
 def compile_coordinate_maps(meshes, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                            cffi_verbose=False, cffi_debug=None):
+                            cffi_verbose=False, cffi_debug=None, num_compile_parts=1, tiered=False):
     """Compile a list of UFL coordinate mappings into UFC Python objects."""
     p = ffcx.parameters.default_parameters()
     if parameters is not None:
         p.update(parameters)
 
-    logger.info('Compiling cmaps: ' + str(meshes))
+    logger.info("Compiling cmaps: %s", meshes)
+
+    decl, cmap_names, source_name = _declarations(_declare_coordinate_maps, meshes, p, num_compile_parts)
+    cache_dir = Path(cache_dir) if cache_dir is not None else jitcache.default_cache_dir()
+
+    obj, module = _compile_module(decl, meshes, cmap_names, source_name, p, cache_dir, timeout,
+                                  cffi_extra_compile_args, cffi_verbose, cffi_debug, num_compile_parts, tiered)
+    return obj, module
 
-    # Get a signature for these cmaps
-    module_name = 'libffcx_cmaps_' + \
-        ffcx.naming.compute_signature(meshes, _compute_parameter_signature(
-            p) + str(cffi_extra_compile_args) + str(cffi_debug), True)
+
+def _declare_coordinate_maps(meshes, parameters, num_compile_parts):
+    # Get a signature for the generated code of these cmaps
+    source_name = 'libffcx_cmaps_' + \
+        ffcx.naming.compute_signature(meshes, _compute_parameter_signature(parameters) + str(num_compile_parts), True)
 
     cmap_names = [ffcx.naming.coordinate_map_name(
         mesh.ufl_coordinate_element(), "JIT") for mesh in meshes]
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, cmap_names, cache_dir, timeout)
-        if obj is not None:
-            return obj, mod
+    scalar_type = parameters["scalar_type"].replace("complex", "_Complex")
+    decl = UFC_HEADER_DECL.format(scalar_type) + UFC_COORDINATEMAPPING_DECL
+    cmap_template = "ufc_coordinate_mapping * create_{name}(void);\n"
+
+    for name in cmap_names:
+        decl += cmap_template.format(name=name)
+    return decl, cmap_names, source_name
+
+
+def _compile_module(decl, ufl_objects, object_names, source_name, parameters, cache_dir, timeout,
+                    cffi_extra_compile_args, cffi_verbose, cffi_debug, num_compile_parts, tiered=False):
+    """Load a module, generating and compiling its code if it is not in the cache.
+
+    The cache has two levels. The generated C code is cached under
+    source_name, a signature of the UFL objects and the FFCX parameters.
+    The compiled module is cached under a name computed from the
+    generated code, the compiler, the compiler arguments and the Python
+    extension ABI, so that changing only the compiler arguments reuses
+    the generated code, and identical code is compiled only once.
+
+    Modules already loaded by this process are returned with the objects
+    created when they were first loaded. These objects are shared
+    between calls and must not be freed by the caller.
+
+    If tiered is True and the module is not in the cache, a quick tier
+    module compiled without optimisation is returned and the module is
+    compiled in the background.
+    """
+    key = (str(cache_dir), source_name, str(cffi_extra_compile_args), str(cffi_debug))
+    t0 = time.perf_counter()
+
+    # Nested calls, for the quick tier, add to the record of the outer call
+    record = telemetry.current()
+    owner = record is None
+    if owner:
+        record = {"source_name": source_name, "compile_args": cffi_extra_compile_args, "timestamp": time.time(),
+                  "generated": False, "compiled": False}
+
+    with _loaded_modules_lock:
+        loaded = _loaded_modules.get(key)
+        if loaded is not None:
+            _loaded_modules_stats["hits"] += 1
+    if loaded is not None:
+        record.update(module_name=loaded[1].__name__, cache="memory")
     else:
-        cache_dir = Path(tempfile.mkdtemp())
+        with telemetry.collect(record):
+            loaded = _load_module(key, decl, ufl_objects, object_names, source_name, parameters, cache_dir, timeout,
+                                  cffi_extra_compile_args, cffi_verbose, cffi_debug, num_compile_parts, tiered)
+        record["cache"] = {(True, True): "miss", (False, True): "source"}.get(
+            (record["generated"], record["compiled"]), "module")
+
+    if owner:
+        record["total"] = time.perf_counter() - t0
+        telemetry.publish(record)
+    return loaded
+
+
+def _load_module(key, decl, ufl_objects, object_names, source_name, parameters, cache_dir, timeout,
+                 cffi_extra_compile_args, cffi_verbose, cffi_debug, num_compile_parts, tiered):
+    """Load a module that is not loaded by this process, see _compile_module."""
+    code_parts = _generate_source(ufl_objects, source_name, parameters, cache_dir, timeout, num_compile_parts)
+    module_name = _compute_module_name(source_name, code_parts, decl, cffi_extra_compile_args, cffi_debug)
+    telemetry.update(module_name=module_name, source_size=sum(len(code) for code in code_parts))
+
+    with telemetry.timer("load"):
+        compiled_objects, compiled_module = get_cached_module(module_name, object_names, cache_dir)
+    if compiled_objects is None and tiered:
+        return _compile_quick_tier(key, decl, ufl_objects, object_names, source_name, parameters, cache_dir, timeout,
+                                   cffi_extra_compile_args, cffi_verbose, cffi_debug, num_compile_parts)
+    if compiled_objects is None:
+        t = time.perf_counter()
+        with jitcache.module_lock(cache_dir, module_name, timeout):
+            telemetry.add("lock_wait", time.perf_counter() - t)
+            # Another process may have compiled the module while waiting for the lock
+            with telemetry.timer("load"):
+                compiled_objects, compiled_module = get_cached_module(module_name, object_names, cache_dir)
+            if compiled_objects is None:
+                _compile_objects(decl, code_parts, module_name, cache_dir,
+                                 cffi_extra_compile_args, cffi_verbose, cffi_debug)
+                with telemetry.timer("load"):
+                    compiled_objects, compiled_module = _load_objects(cache_dir, module_name, object_names)
+
+                # Keep the cache within its size limits
+                jitcache.evict(cache_dir, keep=[source_name, module_name])
+
+    telemetry.update(library_size=os.path.getsize(compiled_module.__file__))
+
+    with _loaded_modules_lock:
+        _loaded_modules[key] = (compiled_objects, compiled_module)
+        _loaded_modules_stats["misses"] += 1
+
+    return compiled_objects, compiled_module
+
 
+def _compile_quick_tier(key, decl, ufl_objects, object_names, source_name, parameters, cache_dir, timeout,
+                        cffi_extra_compile_args, cffi_verbose, cffi_debug, num_compile_parts):
+    """Compile and load a module without optimisation, and start building the optimised module."""
+    quick_compile_args = list(cffi_extra_compile_args or []) + QUICK_TIER_COMPILE_ARGS
+    compiled_objects, compiled_module = _compile_module(decl, ufl_objects, object_names, source_name, parameters,
+                                                        cache_dir, timeout, quick_compile_args, cffi_verbose,
+                                                        cffi_debug, num_compile_parts)
+
+    # The optimised module is built by another process, which publishes
+    # it to the cache, where later calls find it. The worker may run in
+    # another working directory, so it gets the absolute cache directory.
+    # The build is submitted without holding locks, as submitting may
+    # fork a worker process.
+    telemetry.update(tier="quick")
+    with _loaded_modules_lock:
+        _quick_tier_modules.add(compiled_module.__name__)
+        upgrade = key not in _upgrades
+        if upgrade:
+            _upgrades[key] = concurrent.futures.Future()
+    if upgrade:
+        logger.info("Building optimised tier of {} in the background".format(source_name))
+        future = _get_build_executor().submit(_build_module, decl, ufl_objects, object_names, source_name,
+                                              parameters, Path(cache_dir).absolute(), timeout, cffi_extra_compile_args,
+                                              cffi_debug, num_compile_parts)
+        future.add_done_callback(functools.partial(_finish_upgrade, key))
+
+    return compiled_objects, compiled_module
+
+
+def _build_module(decl, ufl_objects, object_names, source_name, parameters, cache_dir, timeout,
+                  cffi_extra_compile_args, cffi_debug, num_compile_parts):
+    """Compile a module in a worker, publishing it to the cache."""
+    _compile_module(decl, ufl_objects, object_names, source_name, parameters, cache_dir, timeout,
+                    cffi_extra_compile_args, False, cffi_debug, num_compile_parts)
+
+
+def _finish_upgrade(key, future):
+    """Complete the upgrade of key with the result of its build.
+
+    A failed build is logged and forgotten, so that the next tiered call
+    starts it again.
+    """
+    with _loaded_modules_lock:
+        upgrade = _upgrades[key]
+        if future.exception() is not None:
+            logger.warning("Background JIT build of optimised module failed: {}".format(future.exception()))
+            del _upgrades[key]
+    if future.exception() is not None:
+        upgrade.set_exception(future.exception())
+    else:
+        upgrade.set_result(None)
+
+
+def _generate_source(ufl_objects, source_name, parameters, cache_dir, timeout, num_compile_parts):
+    """Return the generated C code parts for the UFL objects, generating them if they are not in the cache."""
+    code_parts = get_cached_source(source_name, cache_dir)
+    if code_parts is not None:
+        return code_parts
+
+    t = time.perf_counter()
+    with jitcache.module_lock(cache_dir, source_name, timeout):
+        telemetry.add("lock_wait", time.perf_counter() - t)
+        # Another process may have generated the code while waiting for the lock
+        code_parts = get_cached_source(source_name, cache_dir)
+        if code_parts is not None:
+            return code_parts
+
+        if num_compile_parts > 1:
+            _, code_parts = ffcx.compiler.compile_ufl_objects(ufl_objects, prefix="JIT", parameters=parameters,
+                                                              num_parts=num_compile_parts)
+        else:
+            _, code_body = ffcx.compiler.compile_ufl_objects(ufl_objects, prefix="JIT", parameters=parameters)
+            code_parts = [code_body]
+        telemetry.update(generated=True)
+
+        # Remove files left by an entry that has been partially removed
+        for filename in _source_filenames(source_name, cache_dir):
+            filename.unlink()
+        try:
+            jitcache.ready_marker(cache_dir, source_name).unlink()
+        except FileNotFoundError:
+            pass
+
+        cache_dir.mkdir(exist_ok=True, parents=True)
+        for i, code in enumerate(code_parts):
+            with open(cache_dir.joinpath("{}.{}.ufc.c".format(source_name, i)), "w") as f:
+                f.write(code)
+        fd = open(jitcache.ready_marker(cache_dir, source_name), "x")
+        fd.close()
+
+    return code_parts
+
+
+@functools.lru_cache(maxsize=None)
+def _compiler_signature():
+    """Return a string identifying the C compiler, its version and its default flags."""
+    compiler = [os.environ.get("CC") or sysconfig.get_config_var("CC") or "cc"]
+    compiler += [os.environ.get(v, "") for v in ("CFLAGS", "CPPFLAGS", "LDFLAGS")]
+    compiler += [sysconfig.get_config_var(v) or "" for v in ("CFLAGS", "CCSHARED", "LDSHARED")]
     try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_COORDINATEMAPPING_DECL
-        cmap_template = "ufc_coordinate_mapping * create_{name}(void);\n"
+        version = subprocess.run(compiler[0].split()[:1] + ["--version"], stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+    except OSError:
+        version = ""
+    return "\n".join(compiler + [version])
 
-        for name in cmap_names:
-            decl += cmap_template.format(name=name)
 
-        _compile_objects(decl, meshes, cmap_names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
+def _compute_module_name(source_name, code_parts, decl, cffi_extra_compile_args, cffi_debug):
+    """Return the name of the compiled module for generated code.
 
-    obj, module = _load_objects(cache_dir, module_name, cmap_names)
-    return obj, module
+    The name is a hash of the code, the compiler, the compiler arguments
+    and the Python extension ABI, with the prefix of the source name.
+    """
+    h = hashlib.sha1()
+    for s in code_parts + [decl, _compiler_signature(), str(cffi_extra_compile_args), str(cffi_debug),
+                           cffi.__version__, importlib.machinery.EXTENSION_SUFFIXES[0]]:
+        h.update(s.encode("utf-8"))
+    return source_name.rsplit("_", 1)[0] + "_" + h.hexdigest()
 
 
-def _compile_objects(decl, ufl_objects, object_names, module_name, parameters, cache_dir,
-                     cffi_extra_compile_args, cffi_verbose, cffi_debug):
+def _compile_objects(decl, code_parts, module_name, cache_dir, cffi_extra_compile_args, cffi_verbose, cffi_debug):
+    """Compile generated code into a module in the cache directory, holding the module build lock."""
+    # Remove marker left by a module that has been partially removed
+    try:
+        jitcache.ready_marker(cache_dir, module_name).unlink()
+    except FileNotFoundError:
+        pass
 
-    _, code_body = ffcx.compiler.compile_ufl_objects(ufl_objects, prefix="JIT", parameters=parameters)
+    # Without a compiler for separate parts, compile a single file
+    compiler = _parts_compiler(cffi_verbose) if len(code_parts) > 1 else None
+    if len(code_parts) > 1 and compiler is None:
+        logger.warning("Compiling in parts requires distutils and a Unix-style C compiler, "
+                       "compiling {} as a single file".format(module_name))
+        code_parts = ["".join(code_parts)]
 
     ffibuilder = cffi.FFI()
-    ffibuilder.set_source(module_name, code_body, include_dirs=[ffcx.codegeneration.get_include_path()],
+    ffibuilder.set_source(module_name, code_parts[0], include_dirs=[ffcx.codegeneration.get_include_path()],
                           extra_compile_args=cffi_extra_compile_args)
     ffibuilder.cdef(decl)
 
-    c_filename = cache_dir.joinpath(module_name + ".c")
-    ready_name = c_filename.with_suffix(".c.cached")
-
     # Compile (ensuring that compile dir exists)
     cache_dir.mkdir(exist_ok=True, parents=True)
-    ffibuilder.compile(tmpdir=cache_dir, verbose=cffi_verbose, debug=cffi_debug)
+    telemetry.update(compiled=True)
+    try:
+        if len(code_parts) > 1:
+            _compile_parts(compiler, ffibuilder, code_parts[0], code_parts[1:], module_name, cache_dir,
+                           cffi_extra_compile_args, cffi_verbose, cffi_debug)
+        else:
+            # Compiles and links
+            with telemetry.timer("compile"):
+                ffibuilder.compile(tmpdir=cache_dir, verbose=cffi_verbose, debug=cffi_debug)
+    except Exception:
+        # Keep the C file of the failed compile for inspection
+        c_filename = cache_dir.joinpath(module_name + ".c")
+        if c_filename.exists():
+            os.replace(c_filename, c_filename.with_suffix(".c.failed"))
+        raise
 
     # Create a "status ready" file. If this fails, it is an error,
     # because it should not exist yet.
-    fd = open(ready_name, "x")
+    fd = open(jitcache.ready_marker(cache_dir, module_name), "x")
     fd.close()
 
 
+def _parts_compiler(verbose):
+    """Return the distutils C compiler used by cffi if it can compile separate parts, otherwise None."""
+    try:
+        import setuptools  # noqa: F401, provides distutils on recent Python versions
+        from distutils.ccompiler import new_compiler
+        from distutils.sysconfig import customize_compiler
+    except ImportError:
+        return None
+
+    compiler = new_compiler(verbose=verbose)
+    customize_compiler(compiler)
+    return compiler if hasattr(compiler, "compiler_so") else None
+
+
+def _compile_parts(compiler, ffibuilder, code_body, code_parts, module_name, cache_dir,
+                   cffi_extra_compile_args, cffi_verbose, cffi_debug):
+    """Compile the cffi module source and additional C source parts concurrently and link them into one module."""
+    # Write the module source, with the cffi wrappers, and the parts
+    sources = [cache_dir.joinpath(module_name + ".c")]
+    cffi.recompiler.make_c_source(ffibuilder, module_name, code_body, str(sources[0]), verbose=cffi_verbose)
+    for i, code in enumerate(code_parts, 1):
+        sources.append(cache_dir.joinpath("{}.part{}.c".format(module_name, i)))
+        with open(sources[-1], "w") as f:
+            f.write(code)
+    objects = [str(source.with_suffix(".o")) for source in sources]
+
+    include_dirs = [ffcx.codegeneration.get_include_path(), sysconfig.get_paths()["include"],
+                    sysconfig.get_paths()["platinclude"]]
+    cc_args = ["-I" + d for d in include_dirs] + (["-g"] if cffi_debug else []) + (cffi_extra_compile_args or [])
+
+    def compile_source(source, obj):
+        compiler.spawn(compiler.compiler_so + cc_args + ["-c", str(source), "-o", obj])
+
+    # The compiler runs as a subprocess, so threads compile in parallel
+    with telemetry.timer("compile"), concurrent.futures.ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        for future in [executor.submit(compile_source, s, o) for s, o in zip(sources, objects)]:
+            future.result()
+
+    output_filename = cache_dir.joinpath(module_name + importlib.machinery.EXTENSION_SUFFIXES[0])
+    with telemetry.timer("link"):
+        compiler.link_shared_object(objects, str(output_filename), debug=cffi_debug)
+
+
 def _load_objects(cache_dir, module_name, object_names):
 
     # Create module finder that searches the compile path
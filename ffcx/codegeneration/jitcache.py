@@ -0,0 +1,310 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Management of the on-disk cache of JIT compiled modules.
+
+Every cache entry is the group of files ``<module_name>.*`` in the cache
+directory and the ``.c.cached`` marker that is written once the entry is
+ready. There are two kinds of entries: the C code generated for a set of
+UFL objects (``<module_name>.<i>.ufc.c`` files), and compiled modules
+(cffi C source, object files and shared library). The modification time
+of the marker records the last use of the entry and is used for
+least-recently-used eviction when the cache grows beyond its size or
+entry cap.
+
+Compilation of a module is serialised between processes by an advisory
+lock on its ``.c.lock`` file. Processes waiting for the lock are woken
+by the kernel as soon as the compiling process publishes the module or
+dies, in which case a waiter takes over the compilation. Eviction is
+serialised by a lock on a ``.lock`` file in the cache directory, and
+never removes modules whose build lock is held.
+"""
+
+import contextlib
+import logging
+import os
+import time
+from collections import namedtuple
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Default caps, can be overridden through the environment
+DEFAULT_MAX_BYTES = 1024**3
+DEFAULT_MAX_ENTRIES = 1000
+
+cache_entry = namedtuple("cache_entry", ["module_name", "files", "size", "last_used", "ready"])
+
+
+def default_cache_dir():
+    """Return the default JIT cache directory.
+
+    Uses ``FFCX_CACHE_DIR`` if set, otherwise ``$XDG_CACHE_HOME/fenics/ffcx``
+    (``~/.cache/fenics/ffcx`` when ``XDG_CACHE_HOME`` is not set).
+    """
+    cache_dir = os.environ.get("FFCX_CACHE_DIR")
+    if cache_dir:
+        return Path(cache_dir)
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")
+    return Path(xdg_cache_home).joinpath("fenics", "ffcx")
+
+
+def default_max_bytes():
+    """Return the cache size cap in bytes (``FFCX_CACHE_MAX_BYTES``, 0 disables the cap)."""
+    return int(os.environ.get("FFCX_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+
+def default_max_entries():
+    """Return the cap on the number of cache entries (``FFCX_CACHE_MAX_ENTRIES``, 0 disables the cap)."""
+    return int(os.environ.get("FFCX_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+
+
+def ready_marker(cache_dir, module_name):
+    """Return path of the file marking a module as compiled and ready to load."""
+    return Path(cache_dir).joinpath(module_name + ".c.cached")
+
+
+def lock_filename(cache_dir, module_name):
+    """Return path of the file locked while a module is compiled."""
+    return Path(cache_dir).joinpath(module_name + ".c.lock")
+
+
+def list_entries(cache_dir):
+    """Return a list of all JIT modules in the cache directory."""
+    cache_dir = Path(cache_dir)
+    if not cache_dir.is_dir():
+        return []
+
+    files = {}
+    for f in cache_dir.iterdir():
+        if not f.name.startswith("libffcx_"):
+            continue
+        files.setdefault(f.name.split(".", 1)[0], []).append(f)
+
+    entries = []
+    for module_name, module_files in sorted(files.items()):
+        size = 0
+        last_used = 0.0
+        for f in module_files:
+            try:
+                stat = f.stat()
+            except FileNotFoundError:
+                # Removed by a concurrent eviction
+                continue
+            size += stat.st_size
+            last_used = max(last_used, stat.st_mtime)
+
+        marker = ready_marker(cache_dir, module_name)
+        ready = marker in module_files
+        if ready:
+            try:
+                last_used = marker.stat().st_mtime
+            except FileNotFoundError:
+                ready = False
+        entries.append(cache_entry(module_name, module_files, size, last_used, ready))
+
+    return entries
+
+
+def touch(cache_dir, module_name):
+    """Record a use of a cached module."""
+    try:
+        os.utime(ready_marker(cache_dir, module_name))
+    except FileNotFoundError:
+        pass
+
+
+def remove_entry(cache_dir, module_name):
+    """Remove all files of a cached module.
+
+    The ready marker is removed first so no new process tries to load
+    the module.
+    """
+    cache_dir = Path(cache_dir)
+    marker = ready_marker(cache_dir, module_name)
+    files = [f for f in cache_dir.glob(module_name + ".*") if f != marker]
+    for f in [marker] + files:
+        try:
+            f.unlink()
+        except FileNotFoundError:
+            pass
+
+
+@contextlib.contextmanager
+def directory_lock(cache_dir, blocking=True):
+    """Hold an exclusive advisory lock on the cache directory.
+
+    Yields True if the lock was acquired. If ``blocking`` is False and
+    another process holds the lock, yields False immediately.
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(exist_ok=True, parents=True)
+    with open(cache_dir.joinpath(".lock"), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _lock_file(path, timeout):
+    """Open path and take an exclusive lock on it, waiting at most timeout seconds."""
+    f = open(path, "a")
+    deadline = time.monotonic() + timeout
+    interval = 0.001
+    while True:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                f.close()
+                raise TimeoutError("""JIT compilation timed out, waiting for another process to compile {}.
+    Increase the timeout parameter if the compilation is expected to take longer.""".format(path.stem))
+        # Poll often while the lock is likely to be released soon, and
+        # less often during long compilations
+        time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+        interval = min(2 * interval, 0.05)
+
+
+@contextlib.contextmanager
+def module_lock(cache_dir, module_name, timeout):
+    """Hold the exclusive build lock of a module.
+
+    Raises TimeoutError if the lock is not acquired within timeout
+    seconds. On platforms without ``fcntl`` no locking is done.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    path = lock_filename(cache_dir, module_name)
+    Path(cache_dir).mkdir(exist_ok=True, parents=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        f = _lock_file(path, deadline - time.monotonic())
+        # The lock file may have been removed by an eviction while
+        # waiting, in which case the lock is on a stale file
+        try:
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+    try:
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+
+def build_in_progress(cache_dir, module_name):
+    """Return True if a process is compiling the module."""
+    path = lock_filename(cache_dir, module_name)
+    if fcntl is None or not path.exists():
+        return False
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(f, fcntl.LOCK_UN)
+    return False
+
+
+def evict(cache_dir, max_bytes=None, max_entries=None, keep=(), max_age=None, blocking=False):
+    """Evict least recently used modules until the cache is within its caps.
+
+    Parameters
+    ----------
+    cache_dir
+        The cache directory.
+    max_bytes
+        Cap on the total size of the cache, defaults to ``default_max_bytes()``.
+        A cap of zero means unlimited.
+    max_entries
+        Cap on the number of modules, defaults to ``default_max_entries()``.
+        A cap of zero means unlimited.
+    keep
+        Names of modules that must not be evicted.
+    max_age
+        Modules not used for more than max_age seconds are evicted.
+    blocking
+        Wait for another process evicting from the same directory,
+        instead of returning without evicting anything.
+
+    Returns
+    -------
+    List of names of the evicted modules.
+
+    """
+    if max_bytes is None:
+        max_bytes = default_max_bytes()
+    if max_entries is None:
+        max_entries = default_max_entries()
+
+    evicted = []
+    with directory_lock(cache_dir, blocking=blocking) as acquired:
+        if not acquired:
+            return evicted
+
+        entries = list_entries(cache_dir)
+        total_bytes = sum(e.size for e in entries)
+        num_entries = len(entries)
+
+        # Oldest first, modules that are being compiled are never evicted
+        candidates = sorted((e for e in entries
+                             if e.module_name not in keep and not build_in_progress(cache_dir, e.module_name)),
+                            key=lambda e: e.last_used)
+        now = time.time()
+        for e in candidates:
+            if (max_bytes <= 0 or total_bytes <= max_bytes) and (max_entries <= 0 or num_entries <= max_entries) \
+                    and (max_age is None or now - e.last_used <= max_age):
+                break
+            logger.info("Evicting {} from JIT cache (last used {:.0f} s ago)".format(
+                e.module_name, time.time() - e.last_used))
+            remove_entry(cache_dir, e.module_name)
+            total_bytes -= e.size
+            num_entries -= 1
+            evicted.append(e.module_name)
+
+    return evicted
+
+
+def remove_stale(cache_dir):
+    """Remove entries that are not ready and not being compiled.
+
+    These are left by failed compilations (``.c.failed`` files) and by
+    processes that died while compiling.
+
+    Returns
+    -------
+    List of names of the removed modules.
+
+    """
+    removed = []
+    with directory_lock(cache_dir):
+        for e in list_entries(cache_dir):
+            if e.ready or build_in_progress(cache_dir, e.module_name):
+                continue
+            logger.info("Removing stale {} from JIT cache".format(e.module_name))
+            remove_entry(cache_dir, e.module_name)
+            removed.append(e.module_name)
+    return removed
@@ -68,10 +68,62 @@ class FFCXBackendSymbols(object):
         # True = XYZXYZXYZXYZ, False = XXXXYYYYZZZZ
         self.interleaved_components = True
 
+        # Index of the cell and number of cells of a batch kernel, where
+        # the data of the cells is interleaved with the cell index
+        # innermost. None for single cell kernels.
+        self.batch_cell = None
+        self.batch_num_cells = None
+
+        # Coefficient with dofs in the input vector x of action kernels.
+        # None for other kernels.
+        self.action_coefficient = None
+
+        # Array of values of modified terminals at the quadrature points
+        # in kernels reading precomputed values, with the component of
+        # each modified terminal expression, the offsets of the points
+        # of each quadrature rule and the total number of points. None
+        # for other kernels.
+        self.precomputed_values = None
+        self.precomputed_components = None
+        self.precomputed_point_offsets = None
+        self.precomputed_num_points = None
+
+    def set_batch(self, cell, num_cells):
+        """Access the data of cell in batch kernels tabulating num_cells cells."""
+        self.batch_cell = cell
+        self.batch_num_cells = num_cells
+
+    def set_action(self, coefficient):
+        """Access the dofs of coefficient in the input vector x of action kernels."""
+        self.action_coefficient = coefficient
+
+    def set_precomputed(self, values, components, point_offsets, num_points):
+        """Read the modified terminals in components from the array values at the quadrature points."""
+        self.precomputed_values = values
+        self.precomputed_components = components
+        self.precomputed_point_offsets = point_offsets
+        self.precomputed_num_points = num_points
+
+    def _cell_offset(self, index):
+        """Flat index of entry index of the current cell in interleaved batch data."""
+        if self.batch_cell is None:
+            return index
+        return self.batch_num_cells * index + self.batch_cell
+
     def element_tensor(self):
         """Symbol for the element tensor itself."""
         return self.S("A")
 
+    def element_tensor_array(self, shape):
+        """Element tensor of the current cell as an array with the given shape."""
+        A = self.element_tensor()
+        if self.batch_cell is None:
+            return self.L.FlattenedArray(A, dims=shape)
+        strides = [self.batch_num_cells] * len(shape)
+        for i in range(len(shape) - 2, -1, -1):
+            strides[i] = strides[i + 1] * shape[i + 1]
+        return self.L.FlattenedArray(A, strides=strides, offset=self.batch_cell)
+
     def entity(self, entitytype, restriction):
         """Entity index for lookup in element tables."""
         if entitytype == "cell":
@@ -100,6 +152,19 @@ class FFCXBackendSymbols(object):
         """Reusing a single index name for all quadrature loops, assumed not to be nested."""
         return self.S("iq")
 
+    def tensor_point_index(self, direction):
+        """Index for loops over the quadrature points in one direction of a tensor product rule."""
+        return self.S("iq%d" % (direction, ))
+
+    def tensor_argument_dof_index(self, iarg, direction):
+        """Index for loops over the dofs of argument #iarg in one direction of a tensor product element."""
+        indices = ["i", "j", "k", "l"]
+        return self.S("%s%d" % (indices[iarg], direction))
+
+    def tensor_coefficient_dof_index(self, direction):
+        """Index for loops over the coefficient dofs in one direction of a tensor product element."""
+        return self.S("ic%d" % (direction, ))
+
     def quadrature_permutation(self, index):
         """Quadrature permutation, as input to the function."""
         return self.S("quadrature_permutation")[index]
@@ -141,6 +206,29 @@ class FFCXBackendSymbols(object):
         # FIXME: Add domain number!
         return self.S(format_mt_name("J", mt))
 
+    def detJ_component(self, mt):
+        """Jacobian determinant."""
+        return self.S(format_mt_name("detJ", mt))
+
+    def K_component(self, mt):
+        """Jacobian inverse component."""
+        return self.S(format_mt_name("K", mt))
+
+    def precomputed_access(self, mt, num_points):
+        """Value of the modified terminal in the current quadrature point of the array of precomputed values.
+
+        Piecewise constant values (num_points None) are read in the
+        first point. Returns None if the value is not precomputed.
+        """
+        if self.precomputed_components is None or mt.expr not in self.precomputed_components:
+            return None
+        index = self.precomputed_num_points * self.precomputed_components[mt.expr]
+        if num_points is not None:
+            index += self.precomputed_point_offsets[num_points]
+            if num_points > 1:
+                index += self.quadrature_loop_index()
+        return self.S(self.precomputed_values)[index]
+
     def domain_dof_access(self, dof, component, gdim, num_scalar_dofs, restriction):
         # FIXME: Add domain number or offset!
         offset = 0
@@ -148,9 +236,9 @@ class FFCXBackendSymbols(object):
             offset = num_scalar_dofs * gdim
         vc = self.S("coordinate_dofs")
         if self.interleaved_components:
-            return vc[gdim * dof + component + offset]
+            return vc[self._cell_offset(gdim * dof + component + offset)]
         else:
-            return vc[num_scalar_dofs * component + dof + offset]
+            return vc[self._cell_offset(num_scalar_dofs * component + dof + offset)]
 
     def domain_dofs_access(self, gdim, num_scalar_dofs, restriction):
         # FIXME: Add domain number or offset!
@@ -162,8 +250,11 @@ class FFCXBackendSymbols(object):
     def coefficient_dof_access(self, coefficient, dof_number):
         # TODO: Add domain number?
         offset = self.coefficient_offsets[coefficient]
-        w = self.S("w")
-        return w[offset + dof_number]
+        if coefficient == self.action_coefficient:
+            w = self.S("x")
+        else:
+            w = self.S("w")
+        return w[self._cell_offset(offset + dof_number)]
 
     def coefficient_value(self, mt):
         """Symbol for variable holding value or derivative component of coefficient."""
@@ -10,7 +10,7 @@
 #pragma once
 
 #define UFC_VERSION_MAJOR 2018
-#define UFC_VERSION_MINOR 1
+#define UFC_VERSION_MINOR 3
 #define UFC_VERSION_MAINTENANCE 0
 #define UFC_VERSION_RELEASE 0
 
@@ -454,12 +454,152 @@ extern "C"
       const double* restrict quadrature_weights,
       const double* restrict facet_normals);
 
+  /// Tabulate integral into the tensors A of a batch of cells with
+  /// compiled quadrature rule
+  ///
+  /// The data of the cells is interleaved, with the cell index
+  /// innermost: entry k of the tensor, coefficients or coordinate dofs
+  /// of cell i is stored at [k * num_cells + i]. The constants c are
+  /// shared by all cells.
+  ///
+  /// @see ufc_tabulate_tensor
+  ///
+  /// @param[in] num_cells Number of cells in the batch.
+  typedef void(ufc_tabulate_tensor_batch)(
+      ufc_scalar_t* restrict A, const ufc_scalar_t* restrict w,
+      const ufc_scalar_t* c, const double* restrict coordinate_dofs,
+      int num_cells);
+
+  /// Tabulate the action A = A_K x of the element matrix A_K of a
+  /// bilinear integral on the vector x, without forming A_K
+  ///
+  /// @see ufc_tabulate_tensor
+  ///
+  /// @param[out] A The element vector, with the dimensions of the test
+  ///         space.
+  /// @param[in] x Dofs of the vector to apply the element matrix to,
+  ///         with the dimensions of the trial space.
+  ///         Dimensions: x[restriction][dof].
+  typedef void(ufc_tabulate_action)(
+      ufc_scalar_t* restrict A, const ufc_scalar_t* restrict x,
+      const ufc_scalar_t* w, const ufc_scalar_t* c,
+      const double* restrict coordinate_dofs, const int* entity_local_index,
+      const uint8_t* restrict quadrature_permutation,
+      const bool* edge_reflections, const bool* face_reflections,
+      const uint8_t* face_rotations);
+
+  /// Compute the geometry of a cell at the quadrature points of a cell
+  /// integral, to be read by its tabulate_tensor_geometry
+  ///
+  /// @param[out] geometry The components of the Jacobian J (row-major,
+  ///         gdim x tdim), its determinant detJ and its (pseudo)inverse
+  ///         K (row-major, tdim x gdim), each at all quadrature points.
+  ///         Dimensions: geometry[component][point], with size
+  ///         geometry_size of the integral.
+  /// @param[in] coordinate_dofs Values of degrees of freedom of
+  ///         coordinate element. Defines the geometry of the cell.
+  ///         Dimensions: coordinate_dofs[num_dofs][gdim].
+  typedef void(ufc_tabulate_geometry)(
+      double* restrict geometry, const double* restrict coordinate_dofs);
+
+  /// Tabulate integral into tensor A with compiled quadrature rule,
+  /// reading the geometry at the quadrature points instead of
+  /// computing it from the coordinate dofs
+  ///
+  /// @see ufc_tabulate_tensor
+  ///
+  /// @param[in] geometry Geometry of the cell computed by
+  ///         tabulate_geometry of the integral.
+  typedef void(ufc_tabulate_tensor_geometry)(
+      ufc_scalar_t* restrict A, const ufc_scalar_t* w, const ufc_scalar_t* c,
+      const double* restrict coordinate_dofs, const double* restrict geometry,
+      const int* entity_local_index,
+      const uint8_t* restrict quadrature_permutation,
+      const bool* edge_reflections, const bool* face_reflections,
+      const uint8_t* face_rotations);
+
   typedef struct ufc_integral
   {
     const bool* enabled_coefficients;
     ufc_tabulate_tensor* tabulate_tensor;
+
+    /// Tabulate the tensors of a batch of cells, or NULL if the
+    /// integral has no batched kernel
+    ufc_tabulate_tensor_batch* tabulate_tensor_batch;
+
+    /// Tabulate the action of the element matrix on a vector, or NULL
+    /// if the integral has no action kernel
+    ufc_tabulate_action* tabulate_action;
+
+    /// Tabulate the diagonal of the element matrix into the vector A,
+    /// or NULL if the integral has no diagonal kernel
+    ufc_tabulate_tensor* tabulate_diagonal;
+
+    /// Tabulate the upper triangle of the symmetric element matrix
+    /// into the vector A in packed row-major storage, with A[i*(2*n -
+    /// i - 1)/2 + j] the entry (i, j), i <= j, of the n x n matrix, or
+    /// NULL if the integral has no packed kernel
+    ufc_tabulate_tensor* tabulate_tensor_packed;
+
+    /// Number of blocks of the element tensor with nonzero entries, or
+    /// -1 if the integral has no arguments or the blocks are not known
+    int num_nonzero_blocks;
+
+    /// Sub-spaces of the arguments of the blocks with nonzero entries,
+    /// with nonzero_blocks[rank*k + i] the sub-space of argument i of
+    /// block k. The sub-spaces of an argument are the sub-elements of
+    /// its mixed element, or the whole element, numbered consecutively
+    /// for the two cells of interior facet integrals.
+    const int* nonzero_blocks;
+
+    /// Tabulate the blocks with nonzero entries of the element tensor
+    /// only, one after the other in the order of nonzero_blocks and
+    /// each in row-major storage, into the vector A, or NULL if the
+    /// integral has no compact kernel
+    ufc_tabulate_tensor* tabulate_tensor_compact;
+
+    /// Size of the vector A of tabulate_tensor_compact
+    int compact_size;
+
+    /// Compute the geometry at the quadrature points, or NULL if the
+    /// integral has no kernel reading precomputed geometry
+    ufc_tabulate_geometry* tabulate_geometry;
+
+    /// Size of the geometry array computed by tabulate_geometry
+    int geometry_size;
+
+    /// Tabulate the tensor reading the geometry computed by
+    /// tabulate_geometry, or NULL
+    ufc_tabulate_tensor_geometry* tabulate_tensor_geometry;
   } ufc_integral;
 
+  /// Tabulate the integrals over a cell of several forms into their
+  /// element tensors in a single pass, evaluating the geometry and the
+  /// coefficients shared by the forms once
+  ///
+  /// @see ufc_tabulate_tensor
+  ///
+  /// @param[out] A Element tensors of the forms, with A[i] the element
+  ///         tensor of form i.
+  /// @param[in] w Coefficients of the forms, with w[i] the coefficients
+  ///         of form i.
+  /// @param[in] c Constants of the forms, with c[i] the constants of
+  ///         form i.
+  typedef void(ufc_tabulate_tensor_fused)(
+      ufc_scalar_t* restrict* A, const ufc_scalar_t* const* w,
+      const ufc_scalar_t* const* c, const double* restrict coordinate_dofs,
+      const int* entity_local_index,
+      const uint8_t* restrict quadrature_permutation,
+      const bool* edge_reflections, const bool* face_reflections,
+      const uint8_t* face_rotations);
+
+  typedef struct ufc_fused_integral
+  {
+    /// Number of forms, the forms compiled together in their order
+    int num_forms;
+    ufc_tabulate_tensor_fused* tabulate_tensor;
+  } ufc_fused_integral;
+
   typedef struct ufc_custom_integral
   {
     const bool* enabled_coefficients;
@@ -617,6 +757,11 @@ extern "C"
     /// Create a new custom integral on sub domain subdomain_id
     ufc_custom_integral* (*create_custom_integral)(int subdomain_id);
 
+    /// Create a new cell integral on sub domain subdomain_id tabulating
+    /// the element tensors of all forms compiled together with this
+    /// form, or NULL if the cell integrals of the forms are not fused
+    ufc_fused_integral* (*create_fused_cell_integral)(int subdomain_id);
+
   } ufc_form;
 
   // FIXME: Formalise a UFC 'function space'.
@@ -83,6 +83,12 @@ def get_reflection(L, i):
         return L.LiteralBool(False)
 
 
+def has_dof_reflections(element_dof_reflection_entities):
+    """Check if the dofs of any of the elements are reflected with the edges or faces of the cell."""
+    return any(j[0] in (1, 2) for entities in element_dof_reflection_entities.values()
+               for i in entities if i is not None for j in i)
+
+
 def get_vector_reflection_array(L, dof_reflection_entities, vname="reflected_dofs"):
     """Returns array containing true for dofs that require multiplying by -1."""
     _vnames_to_reflect[vname] = False
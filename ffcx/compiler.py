@@ -68,30 +68,39 @@ import os
 import typing
 from time import time
 
+from ffcx import telemetry
 from ffcx.analysis import analyze_ufl_objects
 from ffcx.codegeneration.codegeneration import generate_code
-from ffcx.formatting import format_code
+from ffcx.formatting import format_code, format_code_parts
 from ffcx.ir.representation import compute_ir
 
 logger = logging.getLogger(__name__)
 
 
+_stage_names = {1: "analysis", 2: "ir", 4: "codegen", 5: "format"}
+
+
 def _print_timing(stage, timing):
     logger.info("Compiler stage {stage} finished in {time} seconds.".format(
         stage=stage, time=timing))
+    telemetry.add(_stage_names[stage], timing)
 
 
 def compile_ufl_objects(ufl_objects: typing.Union[typing.List, typing.Tuple],
                         object_names: typing.Dict = {},
                         prefix: str = None,
                         parameters: typing.Dict = None,
-                        visualise: bool = False):
+                        visualise: bool = False,
+                        num_parts: int = None):
     """Generate UFC code for a given UFL objects.
 
     Parameters
     ----------
     @param ufl_objects:
         Objects to be compiled. Accepts elements, forms, integrals or coordinate mappings.
+    @param num_parts:
+        If given, the C source is returned as a list of this many parts
+        that can be compiled separately and linked together.
 
     """
     logger.info("Compiling {}\n".format(prefix))
@@ -118,7 +127,10 @@ def compile_ufl_objects(ufl_objects: typing.Union[typing.List, typing.Tuple],
 
     # Stage 4: format code
     cpu_time = time()
-    code_h, code_c = format_code(code, parameters)
+    if num_parts is None:
+        code_h, code_c = format_code(code, parameters)
+    else:
+        code_h, code_c = format_code_parts(code, parameters, num_parts)
     _print_timing(5, time() - cpu_time)
 
     logger.info("FFCX finished in {} seconds.".format(time() - cpu_time_0))
@@ -4,12 +4,22 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import collections
+import copyreg
+import hashlib
+import io
 import logging
+import os
+import pickle
+import threading
 import warnings
+from pathlib import Path
 
 import numpy
 
 import FIAT
+import FIAT.expansions
+import ffcx
 import ufl
 from FIAT.enriched import EnrichedElement
 from FIAT.mixed import MixedElement
@@ -27,8 +37,25 @@ supported_families = ("Brezzi-Douglas-Marini", "Brezzi-Douglas-Fortin-Marini", "
                       "Radau", "Raviart-Thomas", "Real", "Bubble", "Quadrature", "Regge",
                       "Hellan-Herrmann-Johnson", "Q", "DQ", "TensorProductElement")
 
-# Cache for computed elements
-_cache = {}
+# Default number of elements kept in memory, can be overridden through
+# the environment
+DEFAULT_ELEMENT_CACHE_SIZE = 256
+
+# Least recently used cache of computed elements
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _reduce_expansion_set(expansion_set):
+    """Pickle FIAT expansion sets by their reference cell, as they hold lambdas."""
+    return type(expansion_set), (expansion_set.ref_el, )
+
+
+# Reductions used when pickling elements into the cache directory, kept
+# private so that pickling of FIAT objects elsewhere is unchanged
+_element_dispatch_table = copyreg.dispatch_table.copy()
+_element_dispatch_table.update({cls: _reduce_expansion_set for cls in (
+    FIAT.expansions.LineExpansionSet, FIAT.expansions.TriangleExpansionSet, FIAT.expansions.TetrahedronExpansionSet)})
 
 
 class SpaceOfReals(object):
@@ -46,16 +73,126 @@ def reference_cell_vertices(cellname):
     return cell.get_vertices()
 
 
+def element_cache_size():
+    """Return the number of elements kept in memory (``FFCX_ELEMENT_CACHE_SIZE``, 0 disables the cache)."""
+    return int(os.environ.get("FFCX_ELEMENT_CACHE_SIZE", DEFAULT_ELEMENT_CACHE_SIZE))
+
+
+def element_cache_dir():
+    """Return the directory of pickled elements (``FFCX_ELEMENT_CACHE_DIR``), or None if not set."""
+    cache_dir = os.environ.get("FFCX_ELEMENT_CACHE_DIR")
+    return Path(cache_dir) if cache_dir else None
+
+
+def clear_element_cache():
+    """Remove all elements from the in-memory cache."""
+    with _cache_lock:
+        _cache.clear()
+
+
+def _element_filename(cache_dir, ufl_element):
+    """Return path of the pickled element, keyed by the element and the FIAT and FFCX versions."""
+    key = "{!r} {} {}".format(ufl_element, FIAT.__version__, ffcx.__version__)
+    return Path(cache_dir).joinpath("element_" + hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pickle")
+
+
+def _private_cache_dir(cache_dir):
+    """Create the element cache directory, returning True if only this user can access it.
+
+    Loading a pickle can run arbitrary code, so elements are only loaded
+    from and stored in a directory owned by this user with mode 0700.
+    """
+    if not hasattr(os, "getuid"):
+        return False
+    try:
+        Path(cache_dir).mkdir(mode=0o700, parents=True, exist_ok=True)
+        st = os.stat(cache_dir)
+    except OSError as e:
+        logger.debug("Failed to create element cache directory {}: {}".format(cache_dir, e))
+        return False
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        warnings.warn("Element cache directory {} is not used, as it is not owned by this user "
+                      "with mode 0700.".format(cache_dir))
+        return False
+    return True
+
+
+def _load_element(cache_dir, ufl_element):
+    """Return the element pickled in the cache directory, or None."""
+    filename = _element_filename(cache_dir, ufl_element)
+    try:
+        with open(filename, "rb") as f:
+            st = os.fstat(f.fileno())
+            if st.st_uid != os.getuid() or st.st_mode & 0o022:
+                logger.warning("Ignoring element file {} not owned by this user, or writable by others".format(
+                    filename))
+                return None
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.debug("Failed to load element {} from {}: {}".format(ufl_element, filename, e))
+        return None
+
+
+def _store_element(cache_dir, ufl_element, element):
+    """Pickle the element into the cache directory, replacing the file atomically."""
+    filename = _element_filename(cache_dir, ufl_element)
+    tmpname = filename.with_suffix(".{}.tmp".format(os.getpid()))
+    try:
+        data = io.BytesIO()
+        pickler = pickle.Pickler(data, protocol=pickle.HIGHEST_PROTOCOL)
+        pickler.dispatch_table = _element_dispatch_table
+        pickler.dump(element)
+        tmpname.write_bytes(data.getvalue())
+        os.replace(tmpname, filename)
+    except Exception as e:
+        logger.debug("Failed to store element {} in {}: {}".format(ufl_element, filename, e))
+        if tmpname.exists():
+            tmpname.unlink()
+
+
 def create_element(ufl_element):
+    """Create the FIAT element of a UFL element.
+
+    Elements are kept in a least recently used in-memory cache. If
+    ``FFCX_ELEMENT_CACHE_DIR`` is set, elements are also pickled into
+    that directory, so that other processes do not construct them again.
+    The directory must be private to the user, see _private_cache_dir.
+    """
 
     # Create element signature for caching (just use UFL element)
     element_signature = ufl_element
 
     # Check cache
-    if element_signature in _cache:
-        logger.debug("Reusing element from cache")
-        return _cache[element_signature]
+    with _cache_lock:
+        if element_signature in _cache:
+            logger.debug("Reusing element from cache")
+            _cache.move_to_end(element_signature)
+            return _cache[element_signature]
+
+    cache_dir = element_cache_dir()
+    if cache_dir is not None and not _private_cache_dir(cache_dir):
+        cache_dir = None
+    element = _load_element(cache_dir, ufl_element) if cache_dir is not None else None
+    if element is None:
+        element = _construct_element(ufl_element)
+        if cache_dir is not None:
+            _store_element(cache_dir, ufl_element, element)
+
+    # Store in cache, evicting the least recently used elements
+    maxsize = element_cache_size()
+    if maxsize > 0:
+        with _cache_lock:
+            _cache[element_signature] = element
+            while len(_cache) > maxsize:
+                _cache.popitem(last=False)
+
+    return element
 
+
+def _construct_element(ufl_element):
+    """Construct the FIAT element of a UFL element."""
     if isinstance(ufl_element, ufl.FiniteElement):
         element = _create_fiat_element(ufl_element)
     elif isinstance(ufl_element, ufl.MixedElement):
@@ -71,9 +208,6 @@ def create_element(ufl_element):
         element = _create_restricted_element(ufl_element)
         raise RuntimeError("Cannot handle this element type: {}".format(ufl_element))
 
-    # Store in cache
-    _cache[element_signature] = element
-
     return element
 
 
@@ -21,6 +21,7 @@ from collections import namedtuple
 
 from ffcx import __version__ as FFCX_VERSION
 from ffcx.codegeneration import __version__ as UFC_VERSION
+from ffcx.parameters import EXECUTION_PARAMETERS
 
 logger = logging.getLogger(__name__)
 
@@ -64,6 +65,57 @@ def format_code(code: namedtuple, parameters):
 
     logger.debug("Compiler stage 5: Formatting code")
 
+    code_h_pre, code_h_post, code_c_pre = _generate_preamble(parameters)
+
+    code_h = ""
+    code_c = ""
+
+    for parts_code in code:
+        code_h += "".join([c[0] for c in parts_code])
+        code_c += "".join([c[1] for c in parts_code])
+
+    # Add headers to body
+    code_h = code_h_pre + code_h + code_h_post
+    code_c = code_c_pre + code_c
+
+    return code_h, code_c
+
+
+def format_code_parts(code: namedtuple, parameters, num_parts):
+    """Format given code in UFC format, splitting the source into parts.
+
+    Returns a string with the header file contents and a list of strings
+    with the contents of num_parts source files that can be compiled
+    separately and linked together. The implementations are distributed
+    over the parts to balance their size, and each part declares all
+    functions so that it can refer to implementations in other parts.
+
+    """
+    logger.debug("Compiler stage 5: Formatting code in {} parts".format(num_parts))
+
+    code_h_pre, code_h_post, code_c_pre = _generate_preamble(parameters)
+
+    blocks = [c for parts_code in code for c in parts_code]
+    declarations = "".join([c[0] for c in blocks])
+
+    # Assign largest implementations first to the smallest part
+    sizes = [0] * num_parts
+    assignment = [[] for i in range(num_parts)]
+    for i in sorted(range(len(blocks)), key=lambda i: -len(blocks[i][1])):
+        part = sizes.index(min(sizes))
+        sizes[part] += len(blocks[i][1])
+        assignment[part].append(i)
+
+    code_h = code_h_pre + declarations + code_h_post
+    code_c = [code_c_pre + declarations + "".join([blocks[i][1] for i in sorted(indices)])
+              for indices in assignment]
+
+    return code_h, code_c
+
+
+def _generate_preamble(parameters):
+    """Generate the code preceding (and following) generated code in header and source files."""
+
     # Generate code for comment at top of file
     code_h_pre = _generate_comment(parameters) + "\n"
     code_c_pre = _generate_comment(parameters) + "\n"
@@ -86,18 +138,7 @@ def format_code(code: namedtuple, parameters):
     code_h_pre += c_extern_pre
     code_h_post = c_extern_post
 
-    code_h = ""
-    code_c = ""
-
-    for parts_code in code:
-        code_h += "".join([c[0] for c in parts_code])
-        code_c += "".join([c[1] for c in parts_code])
-
-    # Add headers to body
-    code_h = code_h_pre + code_h + code_h_post
-    code_c = code_c_pre + code_c
-
-    return code_h, code_c
+    return code_h_pre, code_h_post, code_c_pre
 
 
 def write_code(code_h, code_c, prefix, output_dir):
@@ -123,6 +164,7 @@ def _generate_comment(parameters):
     comment += "//\n"
     comment += "// This code was generated with the following parameters:\n"
     comment += "//\n"
+    parameters = {k: v for k, v in parameters.items() if k not in EXECUTION_PARAMETERS}
     comment += textwrap.indent(pprint.pformat(parameters), "//  ")
     comment += "\n"
 
@@ -23,7 +23,7 @@ from collections import namedtuple
 import numpy
 
 import ufl
-from ffcx import naming
+from ffcx import naming, parallel, telemetry
 from ffcx.fiatinterface import (EnrichedElement, FlattenedDimensions,
                                 MixedElement, QuadratureElement, SpaceOfReals,
                                 create_element)
@@ -46,7 +46,7 @@ ir_form = namedtuple('ir_form', ['id', 'prefix', 'name', 'signature', 'rank',
                                  'get_exterior_facet_integral_ids', 'create_interior_facet_integral',
                                  'get_interior_facet_integral_ids', 'create_vertex_integral',
                                  'get_vertex_integral_ids', 'create_custom_integral',
-                                 'get_custom_integral_ids'])
+                                 'get_custom_integral_ids', 'create_fused_cell_integral'])
 ir_element = namedtuple('ir_element', ['id', 'name', 'signature', 'cell_shape',
                                        'topological_dimension',
                                        'geometric_dimension', 'space_dimension', 'value_shape',
@@ -78,7 +78,10 @@ ir_integral = namedtuple('ir_integral', ['representation', 'integral_type', 'sub
                                          'coefficient_offsets', 'original_constant_offsets', 'params',
                                          'unique_tables', 'unique_table_types', 'table_origins', 'table_dofmaps',
                                          'piecewise_ir', 'varying_irs', 'all_num_points', 'name',
-                                         'precision'])
+                                         'precision', 'action_ir', 'geometry_ir', 'block_sparsity'])
+ir_fused_integral = namedtuple('ir_fused_integral', ['name', 'integral_type', 'subdomain_id', 'num_forms',
+                                                     'integrals', 'expression', 'components', 'point_offsets',
+                                                     'num_points', 'packed_coefficients', 'precision'])
 ir_tabulate_dof_coordinates = namedtuple('ir_tabulate_dof_coordinates', ['tdim', 'gdim', 'points', 'cell_shape'])
 ir_evaluate_dof = namedtuple('ir_evaluate_dof', ['mappings', 'reference_value_size', 'physical_value_size',
                                                  'geometric_dimension', 'topological_dimension', 'dofs',
@@ -90,7 +93,8 @@ ir_expression = namedtuple('ir_expression', ['name', 'element_dimensions', 'para
                                              'integral_type', 'entitytype', 'tensor_shape', 'expression_shape',
                                              'original_constant_offsets', 'original_coefficient_positions', 'points'])
 
-ir_data = namedtuple('ir_data', ['elements', 'dofmaps', 'coordinate_mappings', 'integrals', 'forms', 'expressions'])
+ir_data = namedtuple('ir_data', ['elements', 'dofmaps', 'coordinate_mappings', 'integrals', 'fused_integrals',
+                                 'forms', 'expressions'])
 
 
 def compute_ir(analysis: namedtuple, object_names, prefix, parameters, visualise):
@@ -136,17 +140,18 @@ def compute_ir(analysis: namedtuple, object_names, prefix, parameters, visualise
 
     # Compute and flatten representation of integrals
     logger.info("Computing representation of integrals")
-    irs = [
-        _compute_integral_ir(fd, i, prefix, analysis.element_numbers, integral_names, parameters, visualise)
-        for (i, fd) in enumerate(analysis.form_data)
-    ]
+    irs = _compute_integral_irs(analysis, prefix, integral_names, parameters, visualise)
     ir_integrals = list(itertools.chain(*irs))
 
+    # Compute representation of cell integrals fused over all forms
+    logger.info("Computing representation of fused integrals")
+    ir_fused_integrals = _compute_fused_integral_ir(analysis.form_data, irs, parameters, visualise)
+
     # Compute representation of forms
     logger.info("Computing representation of forms")
     ir_forms = [
         _compute_form_ir(fd, i, prefix, analysis.element_numbers, finite_element_names,
-                         dofmap_names, coordinate_mapping_names, object_names)
+                         dofmap_names, coordinate_mapping_names, object_names, ir_fused_integrals)
         for (i, fd) in enumerate(analysis.form_data)
     ]
 
@@ -156,7 +161,7 @@ def compute_ir(analysis: namedtuple, object_names, prefix, parameters, visualise
 
     return ir_data(elements=ir_elements, dofmaps=ir_dofmaps,
                    coordinate_mappings=ir_coordinate_mappings,
-                   integrals=ir_integrals, forms=ir_forms,
+                   integrals=ir_integrals, fused_integrals=ir_fused_integrals, forms=ir_forms,
                    expressions=ir_expressions)
 
 
@@ -339,10 +344,51 @@ def _num_global_support_dofs(fiat_element):
     return num_reals
 
 
-def _compute_integral_ir(form_data, form_index, prefix, element_numbers, integral_names,
+def _compute_integral_irs(analysis, prefix, integral_names, parameters, visualise):
+    """Compute intermediate representations of the integrals of each form.
+
+    With ``parameters["ir_workers"]`` greater than 1, and at least as
+    many integrals as workers, the integrals are computed by a pool of
+    processes. The representations are collected in the order of the
+    forms and integrals, so the generated code is the same as when they
+    are computed in this process.
+    """
+    jobs = [(form_index, itg_data_index) for form_index, fd in enumerate(analysis.form_data)
+            for itg_data_index in range(len(fd.integral_data))]
+    args = (prefix, analysis.element_numbers, integral_names, parameters, visualise)
+
+    workers = parameters.get("ir_workers", 0)
+    if parallel.use_pool(len(jobs), workers):
+        logger.info("Computing representation of {} integrals with {} processes".format(len(jobs), workers))
+        futures = [parallel.process_pool(workers).submit(_compute_integral_ir_collect, analysis.form_data[i], i, j,
+                                                         *args) for i, j in jobs]
+        results = []
+        for future in futures:
+            ir, record = future.result()
+            telemetry.merge(record)
+            results.append(ir)
+    else:
+        results = [_compute_integral_ir(analysis.form_data[i], i, j, *args) for i, j in jobs]
+
+    irs = [[] for fd in analysis.form_data]
+    for (form_index, itg_data_index), ir in zip(jobs, results):
+        irs[form_index].append(ir)
+    return irs
+
+
+def _compute_integral_ir_collect(*args):
+    """Compute intermediate representation of an integral in a worker process, with its telemetry."""
+    with telemetry.collect({}) as record:
+        ir = _compute_integral_ir(*args)
+    return ir, record
+
+
+def _compute_integral_ir(form_data, form_index, itg_data_index, prefix, element_numbers, integral_names,
                          parameters, visualise):
-    """Compute intermediate represention for form integrals."""
-    if form_data.representation == "uflacs":
+    """Compute intermediate represention of a form integral."""
+    if form_data.representation in ("uflacs", "tensor", "adaptive"):
+        # The tensor representation extends uflacs, "adaptive" chooses
+        # between them for each block of each integral
         from ffcx.ir.uflacs.uflacsrepresentation import compute_integral_ir
     elif form_data.representation == "tsfc":
         from ffcx.ir.tsfcrepresentation import compute_integral_ir
@@ -357,43 +403,75 @@ def _compute_integral_ir(form_data, form_index, prefix, element_numbers, integra
         "custom": "cell"
     }
 
-    # Iterate over integrals
-    irs = []
-    for itg_data_index, itg_data in enumerate(form_data.integral_data):
-
-        # Compute representation
-        entitytype = _entity_types[itg_data.integral_type]
-        cell = itg_data.domain.ufl_cell()
-        tdim = cell.topological_dimension()
-        assert all(tdim == itg.ufl_domain().topological_dimension() for itg in itg_data.integrals)
-
-        ir = {
-            "representation": form_data.representation,
-            "integral_type": itg_data.integral_type,
-            "subdomain_id": itg_data.subdomain_id,
-            "rank": form_data.rank,
-            "geometric_dimension": form_data.geometric_dimension,
-            "topological_dimension": tdim,
-            "entitytype": entitytype,
-            "num_facets": cell.num_facets(),
-            "num_vertices": cell.num_vertices(),
-            "needs_oriented": form_needs_oriented_jacobian(form_data),
-            "enabled_coefficients": itg_data.enabled_coefficients
-        }
+    # Compute representation
+    itg_data = form_data.integral_data[itg_data_index]
+    entitytype = _entity_types[itg_data.integral_type]
+    cell = itg_data.domain.ufl_cell()
+    tdim = cell.topological_dimension()
+    assert all(tdim == itg.ufl_domain().topological_dimension() for itg in itg_data.integrals)
+
+    ir = {
+        "representation": form_data.representation,
+        "integral_type": itg_data.integral_type,
+        "subdomain_id": itg_data.subdomain_id,
+        "rank": form_data.rank,
+        "geometric_dimension": form_data.geometric_dimension,
+        "topological_dimension": tdim,
+        "entitytype": entitytype,
+        "num_facets": cell.num_facets(),
+        "num_vertices": cell.num_vertices(),
+        "needs_oriented": form_needs_oriented_jacobian(form_data),
+        "enabled_coefficients": itg_data.enabled_coefficients
+    }
 
+    # Fetch name
+    name = integral_names[(form_index, itg_data_index)]
+
+    with telemetry.timer("ir", telemetry.integral_record(name)):
         ir = compute_integral_ir(ir, itg_data, form_data, element_numbers,
                                  parameters, visualise)
+    ir["name"] = name
 
-        # Fetch name
-        ir["name"] = integral_names[(form_index, itg_data_index)]
+    return ir_integral(**ir)
 
-        irs.append(ir_integral(**ir))
 
-    return irs
+def _compute_fused_integral_ir(form_data, irs, parameters, visualise):
+    """Compute intermediate representation of the cell integrals of all forms fused into one kernel.
+
+    A fused integral is computed for each subdomain with a cell integral
+    in all forms, if the forms are defined on the same domain and the
+    integrals have a representation reading precomputed geometry.
+    """
+    if len(form_data) < 2 or len(set(fd.original_form.ufl_domain() for fd in form_data)) > 1:
+        return []
+
+    from ffcx.ir.uflacs.uflacsrepresentation import compute_fused_integral_ir
+
+    cell_integrals = [{ir.subdomain_id: ir for ir in form_irs if ir.integral_type == "cell"} for form_irs in irs]
+    ir_fused_integrals = []
+    for subdomain_id in cell_integrals[0]:
+        integral_irs = [integrals.get(subdomain_id) for integrals in cell_integrals]
+        if any(ir is None or ir.geometry_ir is None or not ir.params["tabulate_fused"] for ir in integral_irs):
+            continue
+
+        # Integrals reading precomputed geometry
+        integral_irs = [ir._replace(action_ir=None, geometry_ir=None,
+                                    **{k: v for k, v in ir.geometry_ir.items() if not k.startswith("geometry_")})
+                        for ir in integral_irs]
+        ir = compute_fused_integral_ir(integral_irs, form_data[0].original_form.ufl_domain(), parameters,
+                                       visualise)
+        if ir is None:
+            continue
+        ir["name"] = naming.fused_integral_name("cell", [fd.original_form for fd in form_data], subdomain_id)
+        ir["subdomain_id"] = subdomain_id
+        ir["integrals"] = integral_irs
+        ir_fused_integrals.append(ir_fused_integral(**ir))
+
+    return ir_fused_integrals
 
 
 def _compute_form_ir(form_data, form_id, prefix, element_numbers, finite_element_names,
-                     dofmap_names, coordinate_mapping_names, object_names):
+                     dofmap_names, coordinate_mapping_names, object_names, ir_fused_integrals):
     """Compute intermediate representation of form."""
 
     # Store id
@@ -450,6 +528,12 @@ def _compute_form_ir(form_data, form_id, prefix, element_numbers, finite_element
         ir["create_{}_integral".format(integral_type)] = irdata
         ir["get_{}_integral_ids".format(integral_type)] = irdata
 
+    # Fused cell integrals of all forms, the default integral on
+    # subdomain -1
+    ir["create_fused_cell_integral"] = (
+        [-1 if fused_ir.subdomain_id == "otherwise" else fused_ir.subdomain_id for fused_ir in ir_fused_integrals],
+        [fused_ir.name for fused_ir in ir_fused_integrals])
+
     return ir_form(**ir)
 
 
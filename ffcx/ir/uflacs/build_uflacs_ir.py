@@ -20,10 +20,14 @@ from ffcx.ir.uflacs.analysis.modified_terminals import (
 from ffcx.ir.uflacs.analysis.visualise import visualise_graph
 from ffcx.ir.uflacs.elementtables import (build_optimized_tables,
                                           clamp_table_small_numbers,
-                                          piecewise_ttypes)
+                                          equal_tables,
+                                          factorize_tensor_product_table,
+                                          piecewise_ttypes,
+                                          tensor_product_grid)
 from ufl.algorithms.balancing import balance_modifiers
 from ufl.checks import is_cellwise_constant
-from ufl.classes import CellCoordinate, FacetCoordinate, QuadratureWeight
+from ufl.classes import (Argument, CellCoordinate, Coefficient,
+                         FacetCoordinate, QuadratureWeight)
 from ufl.measure import facet_integral_types, point_integral_types
 
 logger = logging.getLogger(__name__)
@@ -32,7 +36,8 @@ ma_data_t = collections.namedtuple("ma_data_t", ["ma_index", "tabledata"])
 
 block_data_t = collections.namedtuple("block_data_t",
                                       ["block_mode",
-                                       # "safe" | "full" | "preintegrated" | "premultiplied"
+                                       # "safe" | "full" | "preintegrated" | "premultiplied" | "partial"
+                                       # | "factorized" | "tensor"
                                        "ttypes",  # list of table types for each block rank
                                        "factor_indices_comp_indices",  # list of tuples (factor index, component index)
                                        "factor_is_piecewise",
@@ -43,11 +48,20 @@ block_data_t = collections.namedtuple("block_data_t",
                                        "transposed",  # block is the transpose of another
                                        "is_uniform",  # used in "preintegrated" and "premultiplied"
                                        "name",  # used in "preintegrated" and "premultiplied"
-                                       "ma_data",  # used in "full", "safe" and "partial"
+                                       "ma_data",  # used in "full", "safe", "partial" and "factorized"
                                        "piecewise_ma_index",  # used in "partial"
-                                       "is_permuted"  # Do quad points on facets need to be permuted?
+                                       "is_permuted",  # Do quad points on facets need to be permuted?
+                                       "monomials",  # used in "tensor"
+                                       "symmetry"
+                                       # None | "symmetric": block is symmetric
+                                       # | "mirrored": block transpose is also added to A
                                        ])
 
+# A term sum_c G * prod_k w_k[c_k] * PT[c][...] of a block in "tensor" mode,
+# with G = sum_t (scale_t * prod numerators_t / prod denominators_t) of piecewise
+# expressions, and w_k the dofs of the coefficients
+tensor_monomial_t = collections.namedtuple("tensor_monomial_t", ["name", "coefficients", "terms"])
+
 
 def multiply_block_interior_facets(point_index, unames, ttypes, unique_tables,
                                    unique_table_num_dofs):
@@ -140,6 +154,172 @@ def integrate_block_interior_facets(weights, unames, ttypes, unique_tables, uniq
     return ptable
 
 
+def factorized_block_cost(factor_shapes):
+    """Return the number of multiply-adds of a sum factorized block.
+
+    factor_shapes[i][d] is the (num_points, num_dofs) shape of the
+    factor of argument i in direction d. The contractions over the
+    points are done one direction at a time, from the last direction to
+    the first."""
+    tdim = len(factor_shapes[0])
+    cost = 0
+    for d in range(tdim):
+        c = numpy.prod([shape[0] for shape in factor_shapes[0][:d + 1]])
+        for shapes in factor_shapes:
+            c *= numpy.prod([shape[1] for shape in shapes[d:]])
+        cost += c
+    return int(cost)
+
+
+def factorized_coefficient_cost(factor_shapes):
+    """Return the number of multiply-adds of evaluating a coefficient in all points by sum factorization.
+
+    factor_shapes[d] is the (num_points, num_dofs) shape of the factor
+    in direction d. The contractions over the dofs are done one
+    direction at a time, from the last direction to the first."""
+    tdim = len(factor_shapes)
+    cost = 0
+    for d in range(tdim):
+        c = numpy.prod([shape[1] for shape in factor_shapes[:d + 1]])
+        c *= numpy.prod([shape[0] for shape in factor_shapes[d:]])
+        cost += c
+    return int(cost)
+
+
+def build_tensor_factor_tables(F, num_points, points, unique_tables, unique_table_types,
+                               rtol, atol):
+    """Factorize the tables of arguments and coefficients over a tensor product grid of points.
+
+    Finds the tables of tensor product elements that are products of
+    one table per direction of the grid. The factors are added to
+    unique_tables. Returns a dict mapping the name of each factorized
+    table to the names of its factors, and the indices of the
+    coefficient nodes of F that are cheaper to evaluate by sum
+    factorization."""
+    point_counts = tensor_product_grid(points, rtol=rtol, atol=atol)
+    if point_counts is None:
+        return {}, set()
+
+    factorizations = {}
+    factor_names = []
+    coefficient_nodes = set()
+    for i, v in F.nodes.items():
+        tr = v.get('tr')
+        if tr is None:
+            continue
+        mt = v['mt']
+
+        # Coefficients are evaluated in all points by sum factorization,
+        # their dofs must be contiguous to be indexed by direction
+        if isinstance(mt.terminal, Coefficient):
+            begin, end = tr.dofrange
+            if v['status'] != 'varying' or len(tr.dofmap) != end - begin:
+                continue
+        elif not isinstance(mt.terminal, Argument):
+            continue
+
+        # Elements mapped by a Piola transform have dofs reflected by
+        # the cell orientation
+        if (tr.ttype not in ("varying", "uniform") or tr.is_permuted
+                or mt.terminal.ufl_element().mapping() != "identity"):
+            continue
+
+        if tr.name not in factorizations:
+            factors = factorize_tensor_product_table(unique_tables[tr.name][0, 0], point_counts,
+                                                     rtol=rtol, atol=atol)
+            if factors is not None:
+                # Reuse equal factors, also of other tables
+                names = []
+                for factor in factors:
+                    factor = factor.reshape((1, 1) + factor.shape)
+                    for name in factor_names:
+                        if equal_tables(unique_tables[name], factor, rtol=rtol, atol=atol):
+                            break
+                    else:
+                        name = "FT%d_Q%d" % (len(factor_names), num_points)
+                        factor_names.append(name)
+                        unique_tables[name] = factor
+                        unique_table_types[name] = "varying"
+                    names.append(name)
+                factors = tuple(names)
+            factorizations[tr.name] = factors
+
+        factors = factorizations[tr.name]
+        if factors is not None and isinstance(mt.terminal, Coefficient):
+            shapes = [unique_tables[name].shape[2:] for name in factors]
+            if factorized_coefficient_cost(shapes) < num_points * len(tr.dofmap):
+                coefficient_nodes.add(i)
+
+    tensor_factors = {name: factors for name, factors in factorizations.items() if factors is not None}
+    return tensor_factors, coefficient_nodes
+
+
+def expand_monomials(F, i, max_terms=64):
+    """Expand a factor as a polynomial in the values of varying coefficients.
+
+    Returns a dict mapping the tuples of the indices of the coefficient
+    nodes of F in each monomial to the coefficient of the monomial, a
+    list of terms (scale, numerators, denominators) with the numerators
+    and denominators given by indices of piecewise nodes of F. Returns
+    None if the factor is not such a polynomial, or has more than
+    max_terms terms.
+    """
+    v = F.nodes[i]
+    expr = v['expression']
+    if v['status'] == 'piecewise':
+        return {(): [(1.0, (i, ), ())]}
+
+    mt = v.get('mt')
+    if mt is not None:
+        # The value of a coefficient is linear in its dofs, which must
+        # be contiguous
+        tr = v.get('tr')
+        if (isinstance(mt.terminal, Coefficient) and tr is not None and tr.ttype in ("varying", "uniform")
+                and not tr.is_permuted and len(tr.dofmap) == tr.dofrange[1] - tr.dofrange[0]):
+            return {(i, ): [(1.0, (), ())]}
+        return None
+
+    operands = [F.e2i[o] for o in expr.ufl_operands]
+    if isinstance(expr, ufl.classes.Sum):
+        monomials = collections.defaultdict(list)
+        for j in operands:
+            m = expand_monomials(F, j, max_terms)
+            if m is None:
+                return None
+            for key, terms in m.items():
+                monomials[key] += terms
+    elif isinstance(expr, ufl.classes.Product):
+        a, b = (expand_monomials(F, j, max_terms) for j in operands)
+        if a is None or b is None:
+            return None
+        monomials = collections.defaultdict(list)
+        for (ka, ta), (kb, tb) in itertools.product(a.items(), b.items()):
+            monomials[tuple(sorted(ka + kb))] += [(sa * sb, na + nb, da + db)
+                                                  for (sa, na, da), (sb, nb, db) in itertools.product(ta, tb)]
+    elif isinstance(expr, ufl.classes.Division) and F.nodes[operands[1]]['status'] == 'piecewise':
+        monomials = expand_monomials(F, operands[0], max_terms)
+        if monomials is None:
+            return None
+        monomials = {key: [(s, n, d + (operands[1], )) for s, n, d in terms] for key, terms in monomials.items()}
+    else:
+        return None
+
+    if sum(len(terms) for terms in monomials.values()) > max_terms:
+        return None
+    return dict(monomials)
+
+
+def integrate_monomial(weights, tables):
+    """Return the tensor sum_q weights[q] * prod_k tables[k][q, i_k] with one axis i_k per table.
+
+    Tables with a single row are constant over the points."""
+    A = numpy.asarray(weights)
+    for table in tables:
+        table = numpy.broadcast_to(table, (len(weights), table.shape[-1]))
+        A = A[..., numpy.newaxis] * table.reshape((len(weights), ) + (1, ) * (A.ndim - 1) + (table.shape[-1], ))
+    return A.sum(axis=0)
+
+
 def uflacs_default_parameters(optimize):
     """Default parameters for tuning of uflacs code generation.
 
@@ -164,14 +344,44 @@ def uflacs_default_parameters(optimize):
         "enable_premultiplication": False,
         "enable_sum_factorization": False,
         "enable_block_transpose_reuse": False,
+        "enable_symmetric_blocks": False,
         "enable_table_zero_compression": False,
+        "enable_tensor_factorization": False,
 
         # Code generation parameters
         "vectorize": False,
         "alignas": 0,
         "assume_aligned": None,
         "padlen": 1,
-        "use_symbol_array": True
+        "use_symbol_array": True,
+
+        # Generate a kernel tabulating the tensors of a batch of cells
+        "tabulate_tensor_batch": False,
+
+        # Generate a kernel computing the action A_K x of the element
+        # matrix of bilinear forms
+        "tabulate_action": False,
+
+        # Generate a kernel computing the diagonal of the element matrix
+        # of bilinear forms
+        "tabulate_diagonal": False,
+
+        # Generate a kernel computing the geometry at the quadrature
+        # points of cell integrals, and a kernel reading it
+        "tabulate_geometry": False,
+
+        # Generate a kernel tabulating the nonzero blocks of sub-spaces
+        # of the element tensors of mixed forms only
+        "tabulate_compact": False,
+
+        # Generate a kernel tabulating the upper triangle of symmetric
+        # element matrices in packed row-major storage
+        "tabulate_packed": False,
+
+        # Generate a kernel tabulating the cell integrals of all forms
+        # compiled together, sharing the evaluation of the geometry and
+        # the coefficients
+        "tabulate_fused": False
     }
     if optimize:
         # Override defaults if optimization is turned on
@@ -182,7 +392,9 @@ def uflacs_default_parameters(optimize):
             "enable_premultiplication": False,
             "enable_sum_factorization": True,
             "enable_block_transpose_reuse": True,
+            "enable_symmetric_blocks": True,
             "enable_table_zero_compression": True,
+            "enable_tensor_factorization": True,
 
             # Code generation parameters
             "vectorize": False,
@@ -215,6 +427,13 @@ def parse_uflacs_optimization_parameters(parameters, integral_type):
                 value = float(value)
             p[key] = value
 
+    # Vectorized code works on whole SIMD registers, with the arrays
+    # aligned and padded to the register size
+    if p["vectorize"]:
+        p["alignas"] = max(p["alignas"], 32)
+        if p["padlen"] == 1:
+            p["padlen"] = p["alignas"] // 8
+
     # Conditionally disable some optimizations based on integral type,
     # i.e. these options are not valid for certain integral types
     skip_preintegrated = point_integral_types + ufl.custom_integral_types
@@ -229,7 +448,15 @@ def parse_uflacs_optimization_parameters(parameters, integral_type):
 
 
 def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
-                    quadrature_rules, parameters, visualise):
+                    quadrature_rules, parameters, visualise, representation="uflacs"):
+    """Build the uflacs intermediate representation of an integral.
+
+    The "tensor" representation integrates the blocks with factors that
+    are polynomials in the coefficient values by contracting reference
+    tensors, precomputed here, with the coefficient dofs and piecewise
+    factors. The "adaptive" representation does so for the blocks where it
+    takes fewer operations than quadrature.
+    """
     # The intermediate representation dict we're building and returning
     # here
     ir = {}
@@ -250,6 +477,7 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
                           "modified_arguments": [],
                           "preintegrated_blocks": {},
                           "premultiplied_blocks": {},
+                          "reference_tensors": {},
                           "preintegrated_contributions": collections.defaultdict(list),
                           "block_contributions": collections.defaultdict(list)}
 
@@ -391,14 +619,37 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
         # Attach 'status' to each node: 'inactive', 'piecewise' or 'varying'
         analyse_dependencies(F, mt_unique_table_reference)
 
+        # Factorize tables of tensor product elements on quadrilaterals
+        # and hexahedra, to integrate with sum factorization
+        if (p["enable_tensor_factorization"] and integral_type == "cell" and num_points > 1
+                and cell.cellname() in ("quadrilateral", "hexahedron")):
+            tensor_factors, factorized_coefficients = build_tensor_factor_tables(
+                F, num_points, quadrature_rules[num_points][0], unique_tables, unique_table_types,
+                rtol=p["table_rtol"], atol=p["table_atol"])
+        else:
+            tensor_factors, factorized_coefficients = {}, set()
+
         # Save the factorisation graph to the piecewise IR
         ir["piecewise_ir"]["factorization"] = F
         ir["piecewise_ir"]["modified_arguments"] = [F.nodes[i]['mt']
                                                     for i in argkeys]
 
+        # Find the terms with symmetric blocks and the pairs of terms
+        # with transposed blocks, of which one is dropped
+        if p["enable_symmetric_blocks"] and rank == 2 and integral_type in ("cell", "exterior_facet"):
+            symmetries = analyse_block_symmetries(F, argument_factorization)
+        else:
+            symmetries = {}
+
         # Loop over factorization terms
         block_contributions = collections.defaultdict(list)
+        tensor_blocks = []
+        quadrature_block_factors = []
         for ma_indices, fi_ci in sorted(argument_factorization.items()):
+            symmetry = symmetries.get(ma_indices)
+            if symmetry == "dropped":
+                continue
+
             # Get a bunch of information about this term
             assert rank == len(ma_indices)
             trs = tuple(F.nodes[ai]['tr'] for ai in ma_indices)
@@ -425,6 +676,14 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
             # Check if each *each* factor corresponding to this argument is piecewise
             factor_is_piecewise = all(F.nodes[ifi[0]]["status"] == 'piecewise' for ifi in fi_ci)
 
+            # Expand a varying factor in monomials of coefficient values
+            # with piecewise coefficients, for contraction with
+            # reference tensors
+            monomials = None
+            if (representation in ("tensor", "adaptive") and integral_type == "cell" and rank > 0
+                    and not factor_is_piecewise and len(fi_ci) == 1 and "quadrature" not in ttypes):
+                monomials = expand_monomials(F, fi_ci[0][0])
+
             # TODO: Add separate block modes for quadrature
             # Both arguments in quadrature elements
             """
@@ -479,6 +738,31 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
                 # on
                 block_mode = "safe"
 
+            if block_mode in ("full", "safe") and rank > 0 and all(name in tensor_factors for name in unames):
+                # Integrate the tensor product of the arguments with sum
+                # factorization if that takes fewer operations:
+                # FQ[q] = weight * f;                      generated inside quadloop
+                # B[...] = sum_q FQ[q] * u[i] * v[j];      contracted one direction
+                #                                          at a time after quadloop
+                factor_shapes = [[unique_tables[name].shape[2:] for name in tensor_factors[uname]]
+                                 for uname in unames]
+                if factorized_block_cost(factor_shapes) < num_points * numpy.prod(
+                        [unique_table_num_dofs[name] for name in unames]):
+                    block_mode = "factorized"
+
+            if monomials is not None and block_mode not in ("preintegrated", "premultiplied"):
+                # Compare the operation counts of the contractions and
+                # of quadrature, including the coefficient evaluations
+                block_size = numpy.prod([unique_table_num_dofs[name] for name in unames])
+                coefficient_nodes = set(j for key in monomials for j in key)
+                tensor_cost = sum(
+                    numpy.prod([unique_table_num_dofs[F.nodes[j]['tr'].name] for j in key]) * (block_size + len(key))
+                    for key in monomials)
+                quadrature_cost = num_points * (block_size + len(monomials) + sum(
+                    unique_table_num_dofs[F.nodes[j]['tr'].name] for j in coefficient_nodes))
+                if representation == "tensor" or tensor_cost < quadrature_cost:
+                    block_mode = "tensor"
+
             # Carry out decision
             if block_mode == "preintegrated":
                 # Add to contributions:
@@ -526,7 +810,49 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
                 blockdata = block_data_t(
                     block_mode, ttypes, fi_ci, factor_is_piecewise, block_unames,
                     block_restrictions, block_is_transposed, block_is_uniform, pname,
-                    None, None, block_is_permuted)
+                    None, None, block_is_permuted, None, None)
+                block_is_piecewise = True
+
+            elif block_mode == "tensor":
+                # Add to contributions:
+                # PT[c][...] = sum_q weight * prod_k f_k[c_k] * u * v;  precomputed here
+                # B[...] = sum_c G * prod_k w_k[c_k] * PT[c][...];     generated after quadloop
+                # A[blockmap] += B[...];                                generated after quadloop
+                # for each monomial G * prod_k f_k of the factor, with
+                # G piecewise and f_k = sum_c w_k[c] * FE_k[c]
+
+                cache = ir["piecewise_ir"]["reference_tensors"]
+                weights = quadrature_rules[num_points][1]
+                block_monomials = []
+                for key, terms in sorted(monomials.items()):
+                    coefficients = tuple((F.nodes[j]['mt'], F.nodes[j]['tr']) for j in key)
+                    table_names = tuple(tr.name for mt, tr in coefficients) + unames
+                    pname = cache.get((num_points, table_names))
+                    if pname is None:
+                        tables = []
+                        for name in table_names:
+                            table = unique_tables.get(name)
+                            if table is None:
+                                table = numpy.ones((1, 1, 1, unique_table_num_dofs[name]))
+                            tables.append(table[0, 0])
+                        ptable = clamp_table_small_numbers(
+                            integrate_monomial(weights, tables), rtol=p["table_rtol"], atol=p["table_atol"])
+
+                        pname = "PT%d" % (len(cache), )
+                        cache[(num_points, table_names)] = pname
+                        unique_tables[pname] = ptable
+                        unique_table_types[pname] = "tensor"
+                        ir["table_origins"][pname] = unames
+
+                    terms = tuple((scale, tuple(F.nodes[j]['expression'] for j in numerators),
+                                   tuple(F.nodes[j]['expression'] for j in denominators))
+                                  for scale, numerators, denominators in terms)
+                    block_monomials.append(tensor_monomial_t(pname, coefficients, terms))
+
+                blockdata = block_data_t(
+                    block_mode, ttypes, fi_ci, factor_is_piecewise, unames,
+                    block_restrictions, False, block_is_uniform, None,
+                    None, None, False, tuple(block_monomials), None)
                 block_is_piecewise = True
 
             elif block_mode == "premultiplied":
@@ -570,7 +896,7 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
                 blockdata = block_data_t(
                     block_mode, ttypes, fi_ci, factor_is_piecewise, block_unames,
                     block_restrictions, block_is_transposed, block_is_uniform, pname, None, None,
-                    block_is_permuted)
+                    block_is_permuted, None, None)
                 block_is_piecewise = False
 
 #           elif block_mode == "scaled":
@@ -584,7 +910,7 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
 #               # premultiplied, except no P table name or values)
 #               block_is_piecewise = False
 
-            elif block_mode in ("partial", "full", "safe"):
+            elif block_mode in ("partial", "full", "safe", "factorized"):
                 block_is_piecewise = factor_is_piecewise and not expect_weight
                 block_is_permuted = False
                 ma_data = []
@@ -612,8 +938,9 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
                     blockdata = block_data_t(block_mode, ttypes, fi_ci,
                                              factor_is_piecewise, block_unames,
                                              block_restrictions, block_is_transposed,
-                                             None, None, tuple(ma_data), piecewise_ma_index, block_is_permuted)
-                elif block_mode in ("full", "safe"):
+                                             None, None, tuple(ma_data), piecewise_ma_index, block_is_permuted,
+                                             None, None)
+                elif block_mode in ("full", "safe", "factorized"):
                     # Add to contributions:
                     # B[i] = sum_q weight * f * u[i] * v[j];  generated inside quadloop
                     # A[blockmap] += B[i];                    generated after quadloop
@@ -622,10 +949,17 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
                     blockdata = block_data_t(block_mode, ttypes, fi_ci,
                                              factor_is_piecewise, block_unames,
                                              block_restrictions, block_is_transposed,
-                                             None, None, tuple(ma_data), None, block_is_permuted)
+                                             None, None, tuple(ma_data), None, block_is_permuted, None, None)
             else:
                 raise RuntimeError("Invalid block_mode %s" % (block_mode, ))
 
+            blockdata = blockdata._replace(symmetry=symmetry)
+
+            if block_mode == "tensor":
+                tensor_blocks.append(blockdata)
+            else:
+                quadrature_block_factors += [ifi[0] for ifi in fi_ci]
+
             if block_is_piecewise:
                 # Insert in piecewise expr_ir
                 ir["piecewise_ir"]["block_contributions"][blockmap].append(blockdata)
@@ -633,13 +967,40 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
                 # Insert in varying expr_ir for this quadrature loop
                 block_contributions[blockmap].append(blockdata)
 
+        # Blocks contracted with reference tensors only need the
+        # piecewise coefficients of their monomials, update the status
+        # of the nodes they no longer depend on
+        if tensor_blocks:
+            targets = quadrature_block_factors
+            for blockdata in tensor_blocks:
+                for monomial in blockdata.monomials:
+                    for scale, numerators, denominators in monomial.terms:
+                        targets += [F.e2i[e] for e in numerators + denominators]
+            analyse_dependencies(F, mt_unique_table_reference, targets)
+            factorized_coefficients = set(i for i in factorized_coefficients if F.nodes[i]['status'] == 'varying')
+
+        # Keep the factors of the tables of coefficients and of the
+        # arguments of factorized blocks
+        factorized_tables = set(
+            mad.tabledata.name for contributions in block_contributions.values()
+            for blockdata in contributions if blockdata.block_mode == "factorized"
+            for mad in blockdata.ma_data)
+        for i in factorized_coefficients:
+            factorized_tables.add(F.nodes[i]['tr'].name)
+        tensor_factors = {name: factors for name, factors in tensor_factors.items()
+                          if name in factorized_tables}
+
         # Figure out which table names are referenced in unstructured
         # partition
         active_table_names = set()
         for i, v in F.nodes.items():
             tr = v.get('tr')
             if tr is not None and F.nodes[i]['status'] != 'inactive':
-                active_table_names.add(tr.name)
+                if i in factorized_coefficients:
+                    # Coefficient evaluated by sum factorization
+                    active_table_names.update(tensor_factors[tr.name])
+                else:
+                    active_table_names.add(tr.name)
 
         # Figure out which table names are referenced in blocks
         for blockmap, contributions in itertools.chain(
@@ -647,9 +1008,14 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
             for blockdata in contributions:
                 if blockdata.block_mode in ("preintegrated", "premultiplied"):
                     active_table_names.add(blockdata.name)
+                elif blockdata.block_mode == "tensor":
+                    active_table_names.update(monomial.name for monomial in blockdata.monomials)
                 elif blockdata.block_mode in ("partial", "full", "safe"):
                     for mad in blockdata.ma_data:
                         active_table_names.add(mad.tabledata.name)
+                elif blockdata.block_mode == "factorized":
+                    for mad in blockdata.ma_data:
+                        active_table_names.update(tensor_factors[mad.tabledata.name])
 
         # Record all table types before dropping tables
         ir["unique_table_types"].update(unique_table_types)
@@ -724,20 +1090,58 @@ def build_uflacs_ir(cell, integral_type, entitytype, integrands, argument_shape,
         ir["varying_irs"][num_points] = {"factorization": F,
                                          "modified_arguments": [F.nodes[i]['mt'] for i in argkeys],
                                          "block_contributions": block_contributions,
+                                         "tensor_factors": tensor_factors,
+                                         "factorized_coefficients": factorized_coefficients,
                                          "need_points": need_points,
                                          "need_weights": need_weights}
     return ir
 
 
-def analyse_dependencies(F, mt_unique_table_reference):
+def analyse_block_symmetries(F, argument_factorization):
+    """Find the terms of a bilinear integrand with symmetric or transposed blocks.
+
+    The block of a term is the transpose of the block of the term with
+    the tables of the arguments swapped and the same factor, and is
+    symmetric if the arguments have the same table. Returns a dict with
+    "symmetric" for the terms with symmetric blocks, "mirrored" for the
+    terms with blocks also added transposed to the element tensor and
+    "dropped" for the terms they replace.
+    """
+    terms = {}
+    for ma_indices, fi_ci in sorted(argument_factorization.items()):
+        trs = tuple(F.nodes[ai]['tr'] for ai in ma_indices)
+        if any(tr.ttype == "quadrature" for tr in trs):
+            continue
+        key = (trs[0].name, trs[0].dofmap, trs[1].name, trs[1].dofmap, tuple(fi_ci))
+        terms.setdefault(key, ma_indices)
+
+    symmetries = {}
+    for (name0, dofmap0, name1, dofmap1, fi_ci), ma_indices in terms.items():
+        if ma_indices in symmetries:
+            continue
+        if (name0, dofmap0) == (name1, dofmap1):
+            symmetries[ma_indices] = "symmetric"
+        else:
+            transposed = terms.get((name1, dofmap1, name0, dofmap0, fi_ci))
+            if transposed is not None:
+                symmetries[ma_indices] = "mirrored"
+                symmetries[transposed] = "dropped"
+    return symmetries
+
+
+def analyse_dependencies(F, mt_unique_table_reference, targets=None):
     # Sets 'status' of all nodes to either: 'inactive', 'piecewise' or 'varying'
     # Children of 'target' nodes are either 'piecewise' or 'varying'.
     # All other nodes are 'inactive'.
     # Varying nodes are identified by their tables ('tr'). All their parent
     # nodes are also set to 'varying' - any remaining active nodes are 'piecewise'.
+    # The targets default to the nodes marked as 'target'.
 
     # Set targets, and dependencies to 'active'
-    targets = [i for i, v in F.nodes.items() if v.get('target')]
+    if targets is None:
+        targets = [i for i, v in F.nodes.items() if v.get('target')]
+    else:
+        targets = list(targets)
     for i, v in F.nodes.items():
         v['status'] = 'inactive'
 
@@ -766,10 +1170,13 @@ def analyse_dependencies(F, mt_unique_table_reference):
                     raise RuntimeError("Invalid ttype %s" % (ttype, ))
 
         elif not is_cellwise_constant(v['expression']):
-            raise RuntimeError("Error")
-            # Keeping this check to be on the safe side,
-            # not sure which cases this will cover (if any)
-            # varying_indices.append(i)
+            # The Jacobian determinant and inverse are only terminals
+            # when read from precomputed geometry, which varies over
+            # the points of non-affine cells
+            if not isinstance(v['mt'].terminal, (ufl.classes.JacobianDeterminant,
+                                                 ufl.classes.JacobianInverse)):
+                raise RuntimeError("Error")
+            varying_indices.append(i)
 
     # Set all parents of active varying nodes to 'varying'
     while varying_indices:
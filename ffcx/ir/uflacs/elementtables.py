@@ -5,13 +5,17 @@
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 """Tools for precomputed tables of terminal values."""
 
+import bisect
 import collections
+import hashlib
 import logging
+import threading
 
 import numpy
 
 import ufl
 import ufl.utils.derivativetuples
+from ffcx import telemetry
 from ffcx.fiatinterface import create_element
 from ffcx.ir.representationutils import (create_quadrature_points_and_weights,
                                          integral_type_to_entity_dim,
@@ -24,7 +28,7 @@ default_rtol = 1e-5
 default_atol = 1e-8
 
 table_origin_t = collections.namedtuple(
-    "table_origin", ["element", "avg", "derivatives", "flat_component", "dofrange", "dofmap"])
+    "table_origin_t", ["element", "avg", "derivatives", "flat_component", "dofrange", "dofmap"])
 
 piecewise_ttypes = ("piecewise", "fixed", "ones", "zeros")
 
@@ -33,10 +37,71 @@ uniform_ttypes = ("uniform", "fixed", "ones", "zeros")
 valid_ttypes = set(("quadrature", )) | set(piecewise_ttypes) | set(uniform_ttypes)
 
 unique_table_reference_t = collections.namedtuple(
-    "unique_table_reference",
+    "unique_table_reference_t",
     ["name", "values", "dofrange", "dofmap", "original_dim", "ttype", "is_piecewise", "is_uniform",
      "is_permuted"])
 
+tabulation_cache_info_t = collections.namedtuple(
+    "tabulation_cache_info", ["hits", "misses", "maxsize", "currsize"])
+
+
+class TabulationCache(object):
+    """Bounded LRU cache of the tabulations of FIAT elements.
+
+    The tabulation of an element at a set of points is kept for the
+    highest derivative order requested, and tabulations of lower orders
+    are read from it. The tables are read-only.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._tables = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def tabulate(self, fiat_element, deriv_order, points):
+        """Return the tables of the derivatives of fiat_element at points up to order deriv_order."""
+        points = numpy.ascontiguousarray(points, dtype=float)
+        key = (fiat_element, points.shape, hashlib.sha1(points.tobytes()).hexdigest())
+        with self._lock:
+            cached = self._tables.get(key)
+            if cached is not None and cached[0] >= deriv_order:
+                self._tables.move_to_end(key)
+                self.hits += 1
+                telemetry.add("tabulation_hits", 1)
+                return cached[1]
+            self.misses += 1
+            telemetry.add("tabulation_misses", 1)
+
+        tables = fiat_element.tabulate(deriv_order, points)
+        for table in tables.values():
+            table.setflags(write=False)
+
+        with self._lock:
+            if self.maxsize > 0:
+                self._tables[key] = (deriv_order, tables)
+                self._tables.move_to_end(key)
+                while len(self._tables) > self.maxsize:
+                    self._tables.popitem(last=False)
+        return tables
+
+    def info(self):
+        """Return the numbers of hits and misses, and the maximum and current sizes of the cache."""
+        with self._lock:
+            return tabulation_cache_info_t(self.hits, self.misses, self.maxsize, len(self._tables))
+
+    def clear(self):
+        """Empty the cache and reset its statistics."""
+        with self._lock:
+            self._tables.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# Tabulations of the elements of all forms compiled by this process
+tabulation_cache = TabulationCache()
+
 
 # TODO: Get restriction postfix from somewhere central
 def ufc_restriction_offset(restriction, length):
@@ -100,30 +165,137 @@ def build_unique_tables(tables, rtol=default_rtol, atol=default_atol):
     """Return list of unique tables.
 
     Given a list or dict of tables, return a list of unique tables
-    and a dict of unique table indices for each input table key."""
+    and a dict of unique table indices for each input table key.
+
+    Each table is mapped to the first unique table equal to it by
+    equal_tables. To avoid comparing it with all unique tables, these
+    are sorted by a random projection of their values for each shape,
+    and only those with a projection within the bound on the difference
+    implied by the tolerances are compared.
+    """
     unique = []
     mapping = {}
 
+    # Projection weights, sorted projections and indices of the unique
+    # tables of each shape
+    index = {}
+
     if isinstance(tables, list):
         keys = list(range(len(tables)))
     elif isinstance(tables, dict):
         keys = sorted(tables.keys())
 
     for k in keys:
-        t = tables[k]
+        t = numpy.asarray(tables[k])
+        if t.shape not in index:
+            weights = numpy.random.RandomState(0).uniform(-1.0, 1.0, t.shape)
+            index[t.shape] = (weights, [], [])
+        weights, projections, indices = index[t.shape]
+
+        # Tables u with |u - t| <= atol + rtol*|t| have projections
+        # within r of the projection of t, with a margin for rounding
+        p = numpy.sum(weights * t)
+        r = numpy.sum(numpy.abs(weights) * (atol + rtol * numpy.abs(t)))
+        r += 4 * t.size * numpy.finfo(float).eps * (numpy.sum(numpy.abs(weights * t)) + r)
+        begin = bisect.bisect_left(projections, p - r)
+        end = bisect.bisect_right(projections, p + r)
+
         found = -1
-        for i, u in enumerate(unique):
-            if equal_tables(u, t, rtol=rtol, atol=atol):
+        for i in sorted(indices[begin:end]):
+            if equal_tables(unique[i], t, rtol=rtol, atol=atol):
                 found = i
                 break
         if found == -1:
-            i = len(unique)
-            unique.append(t)
-        mapping[k] = i
+            found = len(unique)
+            unique.append(tables[k])
+            position = bisect.bisect_right(projections, p)
+            projections.insert(position, p)
+            indices.insert(position, found)
+        mapping[k] = found
 
     return unique, mapping
 
 
+def tensor_product_grid(points, rtol=default_rtol, atol=default_atol):
+    """Return the number of points in each direction of a tensor product grid of points.
+
+    The points must be ordered lexicographically with the first
+    coordinate varying slowest, as in the Gauss-Jacobi rules of FIAT on
+    quadrilaterals and hexahedra. Returns None if the points are not
+    such a grid."""
+    points = numpy.asarray(points)
+    if points.ndim != 2:
+        return None
+    num_points, gdim = points.shape
+
+    # Count the distinct values of each coordinate, in order of appearance
+    counts = []
+    for d in range(gdim):
+        values = []
+        for x in points[:, d]:
+            if not any(numpy.isclose(x, v, rtol=rtol, atol=atol) for v in values):
+                values.append(x)
+        counts.append(len(values))
+    if numpy.prod(counts) != num_points:
+        return None
+
+    # Coordinate d of the point with multiindex (i_0, ..., i_{gdim-1})
+    # must depend only on i_d
+    grid = points.reshape(tuple(counts) + (gdim, ))
+    for d in range(gdim):
+        line = grid[(0, ) * d + (slice(None), ) + (0, ) * (gdim - d - 1) + (d, )]
+        shape = [1] * gdim
+        shape[d] = counts[d]
+        if not numpy.allclose(grid[..., d], line.reshape(shape), rtol=rtol, atol=atol):
+            return None
+    return tuple(counts)
+
+
+def factorize_tensor_product_table(table, point_counts, rtol=default_rtol, atol=default_atol):
+    """Factorize a table over a tensor product grid into one table per direction.
+
+    Given a (num_points, num_dofs) table of a tensor product element
+    over a tensor product grid with point_counts points in each
+    direction, find tables F_d of shape (point_counts[d], k) with
+
+        table[q, i] = prod_d F_d[q_d, i_d]
+
+    where q and i are the lexicographic flattenings of the multiindices
+    (q_0, ..., q_{n-1}) and (i_0, ..., i_{n-1}). Returns the list of
+    tables F_d, or None if the table does not factorize."""
+    table = numpy.asarray(table)
+    tdim = len(point_counts)
+    num_points, num_dofs = table.shape
+    k = int(round(num_dofs ** (1.0 / tdim)))
+    if num_points != numpy.prod(point_counts) or k**tdim != num_dofs:
+        return None
+
+    # Take the factors as lines through the largest value, scaled such
+    # that their product reproduces it
+    values = table.reshape(tuple(point_counts) + (k, ) * tdim)
+    pivot = numpy.unravel_index(numpy.argmax(numpy.abs(values)), values.shape)
+    scale = values[pivot]
+    if scale == 0.0:
+        return None
+    factors = []
+    for d in range(tdim):
+        index = list(pivot)
+        index[d] = slice(None)
+        index[tdim + d] = slice(None)
+        factor = values[tuple(index)]
+        factors.append(factor if d == 0 else factor / scale)
+
+    # Check that the product of the factors reproduces the table
+    product = factors[0]
+    for factor in factors[1:]:
+        product = numpy.multiply.outer(product, factor)
+    axes = [2 * d for d in range(tdim)] + [2 * d + 1 for d in range(tdim)]
+    product = product.transpose(axes).reshape(table.shape)
+    if not numpy.allclose(product, table, rtol=rtol, atol=atol):
+        return None
+    return factors
+
+
 def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entitytype,
                           derivative_counts, flat_component):
     """Extract values from ffcx element table.
@@ -177,7 +349,7 @@ def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entityt
         # Scalar valued element
         for entity in range(num_entities):
             entity_points = map_integral_points(points, integral_type, cell, entity)
-            tbl = fiat_element.tabulate(deriv_order, entity_points)[derivative_counts]
+            tbl = tabulation_cache.tabulate(fiat_element, deriv_order, entity_points)[derivative_counts]
             component_tables.append(tbl)
     elif len(sh) > 0 and ufl_element.num_sub_elements() == 0:
         # 2-tensor-valued elements, not a tensor product
@@ -187,7 +359,7 @@ def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entityt
 
         for entity in range(num_entities):
             entity_points = map_integral_points(points, integral_type, cell, entity)
-            tbl = fiat_element.tabulate(deriv_order, entity_points)[derivative_counts]
+            tbl = tabulation_cache.tabulate(fiat_element, deriv_order, entity_points)[derivative_counts]
             if len(sh) == 1:
                 component_tables.append(tbl[:, t_comp[0], :])
             elif len(sh) == 2:
@@ -217,7 +389,7 @@ def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entityt
             entity_points = map_integral_points(points, integral_type, cell, entity)
 
             # Tabulate subelement, this is dense nonzero table, [a, b, c]
-            tbl = component_element.tabulate(deriv_order, entity_points)[derivative_counts]
+            tbl = tabulation_cache.tabulate(component_element, deriv_order, entity_points)[derivative_counts]
 
             # Prepare a padded table with zeros
             padded_shape = (fiat_element.space_dimension(),) + fiat_element.value_shape() + (len(entity_points), )
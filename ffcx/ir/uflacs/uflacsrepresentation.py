@@ -4,6 +4,8 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import collections
+import itertools
 import logging
 
 import numpy
@@ -13,6 +15,9 @@ from ffcx.fiatinterface import create_element
 from ffcx.ir.uflacs.build_uflacs_ir import build_uflacs_ir
 from ffcx.ir.uflacs.tools import accumulate_integrals, compute_quadrature_rules
 from ffcx.ir.dof_permutations import base_permutations_and_reflection_entities
+from ufl.algorithms.apply_derivatives import apply_derivatives
+from ufl.algorithms.apply_geometry_lowering import apply_geometry_lowering
+from ufl.corealg.traversal import unique_pre_traversal
 
 logger = logging.getLogger(__name__)
 
@@ -230,8 +235,331 @@ def compute_integral_ir(ir: dict,
     # Build the more uflacs-specific intermediate representation
     uflacs_ir = build_uflacs_ir(itg_data.domain.ufl_cell(), itg_data.integral_type,
                                 ir["entitytype"], integrands, ir["tensor_shape"],
-                                quadrature_rules, parameters, visualise)
+                                quadrature_rules, parameters, visualise,
+                                representation=ir["representation"])
 
     ir.update(uflacs_ir)
 
+    # Find the blocks of sub-spaces of the arguments with nonzero
+    # entries in the element tensor
+    ir["block_sparsity"] = compute_block_sparsity(ir, form_data.argument_elements)
+
+    # Build the representation of the action of bilinear forms
+    if len(ir["tensor_shape"]) == 2 and ir["params"]["tabulate_action"] and \
+            integral_type not in ufl.custom_integral_types:
+        ir["action_ir"] = compute_action_ir(ir, integrands, cell, integral_type, quadrature_rules,
+                                            parameters, visualise)
+    else:
+        ir["action_ir"] = None
+
+    # Build the representation of the integral reading precomputed
+    # geometry
+    geometry_itg_data = form_data.geometry_integral_data.get((integral_type, itg_data.subdomain_id))
+    if integral_type == "cell" and (ir["params"]["tabulate_geometry"] or ir["params"]["tabulate_fused"]) and \
+            geometry_itg_data is not None:
+        ir["geometry_ir"] = compute_geometry_ir(ir, geometry_itg_data, quadrature_rule_sizes, cell,
+                                                quadrature_rules, parameters, visualise)
+    else:
+        ir["geometry_ir"] = None
+
+    # Record if any blocks are contracted with reference tensors
+    if any(blockdata.block_mode == "tensor"
+           for contributions in ir["piecewise_ir"]["block_contributions"].values()
+           for blockdata in contributions):
+        ir["representation"] = "tensor"
+    else:
+        ir["representation"] = "uflacs"
+
     return ir
+
+
+def compute_block_sparsity(ir, argument_elements):
+    """Compute the block sparsity pattern of the element tensor of an integral.
+
+    The sub-spaces of an argument are the sub-elements of its mixed
+    element, numbered consecutively for the two cells of interior facet
+    integrals, or the whole element. Returns a dict with the offsets of
+    the sub-spaces of each argument in the element tensor, and the
+    tuples of sub-spaces of the arguments of the blocks with nonzero
+    entries, or None for functionals.
+    """
+    if not argument_elements:
+        return None
+
+    # Offsets of the sub-spaces, with the last offset the dimension of
+    # the element tensor
+    offsets = []
+    for ufl_element, dim in zip(argument_elements, ir["tensor_shape"]):
+        sub_elements = ufl_element.sub_elements() or [ufl_element]
+        dims = [create_element(sub_element).space_dimension() for sub_element in sub_elements]
+        dims *= dim // sum(dims)
+        offsets.append(tuple(numpy.cumsum([0] + dims).tolist()))
+
+    def subspaces(dofmap, offsets):
+        return [k for k in range(len(offsets) - 1) if any(offsets[k] <= dof < offsets[k + 1] for dof in dofmap)]
+
+    expr_irs = [ir["piecewise_ir"]] + [ir["varying_irs"][num_points] for num_points in ir["all_num_points"]]
+    nonzero_blocks = set()
+    for expr_ir in expr_irs:
+        for blockmap, contributions in expr_ir["block_contributions"].items():
+            blocks = set(itertools.product(*[subspaces(dofmap, o) for dofmap, o in zip(blockmap, offsets)]))
+            nonzero_blocks.update(blocks)
+
+            # Transposed blocks added together with their block
+            if any(blockdata.symmetry == "mirrored" for blockdata in contributions):
+                nonzero_blocks.update(block[::-1] for block in blocks)
+
+    return {"offsets": tuple(offsets), "nonzero_blocks": tuple(sorted(nonzero_blocks))}
+
+
+def compute_action_ir(ir, integrands, cell, integral_type, quadrature_rules, parameters, visualise):
+    """Compute the uflacs representation of the action y = A x of a bilinear integral.
+
+    The trial function is replaced by a coefficient x, so the argument
+    factorization of the integrand keeps the test function only. The
+    trial function is then evaluated in the quadrature points from the
+    dofs of x and contracted with the test function, without forming
+    the element matrix.
+
+    Returns a dict of the integral representation entries which differ
+    from those of the bilinear integral. The dofs of the coefficient
+    "action_coefficient" are read from the input vector x instead of w.
+    """
+    trial, = set(a for integrand in integrands.values()
+                 for a in ufl.algorithms.extract_arguments(integrand) if a.number() == 1)
+    x = ufl.Coefficient(trial.ufl_function_space())
+
+    action_integrands = {num_points: ufl.algorithms.replace(integrand, {trial: x})
+                         for num_points, integrand in integrands.items()}
+    tensor_shape = ir["tensor_shape"][:1]
+
+    action_ir = build_uflacs_ir(cell, integral_type, ir["entitytype"], action_integrands, tensor_shape,
+                                quadrature_rules, parameters, visualise,
+                                representation=ir["representation"])
+
+    action_ir["tensor_shape"] = tensor_shape
+    action_ir["coefficient_numbering"] = dict(ir["coefficient_numbering"])
+    action_ir["coefficient_numbering"][x] = len(ir["coefficient_numbering"])
+    action_ir["coefficient_offsets"] = dict(ir["coefficient_offsets"])
+    action_ir["coefficient_offsets"][x] = 0
+    action_ir["action_coefficient"] = x
+
+    return action_ir
+
+
+def compute_geometry_ir(ir, itg_data, quadrature_rule_sizes, cell, quadrature_rules, parameters, visualise):
+    """Compute the uflacs representation of a cell integral reading precomputed geometry.
+
+    The integrands of itg_data keep the Jacobian J, its determinant detJ
+    and its inverse K as terminals. These are read from an array with
+    the values of the components
+
+        J[0][0], ..., J[gdim - 1][tdim - 1], detJ, K[0][0], ..., K[tdim - 1][gdim - 1]
+
+    in turn, each at all quadrature points. The points of the quadrature
+    rules are ordered by the number of points of the rules. The array is
+    filled by an expression kernel evaluating the geometry at the same
+    points.
+
+    Returns a dict of the integral representation entries which differ
+    from those of the integral, with the representation of the
+    expression kernel in "geometry_expression", or None if the integrand
+    depends on derivatives or averages of the geometry.
+    """
+    sorted_integrals = accumulate_integrals(itg_data, quadrature_rule_sizes)
+    integrands = {num_points: integral.integrand() for num_points, integral in sorted_integrals.items()}
+
+    geometry_types = (ufl.classes.Jacobian, ufl.classes.JacobianDeterminant, ufl.classes.JacobianInverse)
+    modifier_types = (ufl.classes.Derivative, ufl.classes.CellAvg, ufl.classes.FacetAvg)
+    for integrand in integrands.values():
+        for node in unique_pre_traversal(integrand):
+            if isinstance(node, modifier_types) and \
+                    any(isinstance(o, geometry_types) for o in unique_pre_traversal(node)):
+                return None
+
+    geometry_ir = build_uflacs_ir(cell, "cell", ir["entitytype"], integrands, ir["tensor_shape"],
+                                  quadrature_rules, parameters, visualise,
+                                  representation=ir["representation"])
+
+    # Offsets of the points of each quadrature rule in the geometry array
+    geometry_ir["geometry_point_offsets"] = {}
+    offset = 0
+    for num_points in geometry_ir["all_num_points"]:
+        geometry_ir["geometry_point_offsets"][num_points] = offset
+        offset += num_points
+    geometry_ir["geometry_num_points"] = offset
+
+    # Expression kernel evaluating the geometry at all points
+    domain = itg_data.domain
+    gdim = domain.geometric_dimension()
+    tdim = domain.topological_dimension()
+    J = ufl.Jacobian(domain)
+    K = ufl.JacobianInverse(domain)
+    values = [J[i, j] for i in range(gdim) for j in range(tdim)] + [ufl.JacobianDeterminant(domain)] + \
+        [K[i, j] for i in range(tdim) for j in range(gdim)]
+    geometry_ir["geometry_components"] = {value: k for k, value in enumerate(values)}
+    expression = apply_geometry_lowering(ufl.as_vector(values), (ufl.classes.Jacobian, ))
+    expression = apply_derivatives(expression)
+    points = numpy.concatenate([quadrature_rules[num_points][0] for num_points in geometry_ir["all_num_points"]])
+    weights = numpy.ones(points.shape[0])
+
+    expression_ir = {
+        "element_dimensions": ir["element_dimensions"],
+        "tensor_shape": [],
+        "expression_shape": list(expression.ufl_shape),
+        "coefficient_numbering": {},
+        "original_coefficient_positions": [],
+        "coefficient_offsets": {},
+        "integral_type": "expression",
+        "entitytype": "cell",
+        "original_constant_offsets": {},
+        "points": points,
+    }
+    # The expression kernel generator supports the "full" block mode only
+    expression_parameters = dict(parameters, enable_sum_factorization=True)
+    expression_ir.update(build_uflacs_ir(cell, "expression", "cell", {points.shape[0]: expression}, [],
+                                         {points.shape[0]: (points, weights)}, expression_parameters,
+                                         visualise))
+    geometry_ir["geometry_expression"] = expression_ir
+
+    return geometry_ir
+
+
+def compute_fused_integral_ir(integral_irs, domain, parameters, visualise):
+    """Compute the uflacs representation of the cell integrals of several forms fused into one kernel.
+
+    The integrals of each form are given by their representations
+    reading precomputed geometry. The modified terminals of
+    the Jacobian J, the spatial coordinate x and the coefficients used
+    by more than one form, together with the Jacobian determinant and
+    inverse of all forms, are evaluated once at the quadrature points of
+    all rules by an expression kernel, and read from the array of its
+    values by the integrals of each form. The coefficients of the
+    expression kernel are packed from the coefficients of the forms.
+
+    Returns a dict of the fused integral representation, or None if the
+    forms have different quadrature points for the same number of
+    points, or share no values.
+    """
+    quadrature_rules = {}
+    for ir in integral_irs:
+        for num_points in ir.all_num_points:
+            points, weights = ir.quadrature_rules[num_points]
+            if num_points in quadrature_rules and not numpy.array_equal(points, quadrature_rules[num_points][0]):
+                return None
+            quadrature_rules[num_points] = (points, weights)
+
+    # Offsets of the points of each quadrature rule in the array of
+    # values
+    point_offsets = {}
+    offset = 0
+    for num_points in sorted(quadrature_rules):
+        point_offsets[num_points] = offset
+        offset += num_points
+    total_num_points = offset
+
+    # Modified terminal expressions of each form which may be read from
+    # the array of values
+    form_exprs = [_precomputable_exprs(ir) for ir in integral_irs]
+    counts = collections.Counter(expr for exprs in form_exprs for expr in exprs)
+    geometry_types = (ufl.classes.JacobianDeterminant, ufl.classes.JacobianInverse)
+    values = []
+    for exprs in form_exprs:
+        for expr, mt in exprs.items():
+            if expr not in values and (counts[expr] > 1 or isinstance(mt.terminal, geometry_types)):
+                values.append(expr)
+    if not values:
+        return None
+    components = [{expr: k for k, expr in enumerate(values) if expr in exprs} for exprs in form_exprs]
+
+    # Pack the coefficients of the values from the first form using them
+    coefficients = []
+    for expr in values:
+        for f in ufl.algorithms.extract_coefficients(expr):
+            if f not in coefficients:
+                coefficients.append(f)
+    element_dimensions = {}
+    for ir in integral_irs:
+        element_dimensions.update(ir.element_dimensions)
+    coefficient_offsets = {}
+    packed_coefficients = []
+    offset = 0
+    for f in coefficients:
+        form_index = next(i for i, ir in enumerate(integral_irs) if f in ir.coefficient_offsets)
+        size = element_dimensions[f.ufl_element()]
+        packed_coefficients.append((form_index, integral_irs[form_index].coefficient_offsets[f], offset, size))
+        coefficient_offsets[f] = offset
+        offset += size
+
+    # Expression kernel evaluating the values at all points
+    expression = apply_geometry_lowering(ufl.as_vector(values), (ufl.classes.Jacobian, ))
+    expression = apply_derivatives(expression)
+    points = numpy.concatenate([quadrature_rules[num_points][0] for num_points in sorted(quadrature_rules)])
+    weights = numpy.ones(points.shape[0])
+
+    expression_ir = {
+        "element_dimensions": element_dimensions,
+        "tensor_shape": [],
+        "expression_shape": list(expression.ufl_shape),
+        "coefficient_numbering": {f: i for i, f in enumerate(coefficients)},
+        "original_coefficient_positions": list(range(len(coefficients))),
+        "coefficient_offsets": coefficient_offsets,
+        "integral_type": "expression",
+        "entitytype": "cell",
+        "original_constant_offsets": {},
+        "points": points,
+    }
+    # The expression kernel generator supports the "full" block mode only
+    expression_parameters = dict(parameters, enable_sum_factorization=True)
+    expression_ir.update(build_uflacs_ir(domain.ufl_cell(), "expression", "cell", {points.shape[0]: expression}, [],
+                                         {points.shape[0]: (points, weights)}, expression_parameters,
+                                         visualise))
+
+    return {
+        "integral_type": "cell",
+        "num_forms": len(integral_irs),
+        "expression": expression_ir,
+        "components": components,
+        "point_offsets": point_offsets,
+        "num_points": total_num_points,
+        "packed_coefficients": packed_coefficients,
+        "precision": max(ir.precision for ir in integral_irs),
+    }
+
+
+def _precomputable_exprs(ir):
+    """Return the modified terminals of an integral representation which may be read from precomputed values.
+
+    These are the Jacobian and its determinant and inverse, the spatial
+    coordinate and the coefficients which are evaluated from their dofs,
+    keyed by their expression.
+    """
+    graphs = [(ir.piecewise_ir["factorization"], "piecewise", set())]
+    graphs += [(ir.varying_irs[num_points]["factorization"], "varying",
+                ir.varying_irs[num_points]["factorized_coefficients"]) for num_points in ir.all_num_points]
+
+    exprs = {}
+    for F, status, factorized_coefficients in graphs:
+        if F is None:
+            continue
+        for i, v in F.nodes.items():
+            mt = v.get('mt')
+            if mt is None or v['status'] != status or i in factorized_coefficients:
+                continue
+            if mt.averaged or mt.restriction:
+                continue
+            t = mt.terminal
+            if isinstance(t, (ufl.classes.JacobianDeterminant, ufl.classes.JacobianInverse)):
+                exprs[mt.expr] = mt
+            elif isinstance(t, (ufl.classes.Jacobian, ufl.classes.SpatialCoordinate)):
+                if not (mt.global_derivatives or mt.local_derivatives):
+                    exprs[mt.expr] = mt
+            elif isinstance(t, ufl.classes.Coefficient):
+                tr = v.get('tr')
+                if tr is None or tr.ttype in ("zeros", "quadrature"):
+                    continue
+                begin, end = tr.dofrange
+                if tr.ttype == "ones" and end - begin == 1:
+                    continue
+                exprs[mt.expr] = mt
+    return exprs
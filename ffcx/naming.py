@@ -4,7 +4,11 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import collections
 import hashlib
+import threading
+
+import numpy
 
 import ffcx
 import ufl
@@ -26,50 +30,8 @@ def compute_signature(ufl_objects, tag, coordinate_mapping=False):
 
     object_signature = ""
     for ufl_object in ufl_objects:
-        # Get signature from ufl object
-        if isinstance(ufl_object, ufl.Form):
-            kind = "form"
-            object_signature += ufl_object.signature()
-        elif isinstance(ufl_object, ufl.Mesh):
-            # When coordinate mapping is represented by a Mesh, just getting
-            # its coordinate element
-            object_signature += repr(ufl_object.ufl_coordinate_element())
-            kind = "coordinate_mapping"
-        elif coordinate_mapping and isinstance(ufl_object, ufl.FiniteElementBase):
-            object_signature += repr(ufl_object)
-            kind = "coordinate_mapping"
-        elif isinstance(ufl_object, ufl.FiniteElementBase):
-            object_signature += repr(ufl_object)
-            kind = "element"
-        elif isinstance(ufl_object, tuple) and isinstance(ufl_object[0], ufl.core.expr.Expr):
-            expr = ufl_object[0]
-
-            # FIXME Move this to UFL, cache the computation
-            coeffs = ufl.algorithms.extract_coefficients(expr)
-            consts = ufl.algorithms.analysis.extract_constants(expr)
-            args = ufl.algorithms.analysis.extract_arguments(expr)
-
-            rn = dict()
-            rn.update(dict((c, i) for i, c in enumerate(coeffs)))
-            rn.update(dict((c, i) for i, c in enumerate(consts)))
-            rn.update(dict((c, i) for i, c in enumerate(args)))
-
-            domains = []
-            for coeff in coeffs:
-                domains.append(*coeff.ufl_domains())
-            for arg in args:
-                domains.append(*arg.ufl_domains())
-            for gc in ufl.algorithms.analysis.extract_type(expr, ufl.classes.GeometricQuantity):
-                domains.append(*gc.ufl_domains())
-
-            domains = ufl.algorithms.analysis.unique_tuple(domains)
-            rn.update(dict((d, i) for i, d in enumerate(domains)))
-
-            siganture = ufl.algorithms.signature.compute_expression_signature(expr, rn)
-            object_signature += siganture
-            kind = "expression"
-        else:
-            raise RuntimeError("Unknown ufl object type {}".format(ufl_object.__class__.__name__))
+        kind, signature = object_signature_and_kind(ufl_object, coordinate_mapping)
+        object_signature += signature
 
     # Build combined signature
     signatures = [object_signature, str(ffcx.__version__), ffcx.codegeneration.get_signature(), kind, tag]
@@ -77,11 +39,84 @@ def compute_signature(ufl_objects, tag, coordinate_mapping=False):
     return hashlib.sha1(string.encode('utf-8')).hexdigest()
 
 
+def object_signature_and_kind(ufl_object, coordinate_mapping=False):
+    """Return the kind of a UFL object and its signature.
+
+    Signatures are memoised, by UFL for forms and elements and here for
+    expressions, so that repeated calls for the same object are cheap.
+    """
+    if isinstance(ufl_object, ufl.Form):
+        return "form", ufl_object.signature()
+    elif isinstance(ufl_object, ufl.Mesh):
+        # When coordinate mapping is represented by a Mesh, just getting
+        # its coordinate element
+        return "coordinate_mapping", repr(ufl_object.ufl_coordinate_element())
+    elif coordinate_mapping and isinstance(ufl_object, ufl.FiniteElementBase):
+        return "coordinate_mapping", repr(ufl_object)
+    elif isinstance(ufl_object, ufl.FiniteElementBase):
+        return "element", repr(ufl_object)
+    elif isinstance(ufl_object, tuple) and isinstance(ufl_object[0], ufl.core.expr.Expr):
+        # Evaluation points are hardcoded into the generated code
+        points = repr(numpy.asarray(ufl_object[1]).tolist())
+        return "expression", _expression_signature(ufl_object[0]) + points
+    else:
+        raise RuntimeError("Unknown ufl object type {}".format(ufl_object.__class__.__name__))
+
+
+# Signatures of recently used expressions, keyed by id. The expression
+# is kept alive with its signature, so the id is not reused.
+_expression_signatures = collections.OrderedDict()
+_expression_signatures_lock = threading.Lock()
+_max_expression_signatures = 256
+
+
+def _expression_signature(expr):
+    with _expression_signatures_lock:
+        cached = _expression_signatures.get(id(expr))
+        if cached is not None:
+            _expression_signatures.move_to_end(id(expr))
+            return cached[1]
+
+    coeffs = ufl.algorithms.extract_coefficients(expr)
+    consts = ufl.algorithms.analysis.extract_constants(expr)
+    args = ufl.algorithms.analysis.extract_arguments(expr)
+
+    rn = dict()
+    rn.update(dict((c, i) for i, c in enumerate(coeffs)))
+    rn.update(dict((c, i) for i, c in enumerate(consts)))
+    rn.update(dict((c, i) for i, c in enumerate(args)))
+
+    domains = []
+    for coeff in coeffs:
+        domains.append(*coeff.ufl_domains())
+    for arg in args:
+        domains.append(*arg.ufl_domains())
+    for gc in ufl.algorithms.analysis.extract_type(expr, ufl.classes.GeometricQuantity):
+        domains.append(*gc.ufl_domains())
+
+    domains = ufl.algorithms.analysis.unique_tuple(domains)
+    rn.update(dict((d, i) for i, d in enumerate(domains)))
+
+    signature = ufl.algorithms.signature.compute_expression_signature(expr, rn)
+
+    with _expression_signatures_lock:
+        _expression_signatures[id(expr)] = (expr, signature)
+        if len(_expression_signatures) > _max_expression_signatures:
+            _expression_signatures.popitem(last=False)
+
+    return signature
+
+
 def integral_name(integral_type, original_form, form_id, subdomain_id):
     sig = compute_signature([original_form], str(form_id))
     return "integral_{}_{}_{!s}".format(integral_type, subdomain_id, sig)
 
 
+def fused_integral_name(integral_type, original_forms, subdomain_id):
+    sig = compute_signature(original_forms, "fused")
+    return "fused_integral_{}_{}_{!s}".format(integral_type, subdomain_id, sig)
+
+
 def form_name(original_form, form_id):
     sig = compute_signature([original_form], str(form_id))
     return "form_{!s}".format(sig)
@@ -0,0 +1,36 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Process pools of the compiler stages run in parallel.
+
+The pools are created on first use and kept for later calls, so that
+only the first parallel compile of a process starts the processes.
+"""
+
+import atexit
+import concurrent.futures
+import threading
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def process_pool(workers):
+    """Return the process pool with the given number of workers, creating it on first use."""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            atexit.register(pool.shutdown)
+        return pool
+
+
+def use_pool(num_jobs, workers):
+    """Return True if num_jobs jobs should be run by a pool of workers processes.
+
+    Small numbers of jobs are run serially, as starting the jobs in
+    other processes costs more than the parallel work saves.
+    """
+    return workers > 1 and num_jobs >= max(2, workers)
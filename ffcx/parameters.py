@@ -4,7 +4,6 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
-import copy
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,11 +18,18 @@ FFCX_PARAMETERS = {
     # C double precision floating-point types)
     "scalar_type": "double",
     "external_includes": "",  # ':' separated list of include filenames to add to generated code
+    "ir_workers": 0,  # number of processes computing the representation of integrals (0 for serial)
+    "codegen_workers": 0,  # number of processes generating code (0 for serial)
 }
 
+# Parameters controlling how the code is generated but not the code itself,
+# left out of the signatures and the comment of generated code
+EXECUTION_PARAMETERS = ("ir_workers", "codegen_workers")
+
 
 def default_parameters():
     """Return (a copy of) the default parameter values for FFCX."""
-    parameters = copy.deepcopy(FFCX_PARAMETERS)
+    # Values are immutable, so a shallow copy suffices
+    parameters = dict(FFCX_PARAMETERS)
 
     return parameters
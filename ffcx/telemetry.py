@@ -0,0 +1,118 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Telemetry of JIT compilation.
+
+Each JIT call produces a record, a dictionary with the times spent in
+the compiler stages and the C compiler, the result of the cache lookup
+and the sizes of the generated code and compiled module. The records of
+the calls made by this process are returned by ``records()``, and are
+appended as JSON lines to the file named by the environment variable
+``FFCX_JIT_TELEMETRY`` if it is set.
+
+While a record is collected by a thread, the compiler stages add their
+times to it through ``add`` and ``timer``, which do nothing otherwise.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Records of the most recent JIT calls of this process
+_records = collections.deque(maxlen=1000)
+_records_lock = threading.Lock()
+
+_local = threading.local()
+
+
+def records():
+    """Return the telemetry records of the most recent JIT calls of this process, oldest first."""
+    with _records_lock:
+        return list(_records)
+
+
+def clear_records():
+    """Forget the telemetry records of this process."""
+    with _records_lock:
+        _records.clear()
+
+
+def publish(record):
+    """Store a record, and append it to the ``FFCX_JIT_TELEMETRY`` file if set."""
+    with _records_lock:
+        _records.append(record)
+    path = os.environ.get("FFCX_JIT_TELEMETRY")
+    if path:
+        with open(path, "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def current():
+    """Return the record collected by this thread, or None."""
+    return getattr(_local, "record", None)
+
+
+@contextlib.contextmanager
+def collect(record):
+    """Collect the telemetry of this thread into record."""
+    previous = current()
+    _local.record = record
+    try:
+        yield record
+    finally:
+        _local.record = previous
+
+
+def add(key, value, record=None):
+    """Add value to record[key], the record defaults to the current record."""
+    if record is None:
+        record = current()
+    if record is not None:
+        record[key] = record.get(key, 0) + value
+
+
+def merge(record, into=None):
+    """Add the values of a record collected elsewhere, e.g. by a worker process, to into.
+
+    The values of nested dictionaries are merged recursively. into
+    defaults to the current record.
+    """
+    if into is None:
+        into = current()
+    if into is None:
+        return
+    for key, value in record.items():
+        if isinstance(value, dict):
+            merge(value, into.setdefault(key, {}))
+        else:
+            add(key, value, into)
+
+
+def update(**fields):
+    """Set fields of the current record."""
+    record = current()
+    if record is not None:
+        record.update(fields)
+
+
+@contextlib.contextmanager
+def timer(key, record=None):
+    """Add the time spent in the block to record[key], the record defaults to the current record."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(key, time.perf_counter() - t0, record)
+
+
+def integral_record(name):
+    """Return the record of an integral within the current record, or None."""
+    record = current()
+    if record is None:
+        return None
+    return record.setdefault("integrals", {}).setdefault(name, {})
@@ -4,10 +4,22 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import json
+import os
+import subprocess
 import sys
+import threading
+import time
 
+import numpy
+import pytest
+
+import ffcx.cache
 import ffcx.codegeneration.jit
+import ffcx.naming
+import ffcx.telemetry
 import ufl
+from ffcx.codegeneration import jitcache
 
 
 def test_cache_modes():
@@ -32,3 +44,264 @@ def test_cache_modes():
 
     assert(newname == tmpname)
     assert(newfile != tmpfile)
+
+
+def test_cache_eviction(tmp_path, monkeypatch):
+    cell = ufl.triangle
+    element = ufl.FiniteElement("Lagrange", cell, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a0 = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+    a1 = ufl.inner(u, v) * ufl.dx
+
+    # Allow the generated code and the compiled module of a single form in the cache
+    monkeypatch.setenv("FFCX_CACHE_MAX_ENTRIES", "2")
+
+    _, module0 = ffcx.codegeneration.jit.compile_forms([a0], cache_dir=tmp_path)
+    names0 = [e.module_name for e in jitcache.list_entries(tmp_path)]
+    assert len(names0) == 2 and module0.__name__ in names0
+
+    # Compiling another module evicts the least recently used ones
+    _, module1 = ffcx.codegeneration.jit.compile_forms([a1], cache_dir=tmp_path)
+    entries = jitcache.list_entries(tmp_path)
+    assert len(entries) == 2 and module1.__name__ in [e.module_name for e in entries]
+    assert not set(names0) & set(e.module_name for e in entries)
+    assert all(e.ready for e in entries)
+
+
+def test_two_level_cache(tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    _, module0 = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)
+    source_names = [e.module_name for e in jitcache.list_entries(tmp_path) if e.module_name != module0.__name__]
+    assert len(source_names) == 1
+
+    # Changing the compiler arguments reuses the generated code
+    def fail(*args, **kwargs):
+        raise AssertionError("Code should not be generated again")
+    monkeypatch.setattr(ffcx.compiler, "compile_ufl_objects", fail)
+    compiled_forms, module1 = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path,
+                                                                    cffi_extra_compile_args=["-O1"])
+    assert compiled_forms[0].rank == 2
+    assert module1.__name__ != module0.__name__
+    assert source_names[0] in [e.module_name for e in jitcache.list_entries(tmp_path)]
+
+    # Identical generated code is compiled once
+    module_names = [e.module_name for e in jitcache.list_entries(tmp_path)]
+    ffcx.codegeneration.jit.clear_loaded_modules()
+    _, module2 = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)
+    assert module2.__name__ == module0.__name__
+    assert [e.module_name for e in jitcache.list_entries(tmp_path)] == module_names
+
+
+def test_cache_lru_order(tmp_path):
+    # Fake entries, each with a C file, a library and a ready marker
+    for i, name in enumerate(["libffcx_forms_a", "libffcx_forms_b", "libffcx_forms_c"]):
+        for suffix in (".c", ".so"):
+            tmp_path.joinpath(name + suffix).write_bytes(b"0" * 100)
+        jitcache.ready_marker(tmp_path, name).touch()
+        os.utime(jitcache.ready_marker(tmp_path, name), (i, i))
+
+    # Build in progress is never evicted
+    tmp_path.joinpath("libffcx_forms_d.c").touch()
+    os.utime(tmp_path.joinpath("libffcx_forms_d.c"), (0, 0))
+
+    with jitcache.module_lock(tmp_path, "libffcx_forms_d", 1):
+        # Use of "a" makes "b" the least recently used entry
+        jitcache.touch(tmp_path, "libffcx_forms_a")
+        assert jitcache.evict(tmp_path, max_bytes=0, max_entries=3) == ["libffcx_forms_b"]
+        assert jitcache.evict(tmp_path, max_bytes=250, max_entries=0) == ["libffcx_forms_c"]
+    assert sorted(e.module_name for e in jitcache.list_entries(tmp_path)) == ["libffcx_forms_a", "libffcx_forms_d"]
+
+
+def _hold_module_lock(cache_dir, module_name, seconds):
+    """Start a process that holds the build lock of a module for some time."""
+    code = """
+import sys, time
+from ffcx.codegeneration import jitcache
+with jitcache.module_lock(sys.argv[1], sys.argv[2], 10):
+    print("locked", flush=True)
+    time.sleep(float(sys.argv[3]))
+    jitcache.ready_marker(sys.argv[1], sys.argv[2]).touch()
+"""
+    proc = subprocess.Popen([sys.executable, "-c", code, str(cache_dir), module_name, str(seconds)],
+                            stdout=subprocess.PIPE)
+    assert proc.stdout.readline().strip() == b"locked"
+    return proc
+
+
+def test_module_lock_wakeup(tmp_path):
+    proc = _hold_module_lock(tmp_path, "libffcx_forms_a", 0.5)
+    t0 = time.time()
+    with jitcache.module_lock(tmp_path, "libffcx_forms_a", 10):
+        # Woken as soon as the holder published the module
+        assert time.time() - t0 < 5
+        assert jitcache.ready_marker(tmp_path, "libffcx_forms_a").exists()
+    proc.wait()
+
+
+def test_module_lock_dead_producer(tmp_path):
+    proc = _hold_module_lock(tmp_path, "libffcx_forms_a", 60)
+    assert jitcache.build_in_progress(tmp_path, "libffcx_forms_a")
+
+    # Timed out waits leave no open lock files or waiting threads
+    fds, threads = len(os.listdir("/proc/self/fd")), threading.active_count()
+    for i in range(3):
+        with pytest.raises(TimeoutError):
+            with jitcache.module_lock(tmp_path, "libffcx_forms_a", 0.1):
+                pass
+    assert len(os.listdir("/proc/self/fd")) == fds and threading.active_count() == threads
+
+    # Lock is released by the kernel when the producer dies
+    proc.kill()
+    proc.wait()
+    with jitcache.module_lock(tmp_path, "libffcx_forms_a", 10):
+        assert not jitcache.ready_marker(tmp_path, "libffcx_forms_a").exists()
+    assert not jitcache.build_in_progress(tmp_path, "libffcx_forms_a")
+
+
+def test_loaded_module_memo(tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    ffcx.codegeneration.jit.clear_loaded_modules()
+    compiled_forms0, module0 = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)
+    assert ffcx.codegeneration.jit.loaded_module_stats() == {"hits": 0, "misses": 1, "size": 1}
+
+    # Same forms rebuilt from identical UFL are served from memory
+    forms = [ufl.inner(u, v) * ufl.dx]
+    compiled_forms1, module1 = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)
+    assert module1 is module0
+    assert compiled_forms1 == compiled_forms0
+    assert ffcx.codegeneration.jit.loaded_module_stats() == {"hits": 1, "misses": 1, "size": 1}
+
+    # After clearing, the module is loaded again from the cache directory
+    ffcx.codegeneration.jit.clear_loaded_modules()
+    compiled_forms2, module2 = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)
+    assert compiled_forms2[0].rank == 2
+    assert ffcx.codegeneration.jit.loaded_module_stats() == {"hits": 0, "misses": 1, "size": 1}
+
+
+def test_cache_cli(tmp_path, capsys):
+    tmp_path.joinpath("forms.ufl").write_text("""
+from ufl import *
+element = FiniteElement("Lagrange", triangle, 1)
+u, v = TrialFunction(element), TestFunction(element)
+a = inner(grad(u), grad(v)) * dx
+""")
+    cache_dir = tmp_path.joinpath("cache")
+    args = ["--cache-dir", str(cache_dir)]
+    assert ffcx.cache.main(args + ["warm", str(tmp_path.joinpath("forms.ufl"))]) == 0
+    ready = [e.module_name for e in jitcache.list_entries(cache_dir)]
+    assert len(ready) == 4
+
+    # Failed build of a process that died
+    cache_dir.joinpath("libffcx_forms_dead.c").touch()
+    cache_dir.joinpath("libffcx_forms_dead.c.failed").touch()
+    capsys.readouterr()
+    assert ffcx.cache.main(args + ["list"]) == 0
+    assert "libffcx_forms_dead" in capsys.readouterr().out
+
+    assert ffcx.cache.main(args + ["clean"]) == 0
+    assert [e.module_name for e in jitcache.list_entries(cache_dir)] == ready
+
+    assert ffcx.cache.main(args + ["verify"]) == 0
+    assert "0 modules failed" in capsys.readouterr().out
+
+    assert ffcx.cache.main(args + ["prune", "--max-age", "1d"]) == 0
+    assert len(jitcache.list_entries(cache_dir)) == 4
+    assert ffcx.cache.main(args + ["prune", "--max-entries", "1"]) == 0
+    assert len(jitcache.list_entries(cache_dir)) == 1
+
+
+def test_cache_cli_list_removed(tmp_path, capsys, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    ffcx.codegeneration.jit.compile_elements([element], cache_dir=tmp_path)
+
+    # Files removed by another process after the entries were listed
+    list_entries = jitcache.list_entries
+
+    def list_removed_entries(cache_dir):
+        entries = list_entries(cache_dir)
+        for f in tmp_path.iterdir():
+            f.unlink()
+        return entries
+
+    monkeypatch.setattr(jitcache, "list_entries", list_removed_entries)
+    capsys.readouterr()
+    assert ffcx.cache.main(["--cache-dir", str(tmp_path), "list"]) == 0
+    assert "2 entries" in capsys.readouterr().out
+
+
+def test_telemetry(tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + ufl.inner(u, v) * ufl.dx(1)]
+    monkeypatch.setenv("FFCX_JIT_TELEMETRY", str(tmp_path.joinpath("telemetry.jsonl")))
+
+    ffcx.telemetry.clear_records()
+    _, module = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)
+    ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)
+    ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=["-O1"])
+    miss, hit, source = ffcx.telemetry.records()
+
+    assert miss["cache"] == "miss" and miss["module_name"] == module.__name__
+    for key in ("analysis", "ir", "codegen", "format", "compile", "load", "lock_wait", "total"):
+        assert miss[key] >= 0.0
+    assert miss["source_size"] > 0 and miss["library_size"] == os.path.getsize(module.__file__)
+    assert len(miss["integrals"]) == 2
+    for record in miss["integrals"].values():
+        assert record["ir"] > 0.0 and record["codegen"] > 0.0 and record["source_size"] > 0
+
+    assert hit["cache"] == "memory" and hit["module_name"] == module.__name__
+    assert source["cache"] == "source" and "analysis" not in source and source["compile"] > 0.0
+
+    lines = tmp_path.joinpath("telemetry.jsonl").read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [miss, hit, source]
+
+
+def test_warm_path_signatures(tmp_path, monkeypatch):
+    e = ufl.VectorElement("P", "triangle", 1)
+    u = ufl.TrialFunction(ufl.FunctionSpace(ufl.Mesh(e), e))
+    expressions = [(ufl.grad(u[0]), numpy.array([[0.0, 0.0], [1.0, 0.0]]))]
+    ffcx.codegeneration.jit.compile_expressions(expressions, cache_dir=tmp_path)
+
+    # Expression signatures are computed once per expression object
+    calls = []
+    compute_expression_signature = ufl.algorithms.signature.compute_expression_signature
+    monkeypatch.setattr(ufl.algorithms.signature, "compute_expression_signature",
+                        lambda *args: calls.append(args) or compute_expression_signature(*args))
+    _, module0 = ffcx.codegeneration.jit.compile_expressions(expressions, cache_dir=tmp_path)
+    assert not calls
+
+    # Identical expression built again shares the module
+    expressions = [(ufl.grad(u[0]), numpy.array([[0.0, 0.0], [1.0, 0.0]]))]
+    _, module1 = ffcx.codegeneration.jit.compile_expressions(expressions, cache_dir=tmp_path)
+    assert len(calls) == 1
+    assert module1 is module0
+
+
+def test_warm_path_naming(tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+    expressions = [(ufl.grad(u), numpy.array([[0.0, 0.0]]))]
+    ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)
+    ffcx.codegeneration.jit.compile_expressions(expressions, cache_dir=tmp_path)
+
+    # Warm calls, also with equal forms built again, look up the module
+    # without computing names and source signatures
+    calls = []
+    compute_signature = ffcx.naming.compute_signature
+    monkeypatch.setattr(ffcx.naming, "compute_signature",
+                        lambda *args, **kwargs: calls.append(args) or compute_signature(*args, **kwargs))
+    ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)
+    ffcx.codegeneration.jit.compile_forms([ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx], cache_dir=tmp_path)
+    ffcx.codegeneration.jit.compile_expressions(expressions, cache_dir=tmp_path)
+    assert not calls
+
+    # Other parameters are named again
+    ffcx.codegeneration.jit.compile_forms(forms, parameters={"scalar_type": "float"}, cache_dir=tmp_path)
+    assert calls
@@ -20,9 +20,12 @@
 "Unit tests for FFCX"
 
 
+import pickle
+
 import numpy
 import pytest
 
+import ffcx.fiatinterface
 from ffcx.fiatinterface import create_element
 from ufl import FiniteElement
 
@@ -84,6 +87,50 @@ def test_hhj(degree, expected_dim):
     assert P.space_dimension() == expected_dim
 
 
+def test_element_cache(tmp_path, monkeypatch):
+    "Test the in-memory and on-disk caches of elements."
+    cache_dir = tmp_path.joinpath("elements")
+    monkeypatch.setenv("FFCX_ELEMENT_CACHE_SIZE", "2")
+    monkeypatch.setenv("FFCX_ELEMENT_CACHE_DIR", str(cache_dir))
+    ffcx.fiatinterface.clear_element_cache()
+    elements = [FiniteElement("N1curl", "tetrahedron", 2), FiniteElement("RT", "triangle", 2),
+                FiniteElement("Lagrange", "triangle", 3)]
+
+    # The least recently used elements are evicted from memory
+    fiat_elements = [create_element(e) for e in elements]
+    assert create_element(elements[2]) is fiat_elements[2]
+    assert create_element(elements[0]) is not fiat_elements[0]
+    assert len(list(cache_dir.glob("element_*.pickle"))) == 3
+    assert cache_dir.stat().st_mode & 0o777 == 0o700
+
+    # Elements read from disk tabulate as the constructed elements
+    ffcx.fiatinterface.clear_element_cache()
+    points = numpy.array([[0.1, 0.2, 0.3], [0.2, 0.1, 0.4]])
+    for e, fiat_element in zip(elements, fiat_elements):
+        element = create_element(e)
+        assert element is not fiat_element
+        x = points[:, :element.ref_el.get_spatial_dimension()]
+        for derivatives, table in fiat_element.tabulate(1, x).items():
+            assert numpy.allclose(element.tabulate(1, x)[derivatives], table)
+
+    # Pickling of FIAT elements outside the cache is unchanged
+    with pytest.raises(Exception):
+        pickle.dumps(fiat_elements[2])
+
+    # Files writable by others are not loaded
+    filename = ffcx.fiatinterface._element_filename(cache_dir, elements[2])
+    filename.chmod(0o666)
+    assert ffcx.fiatinterface._load_element(cache_dir, elements[2]) is None
+
+    # Directories accessible to others are not used
+    ffcx.fiatinterface.clear_element_cache()
+    cache_dir.chmod(0o755)
+    with pytest.warns(UserWarning, match="not used"):
+        create_element(FiniteElement("Lagrange", "triangle", 4))
+    assert len(list(cache_dir.glob("element_*.pickle"))) == 3
+    ffcx.fiatinterface.clear_element_cache()
+
+
 class TestFunctionValues():
     """These tests examine tabulate gives the correct answers for a the
 supported (non-mixed) for low degrees"""
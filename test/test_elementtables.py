@@ -0,0 +1,60 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import numpy as np
+import pytest
+
+import ufl
+from ffcx.fiatinterface import create_element
+from ffcx.ir.uflacs.elementtables import TabulationCache, build_unique_tables, equal_tables
+
+
+@pytest.mark.parametrize("rtol,atol", [(1e-5, 1e-8), (1e-6, 1e-9), (0.0, 0.1)])
+def test_build_unique_tables(rtol, atol):
+    rng = np.random.RandomState(1)
+    tables = [rng.uniform(-1.0, 1.0, (1, 1, 3, 4)).round(1) for i in range(200)]
+    tables += [np.zeros((1, 1, 3, 4)), np.ones((1, 1, 3, 4)), np.zeros((1, 2, 3, 4))]
+
+    # Perturb the tables within, close to and beyond the tolerances
+    for scale in (0.5, 0.99, 1.01, 2.0, 100.0):
+        tables += [t + scale * (atol + rtol * abs(t)) * rng.choice([-1.0, 1.0], t.shape) for t in tables[:50]]
+    rng.shuffle(tables)
+
+    unique, mapping = build_unique_tables(dict(enumerate(tables)), rtol=rtol, atol=atol)
+
+    # Each table is mapped to the first unique table equal to it
+    expected_unique = []
+    for k, t in enumerate(tables):
+        i = next((i for i, u in enumerate(expected_unique) if equal_tables(u, t, rtol=rtol, atol=atol)), None)
+        if i is None:
+            i = len(expected_unique)
+            expected_unique.append(t)
+        assert mapping[k] == i
+    assert len(unique) == len(expected_unique)
+    assert all(u is v for u, v in zip(unique, expected_unique))
+
+
+def test_tabulation_cache():
+    element = create_element(ufl.FiniteElement("Lagrange", ufl.triangle, 2))
+    points = np.array([[0.1, 0.2], [0.3, 0.4]])
+    cache = TabulationCache(maxsize=2)
+
+    # Tables of lower derivative orders are read from the cached tables
+    tables = cache.tabulate(element, 1, points)
+    assert cache.tabulate(element, 0, points.copy()) is tables
+    assert cache.info() == (1, 1, 2, 1)
+    for derivatives, table in element.tabulate(1, points).items():
+        assert np.array_equal(tables[derivatives], table)
+        assert not tables[derivatives].flags.writeable
+
+    # Higher derivative orders are tabulated again, and the least
+    # recently used tables are evicted
+    cache.tabulate(element, 2, points)
+    cache.tabulate(element, 0, points + 0.1)
+    cache.tabulate(element, 0, points + 0.2)
+    assert cache.info() == (1, 4, 2, 2)
+    cache.tabulate(element, 0, points)
+    assert cache.info().misses == 5
@@ -4,11 +4,21 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import asyncio
+import concurrent.futures
+import itertools
+import os
+import pathlib
+
 import cffi
 import numpy as np
 import pytest
 
 import ffcx.codegeneration.jit
+import ffcx.compiler
+import ffcx.parallel
+import ffcx.parameters
+import ffcx.telemetry
 import ufl
 
 
@@ -398,3 +408,599 @@ def test_conditional(mode):
 
     expected_result = np.ones(3, dtype=np_type)
     assert np.allclose(A2, expected_result)
+
+
+@pytest.mark.parametrize("num_compile_parts", [2, 3])
+def test_compile_parts(num_compile_parts):
+    cell = ufl.triangle
+    element = ufl.FiniteElement("Lagrange", cell, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+    L = ufl.conj(v) * ufl.dx
+    forms = [a, L]
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, num_compile_parts=num_compile_parts)
+
+    form0 = compiled_forms[0][0].create_cell_integral(-1)
+    form1 = compiled_forms[1][0].create_cell_integral(-1)
+
+    A = np.zeros((3, 3), dtype=np.float64)
+    b = np.zeros(3, dtype=np.float64)
+    w = np.array([], dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+
+    ffi = cffi.FFI()
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0], dtype=np.float64)
+    for form, tensor in ((form0, A), (form1, b)):
+        form.tabulate_tensor(
+            ffi.cast('double *', tensor.ctypes.data), ffi.cast('double *', w.ctypes.data),
+            ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+            ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL)
+
+    assert np.allclose(A, np.array([[1.0, -0.5, -0.5], [-0.5, 0.5, 0.0], [-0.5, 0.0, 0.5]]))
+    assert np.allclose(b, 1.0 / 6.0)
+
+
+def test_compile_parts_fallback(tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx, v * ufl.dx]
+
+    # Without a Unix-style compiler the parts are compiled as a single file
+    warnings = []
+    monkeypatch.setattr(ffcx.codegeneration.jit, "_parts_compiler", lambda verbose: None)
+    monkeypatch.setattr(ffcx.codegeneration.jit.logger, "warning", warnings.append)
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, num_compile_parts=3)
+    assert any("as a single file" in w for w in warnings)
+    assert not list(tmp_path.glob("*.part*.c"))
+
+    b = np.zeros(3, dtype=np.float64)
+    w = np.array([], dtype=np.float64)
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0], dtype=np.float64)
+    ffi = cffi.FFI()
+    compiled_forms[1].create_cell_integral(-1).tabulate_tensor(
+        ffi.cast('double *', b.ctypes.data), ffi.cast('double *', w.ctypes.data),
+        ffi.cast('double *', w.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+        ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL)
+    assert np.allclose(b, 1.0 / 6.0)
+
+
+def test_compile_forms_many():
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    form_lists = [[ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx], [ufl.inner(u, v) * ufl.dx, ufl.conj(v) * ufl.dx]]
+    results = ffcx.codegeneration.jit.compile_forms_many(form_lists, max_workers=2)
+
+    assert [len(compiled_forms) for compiled_forms, module in results] == [1, 2]
+    assert [compiled_forms[0].rank for compiled_forms, module in results] == [2, 2]
+    assert results[1][0][1].rank == 1
+
+    # Modules are shared with subsequent calls
+    assert ffcx.codegeneration.jit.compile_forms(form_lists[1])[1] is results[1][1]
+
+
+def test_acompile_forms():
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    # The module is built by another process, in the working directory of that process
+    cwd = os.getcwd()
+    compiled_forms, module = asyncio.run(ffcx.codegeneration.jit.acompile_forms(forms))
+    assert compiled_forms[0].rank == 2
+    assert os.getcwd() == cwd
+    assert isinstance(ffcx.codegeneration.jit._build_executor, concurrent.futures.ProcessPoolExecutor)
+
+
+def test_acompile_forms_relative_cache_dir(tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 3)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    # Workers of the shared pool may run in another working directory
+    monkeypatch.chdir(tmp_path)
+    compiled_forms, module = asyncio.run(ffcx.codegeneration.jit.acompile_forms(forms, cache_dir="cache"))
+    assert pathlib.Path(module.__file__).parent == tmp_path.joinpath("cache")
+    assert ffcx.telemetry.records()[-1]["cache"] == "module"
+
+
+def test_tiered_compile(tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, tiered=True)
+    assert ffcx.codegeneration.jit.module_tier(module) == "quick"
+    assert compiled_forms[0].rank == 2
+
+    # Once the optimised module is built, it is returned instead
+    assert ffcx.codegeneration.jit.wait_for_upgrades(timeout=60)
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, tiered=True)
+    assert ffcx.codegeneration.jit.module_tier(module) == "optimised"
+    assert module is ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)[1]
+
+    form = compiled_forms[0].create_cell_integral(-1)
+    A = np.zeros((3, 3), dtype=np.float64)
+    w = np.array([], dtype=np.float64)
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0], dtype=np.float64)
+    ffi = cffi.FFI()
+    form.tabulate_tensor(
+        ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+        ffi.cast('double *', w.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+        ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL)
+    assert np.allclose(A, np.array([[1.0, -0.5, -0.5], [-0.5, 0.5, 0.0], [-0.5, 0.0, 0.5]]))
+
+
+def test_tiered_compile_working_directory(tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u * v * ufl.dx]
+
+    # The optimised module is built by another process, so the working
+    # directory of this process, and relative cache directories, are
+    # unaffected while it is built
+    monkeypatch.chdir(tmp_path)
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, cache_dir="cache", tiered=True)
+    assert ffcx.codegeneration.jit.module_tier(module) == "quick"
+    for i in range(20):
+        assert os.getcwd() == str(tmp_path)
+        compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, cache_dir="cache", tiered=True)
+    assert ffcx.codegeneration.jit.wait_for_upgrades(timeout=60)
+    assert os.getcwd() == str(tmp_path)
+
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, cache_dir="cache", tiered=True)
+    assert ffcx.codegeneration.jit.module_tier(module) == "optimised"
+    assert pathlib.Path(module.__file__).parent == tmp_path.joinpath("cache")
+
+
+def test_tabulate_tensor_batch():
+    cell = ufl.triangle
+    element = ufl.FiniteElement("Lagrange", cell, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + f * ufl.inner(u, v) * ufl.dx,
+             f * ufl.conj(v) * ufl.dx, f * f * ufl.dx]
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"tabulate_tensor_batch": True})
+
+    num_cells = 5
+    np.random.seed(0)
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0]) + 0.2 * np.random.rand(num_cells, 6)
+    w = np.random.rand(num_cells, 3)
+    c = np.array([], dtype=np.float64)
+
+    ffi = cffi.FFI()
+    for compiled_form, shape in zip(compiled_forms, [(3, 3), (3, ), ()]):
+        integral = compiled_form.create_cell_integral(-1)
+        assert integral.tabulate_tensor_batch != ffi.NULL
+
+        # Tabulate each cell separately
+        A = np.zeros((num_cells, ) + shape)
+        for i in range(num_cells):
+            integral.tabulate_tensor(
+                ffi.cast('double *', A[i:i + 1].ctypes.data), ffi.cast('double *', w[i].ctypes.data),
+                ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords[i].ctypes.data),
+                ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL)
+
+        # Tabulate the batch, with the cell index innermost
+        A_batch = np.zeros(shape + (num_cells, ))
+        w_batch = np.ascontiguousarray(w.T)
+        coords_batch = np.ascontiguousarray(coords.T)
+        integral.tabulate_tensor_batch(
+            ffi.cast('double *', A_batch.ctypes.data), ffi.cast('double *', w_batch.ctypes.data),
+            ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords_batch.ctypes.data), num_cells)
+
+        assert np.allclose(np.moveaxis(A_batch, -1, 0), A)
+
+    # Batch kernels are only generated on request
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms[:1])
+    assert compiled_forms[0].create_cell_integral(-1).tabulate_tensor_batch == ffi.NULL
+
+
+@pytest.mark.parametrize("mode", ["double", "double complex"])
+def test_vectorize(mode):
+    cell = ufl.tetrahedron
+    element = ufl.VectorElement("Lagrange", cell, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(ufl.FiniteElement("Lagrange", cell, 2))
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + f * ufl.inner(u, v) * ufl.dx,
+             f * ufl.conj(v[0]) * ufl.dx]
+
+    c_type, np_type = float_to_type(mode)
+    np.random.seed(0)
+    coords = np.array([0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]) + 0.2 * np.random.rand(12)
+    w = np.array(np.random.rand(10), dtype=np_type)
+    c = np.array([], dtype=np_type)
+
+    ffi = cffi.FFI()
+    results = []
+    for vectorize in (False, True):
+        compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+            forms, parameters={"scalar_type": mode, "vectorize": vectorize},
+            cffi_extra_compile_args=["-fopenmp-simd"])
+        tensors = [np.zeros((30, 30), dtype=np_type), np.zeros(30, dtype=np_type)]
+        for compiled_form, A in zip(compiled_forms, tensors):
+            compiled_form.create_cell_integral(-1).tabulate_tensor(
+                ffi.cast('{} *'.format(c_type), A.ctypes.data), ffi.cast('{} *'.format(c_type), w.ctypes.data),
+                ffi.cast('{} *'.format(c_type), c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+                ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL)
+        results.append(tensors)
+
+    for A, A_vectorized in zip(*results):
+        assert np.allclose(A, A_vectorized)
+
+
+@pytest.mark.parametrize("cell,degree,coords", [
+    (ufl.quadrilateral, 3, [0.0, 0.0, 1.2, 0.1, 0.1, 1.0, 1.3, 1.4]),
+    (ufl.hexahedron, 2, [[x + 0.1 * y, y + 0.05 * z, 0.9 * z + 0.1 * x]
+                         for x in (0.0, 1.0) for y in (0.0, 1.0) for z in (0.0, 1.0)]),
+])
+def test_tensor_factorization(cell, degree, coords):
+    element = ufl.FiniteElement("Q", cell, degree)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    forms = [f * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u * v * ufl.dx,
+             f * f * v * ufl.dx + ufl.inner(ufl.grad(f), ufl.grad(v)) * ufl.dx]
+
+    # The tables of Q elements in Gauss-Jacobi points factorize
+    header, source = ffcx.compiler.compile_ufl_objects(forms, prefix="factorized",
+                                                       parameters=ffcx.parameters.default_parameters())
+    assert "UFLACS block mode: factorized" in source
+    assert "Sum factorized evaluation of coefficients" in source
+
+    num_dofs = (degree + 1)**cell.topological_dimension()
+    np.random.seed(0)
+    coords = np.array(coords, dtype=np.float64).flatten()
+    w = np.random.rand(num_dofs)
+    c = np.array([], dtype=np.float64)
+
+    ffi = cffi.FFI()
+    results = []
+    for factorize in (False, True):
+        compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+            forms, parameters={"enable_tensor_factorization": factorize})
+        tensors = [np.zeros((num_dofs, num_dofs)), np.zeros(num_dofs)]
+        for compiled_form, A in zip(compiled_forms, tensors):
+            compiled_form.create_cell_integral(-1).tabulate_tensor(
+                ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+                ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+                ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL)
+        results.append(tensors)
+
+    for A, A_factorized in zip(*results):
+        assert np.allclose(A, A_factorized)
+
+
+@pytest.mark.parametrize("representation", ["tensor", "adaptive"])
+def test_tensor_representation(representation):
+    P1 = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    P2 = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(P2), ufl.TestFunction(P2)
+    f = ufl.Coefficient(P1)
+    forms = [f * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + (f * f + 2.0) * u * v * ufl.dx,
+             f * v * ufl.dx + ufl.inner(ufl.grad(f), ufl.grad(v)) * ufl.dx]
+
+    # Affine simplex forms with polynomial coefficients are precomputed
+    # as reference tensors
+    parameters = ffcx.parameters.default_parameters()
+    parameters["representation"] = representation
+    header, source = ffcx.compiler.compile_ufl_objects(forms, prefix="tensor", parameters=parameters)
+    assert "UFLACS block mode: tensor" in source
+
+    # The tensor representation is only used when asked for
+    header, source = ffcx.compiler.compile_ufl_objects(forms, prefix="tensor",
+                                                       parameters=ffcx.parameters.default_parameters())
+    assert "UFLACS block mode: tensor" not in source
+
+    np.random.seed(0)
+    coords = np.array([0.1, 0.0, 1.2, 0.1, 0.3, 0.9], dtype=np.float64)
+    w = np.random.rand(3)
+    c = np.array([], dtype=np.float64)
+
+    ffi = cffi.FFI()
+    results = []
+    for r in ("uflacs", representation):
+        compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, parameters={"representation": r})
+        tensors = [np.zeros((6, 6)), np.zeros(6)]
+        for compiled_form, A in zip(compiled_forms, tensors):
+            compiled_form.create_cell_integral(-1).tabulate_tensor(
+                ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+                ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+                ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL)
+        results.append(tensors)
+
+    for A, A_tensor in zip(*results):
+        assert np.allclose(A, A_tensor)
+
+
+def test_tabulate_action():
+    P1 = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    P2 = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    V = ufl.VectorElement("Lagrange", ufl.triangle, 2)
+    f = ufl.Coefficient(P1)
+    u, v = ufl.TrialFunction(P2), ufl.TestFunction(P1)
+    forms = [f * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + (f * f + 2.0) * u * v * ufl.dx,
+             ufl.inner(ufl.grad(ufl.TrialFunction(V)), ufl.grad(ufl.TestFunction(V))) * ufl.dx,
+             f * v * ufl.dx]
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, parameters={"tabulate_action": True})
+
+    np.random.seed(0)
+    coords = np.array([0.1, 0.0, 1.2, 0.1, 0.3, 0.9], dtype=np.float64)
+    w = np.random.rand(3)
+    c = np.array([], dtype=np.float64)
+
+    ffi = cffi.FFI()
+    for compiled_form, shape in zip(compiled_forms[:2], [(3, 6), (12, 12)]):
+        integral = compiled_form.create_cell_integral(-1)
+        args = [ffi.cast('double *', w.ctypes.data), ffi.cast('double *', c.ctypes.data),
+                ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL]
+
+        A = np.zeros(shape)
+        integral.tabulate_tensor(ffi.cast('double *', A.ctypes.data), *args)
+
+        # The action kernel computes A x without the element matrix
+        x = np.random.rand(shape[1])
+        y = np.zeros(shape[0])
+        integral.tabulate_action(ffi.cast('double *', y.ctypes.data), ffi.cast('double *', x.ctypes.data), *args)
+        assert np.allclose(y, A @ x)
+
+    # Action kernels are only generated for bilinear forms
+    assert compiled_forms[2].create_cell_integral(-1).tabulate_action == ffi.NULL
+
+
+@pytest.mark.parametrize("representation", ["uflacs", "tensor"])
+def test_tabulate_diagonal(representation):
+    P1 = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    P2 = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    TH = ufl.MixedElement([ufl.VectorElement("Lagrange", ufl.triangle, 2), P1])
+    f = ufl.Coefficient(P1)
+    u, v = ufl.TrialFunction(P2), ufl.TestFunction(P2)
+    (w, p), (z, q) = ufl.TrialFunctions(TH), ufl.TestFunctions(TH)
+    forms = [ufl.inner(ufl.grad(ufl.TrialFunction(P1)), ufl.grad(ufl.TestFunction(P1))) * ufl.dx,
+             f * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u * v * ufl.dx,
+             (ufl.inner(ufl.grad(w), ufl.grad(z)) - ufl.div(z) * p - q * ufl.div(w) + f * p * q) * ufl.dx]
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"tabulate_diagonal": True, "representation": representation})
+
+    np.random.seed(0)
+    coords = np.array([0.1, 0.0, 1.2, 0.1, 0.3, 0.9], dtype=np.float64)
+    w = np.random.rand(3)
+    c = np.array([], dtype=np.float64)
+
+    ffi = cffi.FFI()
+    for compiled_form, n in zip(compiled_forms, [3, 6, 15]):
+        integral = compiled_form.create_cell_integral(-1)
+        args = [ffi.cast('double *', w.ctypes.data), ffi.cast('double *', c.ctypes.data),
+                ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL]
+
+        A = np.zeros((n, n))
+        integral.tabulate_tensor(ffi.cast('double *', A.ctypes.data), *args)
+        d = np.zeros(n)
+        integral.tabulate_diagonal(ffi.cast('double *', d.ctypes.data), *args)
+        assert np.allclose(d, np.diag(A))
+
+
+@pytest.mark.parametrize("representation", ["uflacs", "tensor"])
+def test_symmetric_blocks(representation):
+    P1 = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    P2 = ufl.VectorElement("Lagrange", ufl.triangle, 2)
+    f = ufl.Coefficient(P1)
+    u, v = ufl.TrialFunction(P2), ufl.TestFunction(P2)
+    forms = [(f * ufl.inner(ufl.sym(ufl.grad(u)), ufl.sym(ufl.grad(v))) + ufl.div(u) * ufl.div(v)) * ufl.dx,
+             f * ufl.inner(u, v) * ufl.dx + ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx,
+             ufl.inner(ufl.grad(u)[:, 0], v) * ufl.dx]
+
+    np.random.seed(0)
+    coords = np.array([0.1, 0.0, 1.2, 0.1, 0.3, 0.9], dtype=np.float64)
+    w = np.random.rand(3)
+    c = np.array([], dtype=np.float64)
+    ffi = cffi.FFI()
+    args = [ffi.cast('double *', w.ctypes.data), ffi.cast('double *', c.ctypes.data),
+            ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL]
+
+    tensors = []
+    for enable_symmetric_blocks in (False, True):
+        compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+            forms, parameters={"enable_symmetric_blocks": enable_symmetric_blocks, "tabulate_packed": True,
+                               "representation": representation})
+        tensors.append([])
+        for compiled_form in compiled_forms:
+            integral = compiled_form.create_cell_integral(-1)
+            A = np.zeros((12, 12))
+            integral.tabulate_tensor(ffi.cast('double *', A.ctypes.data), *args)
+            tensors[-1].append(A)
+
+            # Only symmetric element matrices are tabulated packed
+            if enable_symmetric_blocks and compiled_form is not compiled_forms[2]:
+                P = np.zeros(12 * 13 // 2)
+                integral.tabulate_tensor_packed(ffi.cast('double *', P.ctypes.data), *args)
+                assert np.allclose(P, A[np.triu_indices(12)])
+            else:
+                assert integral.tabulate_tensor_packed == ffi.NULL
+
+    for A0, A1 in zip(*tensors):
+        assert np.allclose(A1, A0)
+
+
+@pytest.mark.parametrize("representation", ["uflacs", "tensor"])
+def test_tabulate_compact(representation):
+    P1 = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    P2 = ufl.VectorElement("Lagrange", ufl.triangle, 2)
+    f = ufl.Coefficient(P1)
+    (u, p), (v, q) = ufl.TrialFunctions(P2 * P1), ufl.TestFunctions(P2 * P1)
+    w, z = ufl.TrialFunction(P2), ufl.TestFunction(P2)
+    forms = [(f * ufl.inner(ufl.grad(u), ufl.grad(v)) - ufl.div(v) * p - q * ufl.div(u)) * ufl.dx,
+             ufl.inner(ufl.grad(w), ufl.grad(z)) * ufl.dx,
+             f * ufl.inner(w, z) * ufl.dx + w[0] * z[1] * ufl.dx]
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"tabulate_compact": True, "representation": representation})
+
+    np.random.seed(0)
+    coords = np.array([0.1, 0.0, 1.2, 0.1, 0.3, 0.9], dtype=np.float64)
+    w = np.random.rand(3)
+    c = np.array([], dtype=np.float64)
+    ffi = cffi.FFI()
+    args = [ffi.cast('double *', w.ctypes.data), ffi.cast('double *', c.ctypes.data),
+            ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL]
+
+    # Velocity and pressure blocks, and blocks of the components of the
+    # velocity
+    offsets = [[0, 12, 15], [0, 6, 12], [0, 6, 12]]
+    expected_blocks = [[(0, 0), (0, 1), (1, 0)], [(0, 0), (1, 1)], [(0, 0), (1, 0), (1, 1)]]
+    for compiled_form, o, blocks in zip(compiled_forms, offsets, expected_blocks):
+        integral = compiled_form.create_cell_integral(-1)
+        assert integral.num_nonzero_blocks == len(blocks)
+        assert [tuple(integral.nonzero_blocks[2 * k:2 * k + 2]) for k in range(len(blocks))] == blocks
+
+        n = o[-1]
+        A = np.zeros((n, n))
+        integral.tabulate_tensor(ffi.cast('double *', A.ctypes.data), *args)
+        C = np.zeros(integral.compact_size)
+        integral.tabulate_tensor_compact(ffi.cast('double *', C.ctypes.data), *args)
+        assert np.allclose(C, np.concatenate([A[o[i]:o[i + 1], o[j]:o[j + 1]].flatten() for i, j in blocks]))
+
+        # Zero blocks
+        for i, j in set(itertools.product(range(2), repeat=2)) - set(blocks):
+            assert np.allclose(A[o[i]:o[i + 1], o[j]:o[j + 1]], 0.0)
+
+
+def test_tabulate_geometry():
+    mesh = ufl.Mesh(ufl.VectorElement("Lagrange", ufl.triangle, 2))
+    V = ufl.FunctionSpace(mesh, ufl.FiniteElement("Lagrange", ufl.triangle, 2))
+    f = ufl.Coefficient(V)
+    u, v = ufl.TrialFunction(V), ufl.TestFunction(V)
+    x = ufl.SpatialCoordinate(mesh)
+    forms = [(f * ufl.inner(ufl.grad(u), ufl.grad(v)) + x[0] * u * v) * ufl.dx,
+             f * v * ufl.dx]
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"tabulate_geometry": True})
+
+    # Curved triangle, with the vertices followed by the edge midpoints
+    np.random.seed(0)
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0, 0.5, 0.5, 0.0, 0.5, 0.5, 0.0], dtype=np.float64)
+    coords += 0.1 * np.random.rand(12)
+    w = np.random.rand(6)
+    c = np.array([], dtype=np.float64)
+
+    ffi = cffi.FFI()
+    for compiled_form, shape in zip(compiled_forms, [(6, 6), (6, )]):
+        integral = compiled_form.create_cell_integral(-1)
+        args = [ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL]
+
+        A = np.zeros(shape)
+        integral.tabulate_tensor(ffi.cast('double *', A.ctypes.data), ffi.cast('double *', w.ctypes.data),
+                                 ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data), *args)
+
+        # J, detJ and K at all points
+        geometry = np.zeros(integral.geometry_size)
+        integral.tabulate_geometry(ffi.cast('double *', geometry.ctypes.data), ffi.cast('double *', coords.ctypes.data))
+        J = geometry[:4 * geometry.size // 9].reshape(2, 2, -1)
+        detJ = geometry[4 * geometry.size // 9:5 * geometry.size // 9]
+        assert np.allclose(detJ, J[0, 0] * J[1, 1] - J[0, 1] * J[1, 0])
+
+        B = np.zeros(shape)
+        integral.tabulate_tensor_geometry(ffi.cast('double *', B.ctypes.data), ffi.cast('double *', w.ctypes.data),
+                                          ffi.cast('double *', c.ctypes.data),
+                                          ffi.cast('double *', coords.ctypes.data),
+                                          ffi.cast('double *', geometry.ctypes.data), *args)
+        assert np.allclose(B, A)
+
+
+def test_tabulate_fused():
+    mesh = ufl.Mesh(ufl.VectorElement("Lagrange", ufl.triangle, 2))
+    V = ufl.FunctionSpace(mesh, ufl.FiniteElement("Lagrange", ufl.triangle, 2))
+    f = ufl.Coefficient(V)
+    g = ufl.Coefficient(ufl.FunctionSpace(mesh, ufl.FiniteElement("Lagrange", ufl.triangle, 1)))
+    u, v = ufl.TrialFunction(V), ufl.TestFunction(V)
+    x = ufl.SpatialCoordinate(mesh)
+    forms = [(f * ufl.inner(ufl.grad(u), ufl.grad(v)) + x[0] * u * v) * ufl.dx,
+             (f * g * v + x[0] * v) * ufl.dx]
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"tabulate_fused": True})
+
+    fused = compiled_forms[0].create_fused_cell_integral(-1)
+    assert fused.num_forms == 2
+    assert compiled_forms[1].create_fused_cell_integral(-1).tabulate_tensor == fused.tabulate_tensor
+
+    # Curved triangle, with the vertices followed by the edge midpoints
+    np.random.seed(0)
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0, 0.5, 0.5, 0.0, 0.5, 0.5, 0.0], dtype=np.float64)
+    coords += 0.1 * np.random.rand(12)
+    w0 = np.random.rand(6)
+    w1 = np.concatenate([w0, np.random.rand(3)])
+    c = np.array([], dtype=np.float64)
+
+    ffi = cffi.FFI()
+    As = [np.zeros((6, 6)), np.zeros(6)]
+    fused.tabulate_tensor(ffi.new("double *[2]", [ffi.cast('double *', A.ctypes.data) for A in As]),
+                          ffi.new("double *[2]", [ffi.cast('double *', w.ctypes.data) for w in (w0, w1)]),
+                          ffi.new("double *[2]", [ffi.cast('double *', c.ctypes.data)] * 2),
+                          ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL)
+
+    for compiled_form, w, A in zip(compiled_forms, (w0, w1), As):
+        integral = compiled_form.create_cell_integral(-1)
+        B = np.zeros(A.shape)
+        integral.tabulate_tensor(ffi.cast('double *', B.ctypes.data), ffi.cast('double *', w.ctypes.data),
+                                 ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+                                 ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL)
+        assert np.allclose(A, B)
+
+
+@pytest.mark.parametrize("representation", ["uflacs", "tensor"])
+def test_parallel_ir(representation):
+    P2 = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    V = ufl.VectorElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(V), ufl.TestFunction(V)
+    f, g = ufl.Coefficient(P2), ufl.Coefficient(V)
+    forms = [sum((f + k) * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx(k) for k in range(4)),
+             sum(ufl.inner(g, v) * f**k * ufl.dx(k) for k in range(3))]
+
+    # The integrals computed by worker processes give the same code
+    # and telemetry of each integral
+    codes = []
+    for workers in (0, 3):
+        parameters = ffcx.parameters.default_parameters()
+        parameters["representation"] = representation
+        parameters["ir_workers"] = workers
+        with ffcx.telemetry.collect({}) as record:
+            codes.append(ffcx.compiler.compile_ufl_objects(forms, prefix="parallel", parameters=parameters))
+        assert len(record["integrals"]) == 7
+        assert all(r["ir"] > 0.0 for r in record["integrals"].values())
+    assert codes[0] == codes[1]
+
+
+def test_parallel_small_jobs_serial(monkeypatch):
+    def process_pool(workers):
+        raise AssertionError("pool started for {} workers".format(workers))
+
+    monkeypatch.setattr(ffcx.parallel, "process_pool", process_pool)
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+
+    # Fewer integrals or IR objects than workers are computed in this process
+    parameters = ffcx.parameters.default_parameters()
+    parameters["ir_workers"] = 4
+    parameters["codegen_workers"] = 32
+    ffcx.compiler.compile_ufl_objects([u * v * ufl.dx + ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx(1)],
+                                      prefix="small", parameters=parameters)
+
+
+def test_parallel_codegen():
+    P1 = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    RT = ufl.FiniteElement("RT", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(P1), ufl.TestFunction(P1)
+    f, g = ufl.Coefficient(P1), ufl.Coefficient(RT)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + f * u * v * ufl.dx(1), ufl.div(g) * v * ufl.dx]
+
+    # The code generated by worker processes is the same, in the same order
+    codes = []
+    for workers in (0, 2):
+        parameters = ffcx.parameters.default_parameters()
+        parameters["codegen_workers"] = workers
+        parameters["tabulate_fused"] = True
+        with ffcx.telemetry.collect({}) as record:
+            codes.append(ffcx.compiler.compile_ufl_objects(forms, prefix="parallel", parameters=parameters))
+        assert len(record["integrals"]) == 3
+        assert all(r["codegen"] > 0.0 and r["source_size"] > 0 for r in record["integrals"].values())
+    assert codes[0] == codes[1]
+    assert "// This code was generated with the following parameters" in codes[0][0]
+    assert "codegen_workers" not in codes[0][0]